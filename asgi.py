@@ -0,0 +1,220 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs
+
+from cache import ResultCache, get_timetable_key
+from metrics import timed, render_metrics, configure_logging, REQUESTS, UNMATCHED
+from placement import get_placement_args
+from recurrence import InvalidRule
+from reservation import process_reservation_request, process_batch_reservation_request, get_optimization_changes, \
+    apply_changes, PLACEMENT_ORDERS, OPTIMIZATION_STRATEGIES
+
+OPTIMIZE_WORKERS = int(os.environ.get('OPTIMIZE_WORKERS', os.cpu_count() or 1))
+OPTIMIZE_QUEUE = int(os.environ.get('OPTIMIZE_QUEUE', 2 * OPTIMIZE_WORKERS))
+configure_logging()
+
+
+class Busy(Exception):
+    """Raised when there are too many optimizations waiting for a worker process"""
+
+
+class OptimizePool:
+    """Runs CPU heavy functions in worker processes, so that they do not block the event loop. At most `workers` of
+    them run at once and at most `queue_size` more wait for a free process, further ones are refused right away. When
+    a worker dies, the calls running at that moment raise BrokenProcessPool and the next call starts a new pool"""
+
+    def __init__(self, workers=OPTIMIZE_WORKERS, queue_size=OPTIMIZE_QUEUE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = None
+        self.pending = 0
+
+    async def run(self, function, *args):
+        if self.pending >= self.workers + self.queue_size:
+            raise Busy()
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.workers)
+        executor = self.executor
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, function, *args)
+        except BrokenProcessPool:
+            if self.executor is executor:
+                executor.shutdown(wait=False)
+                self.executor = None
+            raise
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+pool = OptimizePool()
+optimize_cache = ResultCache(int(os.environ.get('OPTIMIZE_CACHE_SIZE', 128)),
+                             float(os.environ.get('OPTIMIZE_CACHE_TTL', 300)))
+
+
+class InvalidJSON(ValueError):
+    """Raised when the request body is not JSON"""
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body', False):
+            return b''.join(chunks)
+
+
+def load_json(body):
+    with timed('parse'):
+        try:
+            return json.loads(body)
+        except ValueError:
+            raise InvalidJSON("invalid JSON")
+
+
+def dump_json(data):
+    with timed('encode'):
+        return json.dumps(data).encode('utf-8')
+
+
+async def in_thread(function, *args):
+    """Run a function in a thread, for the work whose time grows with the size of the timetable but does not need a
+    worker process. The event loop is free to handle other requests meanwhile"""
+    return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+
+async def send_response(send, status, data, headers=(), content_type=b'text/html; charset=utf-8'):
+    if isinstance(data, str):
+        body = data.encode('utf-8')
+    elif isinstance(data, bytes):  # JSON encoded outside the event loop
+        body, content_type = data, b'application/json'
+    else:
+        body, content_type = dump_json(data), b'application/json'
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b'content-type', content_type), (b'content-length', str(len(body)).encode())]
+                + list(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def reserve(body, args):
+    try:
+        placement, weights = get_placement_args(args)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    # cheap, handled right in the event loop
+    return 200, process_reservation_request(load_json(body), placement, weights)
+
+
+def reserve_batch_json(body, order, placement, weights):
+    """Parse a batch, place its requests and encode the result, all of it in a worker process"""
+    return dump_json(process_batch_reservation_request(load_json(body), order, placement, weights))
+
+
+def load_timetable(body, strategy):
+    """Parse a timetable and return it with the key of its optimization in the cache"""
+    data = load_json(body)
+    return data, get_timetable_key(data['winstrom']['udalost'], strategy)
+
+
+def apply_changes_json(data, changes, diff):
+    with timed('serialize'):
+        result = apply_changes(data, changes, diff)
+    return dump_json(result)
+
+
+async def reserve_batch(body, args):
+    order = args.get('order', 'earliest_start')
+    if order not in PLACEMENT_ORDERS:
+        return 400, {"error": "unknown order " + order}
+    try:
+        placement, weights = get_placement_args(args)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    # a batch may have hundreds of requests, it would hold up the single reservations in the event loop
+    with timed('search'):
+        return 200, await pool.run(reserve_batch_json, body, order, placement, weights)
+
+
+async def optimize_timetable(body, args):
+    strategy = args.get('strategy', 'best_fit')
+    if strategy not in OPTIMIZATION_STRATEGIES:
+        return 400, {"error": "unknown strategy " + strategy}
+    # a large timetable takes a while to parse, hash and encode, it would hold up the reservations in the event loop
+    data, key = await in_thread(load_timetable, body, strategy)
+    changes = optimize_cache.get(key)
+    if changes is None:
+        with timed('optimize'):  # build and optimize in a worker process, their own times stay there
+            changes = await pool.run(get_optimization_changes, data, strategy)
+        optimize_cache.put(key, changes)
+    return 200, await in_thread(apply_changes_json, data, changes, args.get('format') == 'diff')
+
+
+async def optimize_cache_stats(args):
+    return 200, optimize_cache.stats()
+
+
+ROUTES = {
+    '/reserve/': reserve,
+    '/reserve/batch/': reserve_batch,
+    '/optimize/': optimize_timetable,
+}
+GET_ROUTES = {
+    '/optimize/cache/': optimize_cache_stats,
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({"type": "lifespan.startup.complete"})
+        elif message['type'] == 'lifespan.shutdown':
+            pool.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application with the same /reserve/ and /optimize/ endpoints as server.py. Reservations are handled in the
+    event loop, optimizations and batches of reservations go to a pool of worker processes (sized by OPTIMIZE_WORKERS
+    and OPTIMIZE_QUEUE), so a long optimization does not hold up reservations. Run for example with: uvicorn asgi:app"""
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path']
+    REQUESTS.inc(label_value=path if path in ROUTES or path in GET_ROUTES or path == '/metrics' else UNMATCHED)
+    if scope['method'] == 'GET' and scope['path'] == '/metrics':
+        return await send_response(send, 200, render_metrics(), content_type=b'text/plain; version=0.0.4')
+    args = {key: values[-1] for key, values in parse_qs(scope['query_string'].decode('latin-1')).items()}
+    if scope['method'] == 'GET' and scope['path'] in GET_ROUTES:
+        status, result = await GET_ROUTES[scope['path']](args)
+        return await send_response(send, status, result)
+
+    handler = ROUTES.get(scope['path'])
+    if handler is None:
+        return await send_response(send, 404, {"error": "not found"})
+    if scope['method'] != 'POST':
+        return await send_response(send, 200, "post_json called without POST")
+
+    body = await read_body(receive)
+    try:
+        status, result = await handler(body, args)
+    except Busy:
+        return await send_response(send, 503, {"error": "too many optimizations running"}, [(b'retry-after', b'1')])
+    except BrokenProcessPool:
+        return await send_response(send, 503, {"error": "worker process has crashed, try again"},
+                                   [(b'retry-after', b'1')])
+    except (InvalidJSON, InvalidRule) as e:
+        return await send_response(send, 400, {"error": str(e)})
+    await send_response(send, status, result)
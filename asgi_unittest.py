@@ -0,0 +1,90 @@
+import asyncio
+import copy
+import json
+import os
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+import asgi
+from reservation import optimize
+from reservation_unittest import test_data, optimal_space_data
+
+
+async def call(path, data=None, method='POST', query_string=b'', body=None, chunk_size=None):
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string}
+    messages = []
+    body = json.dumps(data).encode('utf-8') if body is None else body
+    chunks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)] if chunk_size else [body]
+
+    async def receive():
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    async def send(message):
+        messages.append(message)
+
+    await asgi.app(scope, receive, send)
+    body = messages[1]['body'].decode('utf-8')
+    return messages[0]['status'], json.loads(body) if body.startswith(('{', '[')) else body
+
+
+class AsgiTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        asgi.pool = asgi.OptimizePool(workers=1, queue_size=0)
+        asgi.optimize_cache.clear()
+
+    def tearDown(self):
+        asgi.pool.shutdown()
+
+    async def test_reserve(self):
+        self.assertEqual((200, optimal_space_data), await call('/reserve/', test_data))
+        self.assertEqual((200, "post_json called without POST"), await call('/reserve/', method='GET'))
+        self.assertEqual(404, (await call('/unknown/', test_data))[0])
+        self.assertEqual(400, (await call('/reserve/', test_data, query_string=b'placement=unknown'))[0])
+        self.assertEqual(400, (await call('/reserve/batch/', test_data, query_string=b'weights=size:1'))[0])
+        self.assertEqual(200, (await call('/reserve/', test_data, query_string=b'placement=worst_fit'))[0])
+
+    async def test_optimize(self):
+        self.assertEqual((200, optimize(test_data)), await call('/optimize/', test_data))
+        self.assertEqual(400, (await call('/optimize/', test_data, query_string=b'strategy=unknown'))[0])
+        self.assertEqual((200, optimize(test_data)), await call('/optimize/', test_data))
+        self.assertEqual(1, (await call('/optimize/cache/', method='GET'))[1]['hits'])
+
+    async def test_body(self):
+        self.assertEqual((200, optimize(test_data)), await call('/optimize/', test_data, chunk_size=100))
+        for path in ('/reserve/', '/reserve/batch/', '/optimize/'):
+            self.assertEqual((400, {"error": "invalid JSON"}), await call(path, body=b'{"winstrom":'))
+
+    async def test_invalid_rule(self):
+        data = copy.deepcopy(test_data)
+        data['winstrom']['udalost'][0]['rrule'] = "FREQ=MONTHLY"
+        for path in ('/reserve/', '/reserve/batch/'):
+            status, body = await call(path, data)
+            self.assertEqual(400, status)
+            self.assertIn("unknown frequency monthly", body['error'])
+        data['winstrom']['udalost'][0]['predmet'] = "101"
+        # optimization reads the rules of the placed bookings only
+        self.assertEqual(400, (await call('/optimize/', data))[0])
+
+    async def test_metrics(self):
+        await call('/reserve/', test_data)
+        await call('/nope"x', test_data)
+        status, body = await call('/metrics', method='GET')
+        self.assertEqual(200, status)
+        self.assertIn('reservation_requests_total{path="/reserve/"}', body)
+        self.assertIn('reservation_requests_total{path="unmatched"}', body)
+        self.assertNotIn('nope', body)
+        self.assertIn('reservation_stage_seconds_count{stage="search"}', body)
+
+    async def test_crashed_worker(self):
+        with self.assertRaises(BrokenProcessPool):
+            await asgi.pool.run(os._exit, 1)
+        self.assertEqual((200, optimize(test_data)), await call('/optimize/', test_data))
+
+    async def test_back_pressure(self):
+        responses = await asyncio.gather(call('/optimize/', test_data), call('/optimize/', test_data),
+                                         call('/reserve/', test_data))
+        self.assertEqual([200, 503, 200], [status for status, _ in responses])
+
+
+if __name__ == '__main__':
+    unittest.main()
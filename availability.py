@@ -0,0 +1,109 @@
+from bisect import bisect_right
+
+NEGATIVE_INFINITY = float('-inf')
+INFINITY = float('inf')
+# recurring bookings are expanded this far after the time an earliest fit is looked for, then twice as far and so on
+EARLIEST_HORIZON = 7 * 24 * 60
+MAX_HORIZON = 366 * 24 * 60
+
+
+class FreeIntervals:
+    """Free intervals of a parking spot, the complement of its reservations: before the first reservation, between
+    every two neighbouring ones and after the last one. Lengths of the intervals are kept in a max segment tree, so the
+    first interval of a given length is found in O(log n)"""
+
+    def __init__(self, parking_spot):
+        self.starts = [NEGATIVE_INFINITY] + list(parking_spot.ends)
+        self.ends = list(parking_spot.starts) + [INFINITY]
+        self.size = 1
+        while self.size < len(self.starts):
+            self.size *= 2
+        # leaves are the lengths of the intervals, every inner node is the maximum of its two children
+        self.tree = [-1] * (2 * self.size)
+        for idx, (start, end) in enumerate(zip(self.starts, self.ends)):
+            self.tree[self.size + idx] = end - start
+        for idx in range(self.size - 1, 0, -1):
+            self.tree[idx] = max(self.tree[2 * idx], self.tree[2 * idx + 1])
+
+    def find_first(self, first, duration):
+        """Return the index of the first interval from a given one on that is at least duration long, None if there
+        is none"""
+        if first >= self.size:
+            return None
+        idx = self.size + first
+        if self.tree[idx] < duration:
+            # go up until the right sibling has a long enough interval in it
+            while idx & 1 or self.tree[idx + 1] < duration:
+                idx >>= 1
+                if idx <= 1:
+                    return None
+            idx += 1
+            while idx < self.size:
+                idx = 2 * idx if self.tree[2 * idx] >= duration else 2 * idx + 1
+        return idx - self.size
+
+    def get_earliest_fit(self, after, duration):
+        """Return the earliest start of a free interval of a given length that does not begin before after"""
+        idx = bisect_right(self.ends, after)
+        start = max(self.starts[idx], after)
+        if self.ends[idx] - start >= duration:
+            return start
+        return self.starts[self.find_first(idx + 1, duration)]
+
+    def get_intervals(self, start, end, limit=None):
+        """Return free intervals that overlap [start, end) cut to it, at most limit of them. Second value is True
+        if there are more"""
+        intervals = []
+        idx = bisect_right(self.ends, start)
+        while idx < len(self.starts) and self.starts[idx] < end:
+            if self.ends[idx] > self.starts[idx]:  # skip reservations that follow each other without any gap
+                if limit is not None and len(intervals) == limit:
+                    return intervals, True
+                intervals.append((max(self.starts[idx], start), min(self.ends[idx], end)))
+            idx += 1
+        return intervals, False
+
+
+class Availability:
+    """Read-only availability queries on a timetable. Free intervals of every parking spot are computed when they are
+    first needed and again only after the reservations of the spot have changed, so a booking makes only its own spot
+    out of date. The index is not updated on an add or remove: the next query of the changed spot rebuilds it in O(n)
+    of its reservations, while the queries themselves take O(log n). Not thread safe, the caller has to hold the lock
+    of the timetable"""
+
+    def __init__(self):
+        self.indexes = {}
+
+    def get_free_intervals(self, parking_spot):
+        entry = self.indexes.get(parking_spot.name)
+        if entry is None or entry[0] is not parking_spot or entry[1] != parking_spot.changes:
+            entry = self.indexes[parking_spot.name] = (parking_spot, parking_spot.changes, FreeIntervals(parking_spot))
+        return entry[2]
+
+    def get_free_spots(self, timetable, start, end):
+        """Return the reservable parking spots that are free for the whole interval [start, end)"""
+        timetable.expand_rules(start, end)
+        return [parking_spot for parking_spot in timetable.parking_spots
+                if parking_spot.is_reservable and parking_spot.fits(start, end)]
+
+    def get_earliest_fits(self, timetable, after, duration, limit=None):
+        """Return (start, parking spot) of the earliest free interval of a given length on every reservable spot,
+        earliest first, at most limit of them. Recurring bookings are expanded until the returned fits are within the
+        expanded window, an occurrence after it can only make a fit later"""
+        horizon = EARLIEST_HORIZON
+        while True:
+            timetable.expand_rules(after, after + horizon + duration)
+            fits = []
+            for idx, parking_spot in enumerate(timetable.parking_spots):
+                if parking_spot.is_reservable:
+                    fits.append((self.get_free_intervals(parking_spot).get_earliest_fit(after, duration), idx))
+            fits.sort()
+            fits = fits[:limit]
+            if not timetable.rules or horizon >= MAX_HORIZON or all(start <= after + horizon for start, _ in fits):
+                return [(start, timetable.parking_spots[idx]) for start, idx in fits]
+            horizon *= 2
+
+    def get_intervals(self, parking_spot, start, end, limit=None):
+        """Return free intervals of a parking spot within [start, end), at most limit of them. Second value is True if
+        there are more, the next page begins at the end of the last interval"""
+        return self.get_free_intervals(parking_spot).get_intervals(start, end, limit)
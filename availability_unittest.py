@@ -0,0 +1,70 @@
+import random
+import unittest
+from availability import Availability, FreeIntervals
+from reservation import ParkingSpot, Timetable
+from reservation_unittest import make_slot, make_random_timetable
+
+
+def get_earliest_fit(parking_spot, after, duration):
+    """Earliest fit found by trying every free interval"""
+    for start in [after] + list(parking_spot.ends):
+        if start >= after and parking_spot.fits(start, start + duration):
+            return start
+
+
+class FreeIntervalsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.parking_spot = ParkingSpot("101", True)
+        for slot in (make_slot("1", 8, 10), make_slot("2", 10, 11), make_slot("3", 12, 13), make_slot("4", 16, 17)):
+            self.parking_spot.add_reservation(slot)
+
+    def test_intervals(self):
+        free_intervals = FreeIntervals(self.parking_spot)
+        self.assertEqual(([(7 * 60, 8 * 60), (11 * 60, 12 * 60), (13 * 60, 16 * 60)], True),
+                         free_intervals.get_intervals(7 * 60, 18 * 60, 3))
+        self.assertEqual(([(7 * 60, 8 * 60), (11 * 60, 12 * 60)], True),
+                         free_intervals.get_intervals(7 * 60, 18 * 60, 2))
+        self.assertEqual(([(13 * 60, 16 * 60), (17 * 60, 18 * 60)], False),
+                         free_intervals.get_intervals(12 * 60, 18 * 60))
+
+    def test_earliest_fit(self):
+        free_intervals = FreeIntervals(self.parking_spot)
+        self.assertEqual(10 * 60, free_intervals.get_earliest_fit(9 * 60, 0))
+        self.assertEqual(11 * 60, free_intervals.get_earliest_fit(9 * 60, 60))
+        self.assertEqual(13 * 60, free_intervals.get_earliest_fit(11 * 60 + 1, 60))
+        self.assertEqual(17 * 60, free_intervals.get_earliest_fit(9 * 60, 240))
+        self.assertEqual(0, FreeIntervals(ParkingSpot("102", True)).get_earliest_fit(0, 60))
+
+    def test_earliest_fit_random(self):
+        rnd = random.Random(0)
+        for seed in range(20):
+            for parking_spot in make_random_timetable(seed).parking_spots:
+                free_intervals = FreeIntervals(parking_spot)
+                for _ in range(20):
+                    after, duration = rnd.randint(0, 1500), rnd.randint(1, 300)
+                    self.assertEqual(get_earliest_fit(parking_spot, after, duration),
+                                     free_intervals.get_earliest_fit(after, duration))
+
+
+class AvailabilityTestCase(unittest.TestCase):
+    def test_queries(self):
+        timetable = Timetable()
+        timetable.parking_spots[0].add_reservation(make_slot("1", 8, 10))
+        timetable.parking_spots[1].add_reservation(make_slot("2", 9, 12))
+        timetable.parking_spots[2].is_reservable = False
+        availability = Availability()
+        self.assertEqual(["101"] + [str(name) for name in range(104, 121)],
+                         [spot.name for spot in availability.get_free_spots(timetable, 10 * 60, 12 * 60)])
+        fits = availability.get_earliest_fits(timetable, 9 * 60, 60, limit=2)
+        self.assertEqual([(9 * 60, "104"), (9 * 60, "105")], [(start, spot.name) for start, spot in fits])
+
+        free_intervals = availability.get_free_intervals(timetable.parking_spots[0])
+        self.assertIs(free_intervals, availability.get_free_intervals(timetable.parking_spots[0]))
+        timetable.parking_spots[0].add_reservation(make_slot("3", 10, 11))
+        self.assertIsNot(free_intervals, availability.get_free_intervals(timetable.parking_spots[0]))
+        self.assertEqual(([(11 * 60, 12 * 60)], False),
+                         availability.get_intervals(timetable.parking_spots[0], 9 * 60, 12 * 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
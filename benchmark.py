@@ -0,0 +1,250 @@
+"""Benchmarks of the reservation system on generated winstrom payloads.
+
+Run for example: python benchmark.py --scales 10,100,1000 --output benchmark.json
+and compare two runs with: python benchmark.py --compare old.json new.json"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from availability import Availability
+from cache import ResultCache
+from reservation import Timetable, get_minimal_window_parking_spot, optimize_timetable, get_requests, optimize, \
+    reoptimize_timetable, get_windows
+from placement import PLACEMENT_STRATEGIES, get_candidates, place
+from snapshot import write_snapshot, read_snapshot
+from vectorized import SpotArrays
+
+TIMEZONE = datetime.timezone(datetime.timedelta(hours=2))
+FIRST_DAY = datetime.datetime(2021, 4, 19, tzinfo=TIMEZONE)
+DAY_START, DAY_END = 7 * 60, 19 * 60
+# cases that are too slow for the largest payloads, they run only up to --slow-limit bookings
+SLOW_CASES = {'optimize_greedy'}
+
+
+def format_date(minutes):
+    return (FIRST_DAY + datetime.timedelta(minutes=minutes)).isoformat(timespec='milliseconds')
+
+
+def make_element(id, spot, start, end, user):
+    return {
+        "id": str(id),
+        "lastUpdate": format_date(start - 24 * 60),
+        "cenik": "",
+        "firma": "",
+        "zahajeni": format_date(start),
+        "dokonceni": format_date(end),
+        "predmet": spot,
+        "typAkt": "code:UDÁLOST",
+        "typAkt@ref": "/c/rezervace1/typ-aktivity/1.json",
+        "typAkt@showAs": "UDÁLOST: Událost",
+        "zodpPrac": "code:" + user,
+        "zodpPrac@ref": "/c/rezervace1/uzivatel/" + str(id % 1000) + ".json",
+        "zodpPrac@showAs": user,
+        "majetek": ""
+    }
+
+
+def generate_payload(bookings, spots=20, density=0.6, min_duration=30, max_duration=480, manager_fraction=0.1,
+                     requests=1, users=200, seed=0):
+    """Generate a winstrom payload with a given number of bookings spread over parking spots named from 101.
+    Bookings of a spot follow each other during working hours, the windows between them are chosen so that the spot is
+    occupied for about the density fraction of the time. First manager_fraction of the spots are not reservable and
+    the requests (elements without predmet) carry the list of the reservable ones"""
+    rnd = random.Random(seed)
+    names = [str(101 + i) for i in range(spots)]
+    mean_window = (min_duration + max_duration) / 2 * (1 - density) / density
+    times = [DAY_START] * spots
+    udalost = []
+
+    for id in range(bookings):
+        idx = rnd.randrange(spots)
+        duration = rnd.randint(min_duration, max_duration)
+        start = times[idx] + int(rnd.expovariate(1 / mean_window)) if mean_window > 0 else times[idx]
+        if start % 1440 + duration > DAY_END:  # move to the next day
+            start = (start // 1440 + 1) * 1440 + DAY_START
+        times[idx] = start + duration
+        udalost.append(make_element(id + 1, names[idx], start, start + duration, "user" + str(rnd.randrange(users))))
+
+    horizon = max(times)
+    reservable = names[int(spots * manager_fraction):]
+    for id in range(bookings, bookings + requests):
+        start = rnd.randrange(horizon // 1440 + 1) * 1440 + rnd.randrange(DAY_START, DAY_END - min_duration)
+        element = make_element(id + 1, "", start, start + min_duration, "user" + str(rnd.randrange(users)))
+        element['reservation'] = reservable
+        udalost.append(element)
+    rnd.shuffle(udalost)
+    return {"winstrom": {"@version": "1.0", "udalost": udalost}}
+
+
+def measure(function, repeat):
+    """Return the best and the mean time of a function in seconds. What the function prints is thrown away, but the
+    time to format it is included"""
+    times = []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times)
+
+
+def get_memory_size(timetable):
+    """Return the number of bytes taken by the reservations of a timetable, objects shared by several reservations
+    are counted once"""
+    objects = {}
+    for parking_spot in timetable.parking_spots:
+        if hasattr(parking_spot, 'ids'):
+            columns = [parking_spot.starts, parking_spot.ends, parking_spot.ids, parking_spot.users]
+        else:
+            columns = [parking_spot.reservations, parking_spot.starts, parking_spot.ends]
+            for time_slot in parking_spot.reservations:
+                for value in (time_slot, time_slot.id, time_slot.user, time_slot.start, time_slot.end):
+                    objects[id(value)] = value
+        for column in columns:
+            objects[id(column)] = column
+    if timetable.symbols is not None:
+        for value in [timetable.symbols.values, timetable.symbols.indexes] + timetable.symbols.values:
+            objects[id(value)] = value
+    return sum(sys.getsizeof(value) for value in objects.values())
+
+
+def get_cases(data):
+    """Return the benchmarked functions for a payload"""
+    from server import app
+    client = app.test_client()
+    body = json.dumps(data)
+    udalost = data['winstrom']['udalost']
+    timetable = Timetable(udalost, data)
+    requests = get_requests(udalost)
+    request = requests[0]
+    spot_arrays = SpotArrays(timetable)
+    cache = ResultCache()
+    optimized = optimize_timetable(timetable)
+    availability = Availability()
+    # removed when the cases are garbage collected
+    directory = tempfile.TemporaryDirectory()
+    snapshot_path = os.path.join(directory.name, 'timetable.snap')
+    write_snapshot(timetable, snapshot_path, 0)
+
+    cases = {
+        'timetable': lambda: Timetable(udalost, data),
+        'timetable_compact': lambda: Timetable(udalost, data, compact=True),
+        'snapshot_write': lambda: write_snapshot(timetable, os.path.join(directory.name, 'write.snap'), 0),
+        'snapshot_load': lambda: read_snapshot(snapshot_path),
+        'minimal_window': lambda: get_minimal_window_parking_spot(timetable, request),
+        'minimal_window_all': lambda: [get_minimal_window_parking_spot(timetable, request) for request in requests],
+        'earliest_fit': lambda: availability.get_earliest_fits(timetable, request.start, request.end - request.start),
+        'spot_arrays': lambda: SpotArrays(timetable),
+        'vectorized_window': lambda: spot_arrays.get_minimal_window_parking_spot(request),
+        'vectorized_window_all': lambda: spot_arrays.get_minimal_window_parking_spots(requests),
+        'optimize_best_fit': lambda: optimize_timetable(timetable, 'best_fit'),
+        'optimize_sharded': lambda: optimize_timetable(timetable, 'sharded'),
+        'optimize_cached': lambda: optimize(data, cache=cache),
+        'optimize_greedy': lambda: optimize_timetable(Timetable(udalost, data), 'greedy'),
+        # one booking added to an optimized timetable and removed again
+        'reoptimize': lambda: (reoptimize_timetable(optimized, added=[request]),
+                               reoptimize_timetable(optimized, removed=[request])),
+        'to_json': lambda: timetable.to_json(),
+        'to_json_diff': lambda: timetable.to_json(diff=True),
+        'server_reserve': lambda: client.post('/reserve/', data=body, content_type='application/json'),
+        'server_optimize': lambda: client.post('/optimize/', data=body, content_type='application/json'),
+        # every placement strategy on one shared candidate set
+        'placement_all': lambda: [place(timetable.parking_spots, request, PLACEMENT_STRATEGIES)
+                                  for request in requests],
+    }
+    for name, strategy in PLACEMENT_STRATEGIES.items():
+        cases['placement_' + name] = lambda strategy=strategy: [
+            strategy(get_candidates(timetable.parking_spots, request), request) for request in requests]
+    return cases
+
+
+def get_placement_quality(data):
+    """Place all requests of a payload one after another by every placement strategy. Return the number of placed
+    requests and the sum of windows between the reservations afterwards (fragmentation, lower is better)"""
+    udalost = data['winstrom']['udalost']
+    requests = sorted(get_requests(udalost), key=lambda request: (request.start, request.end))
+    quality = {}
+    for name, strategy in PLACEMENT_STRATEGIES.items():
+        timetable = Timetable(udalost, data)
+        placed = 0
+        for request in requests:
+            candidate = strategy(get_candidates(timetable.parking_spots, request), request)
+            if candidate is not None:
+                candidate.spot.add_reservation(request)
+                placed += 1
+        quality[name] = placed, get_windows(timetable)
+    return quality
+
+
+def run(scales, repeat=3, slow_limit=5000, **generator_args):
+    results = []
+    for bookings in scales:
+        data = generate_payload(bookings, **generator_args)
+        for case, function in get_cases(data).items():
+            if case in SLOW_CASES and bookings > slow_limit:
+                continue
+            best, mean = measure(function, repeat)
+            results.append({"bookings": bookings, "case": case, "best": best, "mean": mean, "repeat": repeat})
+            print("%8d %-24s best %.6f s  mean %.6f s" % (bookings, case, best, mean))
+        for compact in (False, True):
+            size = get_memory_size(Timetable(data['winstrom']['udalost'], compact=compact))
+            case = 'memory_compact' if compact else 'memory'
+            results.append({"bookings": bookings, "case": case, "bytes": size})
+            print("%8d %-24s %d bytes" % (bookings, case, size))
+        for name, (placed, windows) in get_placement_quality(data).items():
+            results.append({"bookings": bookings, "case": 'quality_' + name, "placed": placed, "windows": windows})
+            print("%8d %-24s %d placed, windows %d min" % (bookings, 'quality_' + name, placed, windows))
+    return {
+        "python": platform.python_version(),
+        "date": datetime.datetime.now().isoformat(timespec='seconds'),
+        "generator": generator_args,
+        "results": results,
+    }
+
+
+def compare(old_path, new_path):
+    """Print how much time (or memory) every case takes in the new run compared to the old one"""
+    with open(old_path) as f:
+        old = {(result['bookings'], result['case']): result for result in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+    for result in new:
+        key = (result['bookings'], result['case'])
+        value = 'bytes' if 'bytes' in result else 'windows' if 'windows' in result else 'best'
+        if key in old and old[key].get(value):
+            print("%8d %-24s %.2fx" % (key[0], key[1], result[value] / old[key][value]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the reservation system on generated payloads")
+    parser.add_argument('--scales', default="10,100,1000,10000,100000", help="comma separated numbers of bookings")
+    parser.add_argument('--spots', type=int, default=20,
+                        help="spots named from 101, with more than 20 set SPOT_INVENTORY to a file with all of them")
+    parser.add_argument('--density', type=float, default=0.6, help="occupied fraction of working hours of a spot")
+    parser.add_argument('--min-duration', type=int, default=30, help="in minutes")
+    parser.add_argument('--max-duration', type=int, default=480, help="in minutes")
+    parser.add_argument('--manager-fraction', type=float, default=0.1, help="fraction of not reservable spots")
+    parser.add_argument('--requests', type=int, default=100, help="number of reservation requests in the payload")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--slow-limit', type=int, default=5000, help="skip slow cases above this number of bookings")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default="benchmark.json", help="where to write the results as JSON")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help="compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        output = run([int(scale) for scale in args.scales.split(',')], args.repeat, args.slow_limit,
+                     spots=args.spots, density=args.density, min_duration=args.min_duration,
+                     max_duration=args.max_duration, manager_fraction=args.manager_fraction,
+                     requests=args.requests, seed=args.seed)
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
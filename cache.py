@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from operator import itemgetter
+
+from inventory import inventory
+
+
+def get_timetable_key(reservations, strategy):
+    """Return a hash of what the optimization depends on: id, parking spot, start and end of the bookings, rules of the
+    recurring ones, reservability of the spots, the spot inventory and the strategy. Order of the elements and their
+    other fields do not matter"""
+    reservable = None
+    for element in reservations:
+        if element['predmet'] == "" and 'reservation' in element.keys():
+            reservable = sorted(element['reservation'])
+    get_fields = itemgetter('id', 'predmet', 'zahajeni', 'dokonceni')
+    bookings = sorted("\0".join(get_fields(element)) for element in reservations if element['predmet'] != "")
+    bookings.extend(sorted("\0".join([element['id'], element['rrule'], element.get('tzid', "")]
+                                     + element.get('exdate', []))
+                           for element in reservations if element['predmet'] != "" and 'rrule' in element))
+    bookings.append(repr((strategy, reservable, inventory.get_spots())))
+    return hashlib.sha256("\n".join(bookings).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Results kept for at most ttl seconds, when there are more than max_size of them the least recently used one is
+    dropped. Counts hits and misses so that the size and the time to live can be tuned"""
+
+    def __init__(self, max_size=128, ttl=300, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the result for a key, None if there is no valid one"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= self.clock():
+                del self.entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = (self.clock() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, function):
+        """Return the cached result for a key, compute and store it if there is none"""
+        value = self.get(key)
+        if value is None:
+            value = function()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {"size": len(self.entries), "max_size": self.max_size, "ttl": self.ttl, "hits": self.hits,
+                    "misses": self.misses, "evictions": self.evictions, "expirations": self.expirations}
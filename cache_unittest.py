@@ -0,0 +1,51 @@
+import copy
+import unittest
+from cache import ResultCache, get_timetable_key
+from reservation import optimize
+from reservation_unittest import test_data
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    def test_key(self):
+        data = copy.deepcopy(test_data)
+        key = get_timetable_key(data['winstrom']['udalost'], 'best_fit')
+        data['winstrom']['udalost'].reverse()
+        data['winstrom']['udalost'][0]['lastUpdate'] = "2021-05-01T00:00:00.000+02:00"
+        self.assertEqual(key, get_timetable_key(data['winstrom']['udalost'], 'best_fit'))
+        self.assertNotEqual(key, get_timetable_key(data['winstrom']['udalost'], 'greedy'))
+        data['winstrom']['udalost'][0]['predmet'] = "103"
+        self.assertNotEqual(key, get_timetable_key(data['winstrom']['udalost'], 'best_fit'))
+        data['winstrom']['udalost'][0]['predmet'] = "102"
+        data['winstrom']['udalost'][2]['reservation'] = ["101"]
+        self.assertNotEqual(key, get_timetable_key(data['winstrom']['udalost'], 'best_fit'))
+
+    def test_lru_and_ttl(self):
+        clock = Clock()
+        cache = ResultCache(max_size=2, ttl=10, clock=clock)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(1, cache.get("a"))
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        clock.time = 10
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual({"size": 1, "max_size": 2, "ttl": 10, "hits": 1, "misses": 2, "evictions": 1,
+                          "expirations": 1}, cache.stats())
+
+    def test_optimize(self):
+        cache = ResultCache()
+        self.assertEqual(optimize(test_data), optimize(test_data, cache=cache))
+        self.assertEqual(optimize(test_data, diff=True), optimize(test_data, diff=True, cache=cache))
+        self.assertEqual((1, 1), (cache.stats()['hits'], cache.stats()['misses']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+import sqlite3
+import threading
+
+from recurrence import InvalidRule
+from reservation import Timetable, ParkingSpot, TimeSlot, get_reservation_time
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS spots (
+    name TEXT PRIMARY KEY,
+    reservable INTEGER NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    id TEXT PRIMARY KEY,
+    spot TEXT NOT NULL REFERENCES spots (name),
+    user TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reservations_spot_start ON reservations (spot, start);
+'''
+
+
+class Conflict(Exception):
+    """Raised when a placement has lost the race for every free spot"""
+
+
+def get_ranked_spots(timetable, request, reservable=None):
+    """Return the spots where the request fits, best first. Same order as get_minimal_window_parking_spot uses, spots
+    with the smallest window first and spots without reservations at the end"""
+    windows, empty_spots = [], []
+    for idx, parking_spot in enumerate(timetable.parking_spots):
+        if not (parking_spot.is_reservable if reservable is None else parking_spot.name in reservable):
+            continue
+        if len(parking_spot.reservations) == 0:
+            empty_spots.append(parking_spot)
+            continue
+        window = parking_spot.get_window(request.start, request.end)
+        if window is not None:
+            windows.append((window, idx, parking_spot))
+    return [parking_spot for _, _, parking_spot in sorted(windows, key=lambda item: item[:2])] + empty_spots
+
+
+def check_not_recurring(reservations):
+    """Raise InvalidRule if one of the udalost elements repeats, the database keeps single reservations only"""
+    for element in reservations:
+        if 'rrule' in element:
+            raise InvalidRule("recurring booking " + element['id'] + " is not supported by the shared timetable")
+
+
+class ReservationEngine:
+    """Reservations shared by all worker processes through a SQLite database.
+
+    Every worker keeps the timetable as a cache of the database and looks for free spots in it without any lock.
+    A placement is committed with compare-and-swap on the version of the spot, it succeeds only if nobody has
+    committed to that spot since the worker read it, so placements on different spots never conflict. When the race
+    is lost, the next best spot is tried and the stale spots are read again"""
+
+    def __init__(self, path, max_attempts=5, inventory=None):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.inventory = inventory
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.timetable = Timetable(inventory=inventory)
+        self.versions = {}
+        with self.connect() as db:
+            db.executescript(SCHEMA)
+            db.executemany("INSERT OR IGNORE INTO spots (name, reservable) VALUES (?, ?)",
+                           [(spot.name, spot.is_reservable) for spot in self.timetable.parking_spots])
+        self.refresh()
+
+    def update_spots(self):
+        """Take over the changes of the spot inventory: new spots get their rows, spots whose reservability has changed
+        get a new version so that every worker reads them again, spots no longer in the inventory are not reservable"""
+        with self.lock:
+            if not self.timetable.update_spots():
+                return
+            reservable = {name: is_reservable for name, is_reservable, _ in self.timetable.inventory.spots}
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT OR IGNORE INTO spots (name, reservable) VALUES (?, ?)", reservable.items())
+            for name, in db.execute("SELECT name FROM spots").fetchall():
+                db.execute("UPDATE spots SET reservable = ?, version = version + 1 WHERE name = ? AND reservable != ?",
+                           (reservable.get(name, False), name, reservable.get(name, False)))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self.refresh()
+
+    def connect(self):
+        """Return the connection of the current thread, SQLite connections cannot be shared between threads"""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = self.local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def refresh(self):
+        """Read again the spots that somebody else has changed since the last time, return True if there was any"""
+        db = self.connect()
+        changed = False
+        for name, reservable, version in db.execute("SELECT name, reservable, version FROM spots").fetchall():
+            if self.versions.get(name) == version:
+                continue
+            changed = True
+            parking_spot = ParkingSpot(name, reservable)
+            rows = db.execute("SELECT id, user, start, end FROM reservations WHERE spot = ? ORDER BY start", (name,))
+            for id, user, start, end in rows:
+                parking_spot.add_reservation(TimeSlot(id, user, start, end))
+            with self.lock:
+                self.timetable.add_parking_spot(parking_spot)
+                self.versions[name] = version
+        return changed
+
+    def load(self, reservations):
+        """Replace all reservations in the database with the bookings of a list of udalost elements"""
+        check_not_recurring(reservations)
+        timetable = Timetable(reservations, inventory=self.inventory)
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.execute("DELETE FROM reservations")
+            for parking_spot in timetable.parking_spots:
+                db.execute("INSERT OR IGNORE INTO spots (name, reservable) VALUES (?, ?)",
+                           (parking_spot.name, parking_spot.is_reservable))
+                db.execute("UPDATE spots SET reservable = ?, version = version + 1 WHERE name = ?",
+                           (parking_spot.is_reservable, parking_spot.name))
+                db.executemany("INSERT OR REPLACE INTO reservations VALUES (?, ?, ?, ?, ?)",
+                               [(slot.id, parking_spot.name, slot.user, slot.start, slot.end)
+                                for slot in parking_spot.reservations])
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self.refresh()
+
+    def commit(self, spot_name, version, request):
+        """Store a reservation if the spot still has the given version. Return False if somebody was faster"""
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            cursor = db.execute("UPDATE spots SET version = version + 1 WHERE name = ? AND version = ?",
+                                (spot_name, version))
+            if cursor.rowcount != 1:
+                db.execute("ROLLBACK")
+                return False
+            db.execute("INSERT INTO reservations VALUES (?, ?, ?, ?, ?)",
+                       (request.id, spot_name, request.user, request.start, request.end))
+            db.execute("COMMIT")
+            return True
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def get_candidates(self, request, reservable=None):
+        """Return (name, version) of the cached spots where the request fits, best first"""
+        with self.lock:
+            return [(spot.name, self.versions[spot.name])
+                    for spot in get_ranked_spots(self.timetable, request, reservable)]
+
+    def reserve(self, request, reservable=None):
+        """Find a spot for a request, commit it and return the name of the spot, None if there is no free spot.
+        Raise Conflict if every attempt has lost the race"""
+        self.update_spots()
+        for _ in range(self.max_attempts):
+            candidates = self.get_candidates(request, reservable)
+            # the cache is refreshed only after a lost race, another worker may have freed some spots since
+            if not candidates and self.refresh():
+                candidates = self.get_candidates(request, reservable)
+            if not candidates:
+                return None
+            for idx, (name, version) in enumerate(candidates):
+                if self.commit(name, version, request):
+                    with self.lock:
+                        if self.versions[name] == version:
+                            self.timetable.get_parking_spot(name).add_reservation(request)
+                            self.versions[name] = version + 1
+                    if idx > 0:  # some race was lost, the cache is stale
+                        self.refresh()
+                    return name
+            self.refresh()
+        raise Conflict(request.id)
+
+    def reserve_element(self, element):
+        """Find a spot for a reservation request (udalost element without predmet) and return the element with it"""
+        check_not_recurring([element])
+        start, end = get_reservation_time(element['zahajeni'], element['dokonceni'])
+        spot_name = self.reserve(TimeSlot(element['id'], element['zodpPrac'], start, end), element.get('reservation'))
+        return dict(element, predmet=spot_name if spot_name is not None else "")
@@ -0,0 +1,75 @@
+import os
+import tempfile
+import threading
+import unittest
+from engine import ReservationEngine, Conflict
+from recurrence import InvalidRule
+from reservation import TimeSlot
+from reservation_unittest import test_data, optimal_space_data
+
+
+class ReservationEngineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "reservations.sqlite3")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_reserve_element(self):
+        engine = ReservationEngine(self.path)
+        engine.load(test_data['winstrom']['udalost'])
+        self.assertEqual(optimal_space_data, engine.reserve_element(test_data['winstrom']['udalost'][0]))
+        self.assertEqual("1", ReservationEngine(self.path).timetable.parking_spots[1].reservations[1].id)
+
+    def test_recurring(self):
+        engine = ReservationEngine(self.path)
+        reservations = [dict(element) for element in test_data['winstrom']['udalost']]
+        reservations[1]['rrule'] = "FREQ=DAILY"
+        self.assertRaises(InvalidRule, engine.load, reservations)
+        self.assertEqual([], [spot for spot in engine.timetable.parking_spots if spot.reservations])
+        self.assertRaises(InvalidRule, engine.reserve_element, dict(reservations[0], rrule="FREQ=DAILY"))
+
+    def test_lost_race_takes_next_spot(self):
+        first, second = ReservationEngine(self.path), ReservationEngine(self.path)
+        self.assertEqual("101", first.reserve(TimeSlot("1", "code:admin", 0, 60)))
+        # the second worker has not seen the first reservation yet
+        self.assertEqual("102", second.reserve(TimeSlot("2", "code:admin", 30, 90)))
+        self.assertEqual(["1"], [slot.id for slot in second.timetable.parking_spots[0].reservations])
+
+    def test_conflict(self):
+        first, second = ReservationEngine(self.path), ReservationEngine(self.path, max_attempts=1)
+        first.reserve(TimeSlot("1", "code:admin", 0, 60), reservable=["101"])
+        self.assertRaises(Conflict, second.reserve, TimeSlot("2", "code:admin", 30, 90), ["101"])
+        self.assertIsNone(second.reserve(TimeSlot("2", "code:admin", 30, 90), ["101"]))
+
+    def test_spots_freed_by_another_worker(self):
+        first, second = ReservationEngine(self.path), ReservationEngine(self.path)
+        count = len(first.timetable.parking_spots)
+        for i in range(count):
+            self.assertIsNotNone(first.reserve(TimeSlot(str(i), "code:admin", 0, 60)))
+        self.assertIsNone(first.reserve(TimeSlot("full", "code:admin", 0, 60)))
+        second.load([])
+        self.assertIsNotNone(first.reserve(TimeSlot("free", "code:admin", 0, 60)))
+
+    def test_no_double_booking(self):
+        engines = [ReservationEngine(self.path, max_attempts=100) for _ in range(4)]
+        results = []
+
+        def reserve(engine, worker):
+            for i in range(10):
+                results.append(engine.reserve(TimeSlot(str(worker * 10 + i), "code:admin", i * 30, i * 30 + 60)))
+
+        threads = [threading.Thread(target=reserve, args=(engine, idx)) for idx, engine in enumerate(engines)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine = ReservationEngine(self.path)
+        self.assertEqual(40, sum(len(spot.reservations) for spot in engine.timetable.parking_spots))
+        for parking_spot in engine.timetable.parking_spots:
+            self.assertTrue(all(end <= start for start, end in zip(parking_spot.starts[1:], parking_spot.ends)))
+
+
+if __name__ == '__main__':
+    unittest.main()
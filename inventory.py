@@ -0,0 +1,65 @@
+import json
+import os
+import threading
+import time
+
+# spots used when there is no inventory file
+DEFAULT_SPOTS = tuple((str(i), True, {}) for i in range(101, 121))
+
+
+class SpotInventory:
+    """Parking spots of a site read from a JSON file:
+
+    {"spots": [{"name": "101", "reservable": true, "attributes": {"level": 1}}, ...]}
+
+    The file is read once and again only when its modification time changes, which is checked at most every
+    check_interval seconds, so the workers pick up a new inventory without a restart. Without the file the spots
+    101-120 are used"""
+
+    def __init__(self, path, check_interval=1.0, clock=time.monotonic):
+        self.path = path
+        self.check_interval = check_interval
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.spots = DEFAULT_SPOTS
+        self.mtime = None
+        self.checked = None
+        self.version = 0
+        self.reload()
+
+    def reload(self):
+        """Read the file again if it has changed. Return True if the spots have changed"""
+        with self.lock:
+            self.checked = self.clock()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime == self.mtime:
+                return False
+            if mtime is None:
+                spots = DEFAULT_SPOTS
+            else:
+                try:
+                    with open(self.path, encoding='utf-8') as file:
+                        spots = tuple((str(spot['name']), bool(spot.get('reservable', True)),
+                                       spot.get('attributes', {})) for spot in json.load(file)['spots'])
+                except (OSError, ValueError, KeyError, TypeError):
+                    # the file may be just being written, keep the old spots and try again next time
+                    return False
+            self.mtime = mtime
+            if spots != self.spots:
+                self.spots = spots
+                self.version += 1
+                return True
+            return False
+
+    def get_spots(self):
+        """Return (name, reservable, attributes) of all spots, reload the file first if it is time to check it"""
+        if self.clock() - self.checked >= self.check_interval:
+            self.reload()
+        return self.spots
+
+
+inventory = SpotInventory(os.environ.get('SPOT_INVENTORY', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                        'spots.json')))
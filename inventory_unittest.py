@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import unittest
+from engine import ReservationEngine
+from inventory import SpotInventory, DEFAULT_SPOTS
+from reservation import Timetable, TimeSlot
+from store import TimetableStore
+
+
+def make_element(id, spot, start_hour, end_hour):
+    return {"id": id, "predmet": spot, "zahajeni": "2021-04-17T%02d:00:00+00:00" % start_hour,
+            "dokonceni": "2021-04-17T%02d:00:00+00:00" % end_hour, "zodpPrac": "code:admin"}
+
+
+class Clock:
+    def __init__(self):
+        self.time = 0
+
+    def __call__(self):
+        return self.time
+
+
+class SpotInventoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'spots.json')
+        self.clock = Clock()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, spots, mtime):
+        with open(self.path, 'w') as file:
+            json.dump({"spots": spots}, file)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_default(self):
+        self.assertEqual(DEFAULT_SPOTS, SpotInventory(self.path).get_spots())
+
+    def test_reload(self):
+        self.write([{"name": "A1", "attributes": {"level": 1}}, {"name": 2, "reservable": False}], 1000)
+        inventory = SpotInventory(self.path, clock=self.clock)
+        self.assertEqual((("A1", True, {"level": 1}), ("2", False, {})), inventory.get_spots())
+
+        self.write([{"name": "A1"}], 2000)
+        self.assertEqual(2, len(inventory.get_spots()))  # not checked yet
+        self.clock.time = 1
+        self.assertEqual((("A1", True, {}),), inventory.get_spots())
+        self.assertEqual(2, inventory.version)
+
+        with open(self.path, 'w') as file:
+            file.write('{"spots": [')
+        os.utime(self.path, (3000, 3000))
+        self.assertFalse(inventory.reload())
+        self.assertEqual((("A1", True, {}),), inventory.get_spots())
+
+    def test_timetable(self):
+        self.write([{"name": "A1"}, {"name": "A2", "reservable": False, "attributes": {"charger": True}}], 1000)
+        timetable = Timetable([{"id": "1", "predmet": "A2", "zahajeni": "2021-04-17T11:41:49.285+02:00",
+                                "dokonceni": "2021-04-17T12:41:49.285+02:00", "zodpPrac": "code:admin"}],
+                              inventory=SpotInventory(self.path))
+        self.assertEqual(["A1", "A2"], [parking_spot.name for parking_spot in timetable.parking_spots])
+        self.assertFalse(timetable.get_parking_spot("A2").is_reservable)
+        self.assertEqual({"charger": True}, timetable.empty_copy().get_parking_spot("A2").attributes)
+        self.assertEqual(1, len(timetable.get_parking_spot("A2").reservations))
+
+    def test_store(self):
+        self.write([{"name": "A1"}, {"name": "A2"}], 1000)
+        inventory = SpotInventory(self.path, clock=self.clock)
+        store = TimetableStore(inventory=inventory)
+        store.load([make_element("1", "A1", 8, 9), make_element("2", "A2", 8, 9)])
+        self.write([{"name": "A1"}, {"name": "B1", "attributes": {"level": 2}}], 2000)
+        self.clock.time = 1
+        self.assertEqual("B1", store.reserve(make_element("3", "", 8, 9))['predmet'])
+        self.assertFalse(store.timetable.get_parking_spot("A2").is_reservable)
+        self.assertEqual({"level": 2}, store.timetable.get_parking_spot("B1").attributes)
+        store.apply({"action": "remove", "udalost": {"id": "2"}})
+        self.write([{"name": "A1"}, {"name": "B1"}, {"name": "B2"}], 3000)
+        self.clock.time = 2
+        store.apply({"action": "remove", "udalost": {"id": "3"}})
+        self.assertEqual(["A1", "B1", "B2"], [parking_spot.name for parking_spot in store.timetable.parking_spots])
+
+    def test_engine(self):
+        self.write([{"name": "A1"}], 1000)
+        inventory = SpotInventory(self.path, clock=self.clock)
+        path = os.path.join(self.directory.name, "reservations.sqlite3")
+        engine = ReservationEngine(path, inventory=inventory)
+        self.assertEqual("A1", engine.reserve(TimeSlot("1", "code:admin", 0, 60)))
+        self.assertIsNone(engine.reserve(TimeSlot("2", "code:admin", 0, 60)))
+        self.write([{"name": "A1"}, {"name": "A2"}], 2000)
+        self.clock.time = 1
+        self.assertEqual("A2", engine.reserve(TimeSlot("2", "code:admin", 0, 60)))
+        # another worker reads the new spot from the database
+        other = ReservationEngine(path, inventory=SpotInventory(os.path.join(self.directory.name, 'other.json')))
+        self.assertEqual(["1"], [slot.id for slot in other.timetable.get_parking_spot("A1").reservations])
+        self.assertEqual(["2"], [slot.id for slot in other.timetable.get_parking_spot("A2").reservations])
+
+
+if __name__ == '__main__':
+    unittest.main()
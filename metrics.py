@@ -0,0 +1,140 @@
+import logging
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'WARNING')
+# fraction of the records below WARNING that are written
+LOG_SAMPLE = float(os.environ.get('LOG_SAMPLE', 1.0))
+
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 10000, 100000, 1000000)
+
+
+def escape_label(value):
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(label, value, extra=""):
+    labels = [label + '="' + escape_label(value) + '"'] if label is not None else []
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    """Monotonic counter, one series for every value of the label"""
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, amount=1, label_value=None):
+        with self.lock:
+            self.series[label_value] = self.series.get(label_value, 0) + amount
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " counter"]
+        with self.lock:
+            for value, count in sorted(self.series.items(), key=lambda item: str(item[0])):
+                lines.append(self.name + format_labels(self.label, value) + " " + repr(count))
+        return lines
+
+
+class Histogram:
+    """Numbers of observed values in buckets with the given upper bounds, their sum and count, one series for every
+    value of the label"""
+
+    def __init__(self, name, help, label=None, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label value -> [count of every bucket and of +Inf, sum, count]
+        self.series = {}
+
+    def observe(self, value, label_value=None):
+        idx = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 1) + [0, 0]
+            series[idx] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.help, "# TYPE " + self.name + " histogram"]
+        with self.lock:
+            for value, series in sorted(self.series.items(), key=lambda item: str(item[0])):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), series):
+                    cumulative += count
+                    lines.append(self.name + "_bucket" + format_labels(self.label, value, 'le="' + str(bound) + '"')
+                                 + " " + str(cumulative))
+                lines.append(self.name + "_sum" + format_labels(self.label, value) + " " + repr(series[-2]))
+                lines.append(self.name + "_count" + format_labels(self.label, value) + " " + str(series[-1]))
+        return lines
+
+
+STAGE_SECONDS = Histogram('reservation_stage_seconds', "Time spent in a stage of handling a request (parse, build, "
+                                                       "search, optimize, serialize, encode)", 'stage')
+SPOTS_SCANNED = Histogram('reservation_spots_scanned', "Reservable parking spots scanned by one spot search",
+                          buckets=COUNT_BUCKETS)
+SLOTS_EXAMINED = Histogram('reservation_slots_examined', "Reservations on the parking spots scanned by one spot "
+                                                         "search, which are bisected for the neighbours of the request",
+                           buckets=COUNT_BUCKETS)
+# labelled by the route, not the path of the request, so that unknown paths do not make new series
+REQUESTS = Counter('reservation_requests_total', "Handled requests", 'path')
+UNMATCHED = 'unmatched'
+METRICS = [STAGE_SECONDS, SPOTS_SCANNED, SLOTS_EXAMINED, REQUESTS]
+
+
+@contextmanager
+def timed(stage):
+    """Measure the time spent in a block of code as a given stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage)
+
+
+def render_metrics():
+    """Return all metrics in the Prometheus text format. Every worker process has metrics of its own"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class SamplingFilter(logging.Filter):
+    """Lets through only a given fraction of the records below WARNING, warnings and errors always pass"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+def configure_logging(level=LOG_LEVEL, sample=LOG_SAMPLE):
+    """Write log records of the given level and above to stderr, records below WARNING only with a given probability.
+    Does nothing if the logging is already configured. Debug records cost just a level check when they are disabled"""
+    root = logging.getLogger()
+    if root.handlers:
+        return
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handler.addFilter(SamplingFilter(sample))
+    root.addHandler(handler)
+    root.setLevel(level)
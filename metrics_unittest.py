@@ -0,0 +1,43 @@
+import logging
+import unittest
+from metrics import Counter, Histogram, SamplingFilter, STAGE_SECONDS, timed, render_metrics
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_histogram(self):
+        histogram = Histogram('test_seconds', "Test", 'stage', buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, 'parse')
+        self.assertEqual(['# HELP test_seconds Test',
+                          '# TYPE test_seconds histogram',
+                          'test_seconds_bucket{stage="parse",le="1"} 2',
+                          'test_seconds_bucket{stage="parse",le="5"} 3',
+                          'test_seconds_bucket{stage="parse",le="+Inf"} 4',
+                          'test_seconds_sum{stage="parse"} 14.5',
+                          'test_seconds_count{stage="parse"} 4'], histogram.render())
+
+    def test_counter(self):
+        counter = Counter('test_total', "Test")
+        counter.inc()
+        counter.inc(2)
+        self.assertEqual('test_total 3', counter.render()[-1])
+        counter = Counter('test_total', "Test", 'path')
+        counter.inc(label_value='/a"b\\\n')
+        self.assertEqual('test_total{path="/a\\"b\\\\\\n"} 1', counter.render()[-1])
+
+    def test_timed(self):
+        with timed('test'):
+            pass
+        self.assertEqual(1, STAGE_SECONDS.series['test'][-1])
+        self.assertIn('reservation_stage_seconds_count{stage="test"} 1', render_metrics())
+
+    def test_sampling(self):
+        def make_record(level):
+            return logging.LogRecord('test', level, __file__, 1, "message", None, None)
+        self.assertFalse(SamplingFilter(0).filter(make_record(logging.DEBUG)))
+        self.assertTrue(SamplingFilter(0).filter(make_record(logging.WARNING)))
+        self.assertTrue(SamplingFilter(1).filter(make_record(logging.INFO)))
+
+
+if __name__ == '__main__':
+    unittest.main()
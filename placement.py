@@ -0,0 +1,149 @@
+from bisect import bisect_left
+
+from metrics import SPOTS_SCANNED, SLOTS_EXAMINED
+
+INFINITY = float('inf')
+DAY = 24 * 60
+# weights of the objectives of the weighted placement, see get_score
+DEFAULT_WEIGHTS = {'window': 1.0, 'preferred': 1.0, 'load': 0.2}
+
+
+class Candidate:
+    """Reservable parking spot where a request fits, with the gaps to the reservations right before and right after
+    it (infinite when there is none on that side)"""
+    __slots__ = ('spot', 'before', 'after', 'window', 'count')
+
+    def __init__(self, spot, before, after, count):
+        self.spot = spot
+        self.before = before
+        self.after = after
+        # the smaller gap, infinite on an empty spot
+        self.window = min(before, after)
+        self.count = count
+
+
+def get_candidates(parking_spots, request, reservable=None):
+    """Return the reservable parking spots where a request fits in the order of the spots. Every spot is bisected
+    once, so the candidates can be scored by any number of placement strategies. With reservable (a set of names) the
+    spots sent along with the request are taken instead of the reservable ones"""
+    candidates = []
+    start, end = request.start, request.end
+    scanned, examined = 0, 0
+    for parking_spot in parking_spots:
+        if not (parking_spot.is_reservable if reservable is None else parking_spot.name in reservable):
+            continue
+        starts = parking_spot.starts
+        count = len(starts)
+        scanned += 1
+        examined += count
+        idx = bisect_left(starts, end)
+        if idx > 0:
+            previous_end = parking_spot.ends[idx - 1]
+            if previous_end > start:
+                continue
+            before = start - previous_end
+        else:
+            before = INFINITY
+        after = starts[idx] - end if idx < count else INFINITY
+        candidates.append(Candidate(parking_spot, before, after, count))
+    SPOTS_SCANNED.observe(scanned)
+    SLOTS_EXAMINED.observe(examined)
+    return candidates
+
+
+def is_preferred(candidate, request):
+    """Check if the user of a request prefers the spot, the users are listed in the attribute "preferred" of the spot
+    in the inventory"""
+    return request.user in candidate.spot.attributes.get('preferred', ())
+
+
+def place_first_fit(candidates, request):
+    """The first spot where the request fits"""
+    return candidates[0] if candidates else None
+
+
+def place_best_fit(candidates, request):
+    """The spot with the smallest gap next to the request, an empty spot only when it fits nowhere else. Same choice as
+    get_minimal_window_parking_spot"""
+    return min(candidates, key=lambda candidate: candidate.window, default=None)
+
+
+def place_worst_fit(candidates, request):
+    """The spot with the largest gap next to the request, empty spots first. Leaves room for long bookings around"""
+    return max(candidates, key=lambda candidate: candidate.window, default=None)
+
+
+def place_preferred(candidates, request):
+    """The best fit among the spots preferred by the user, the best fit of all spots if none of them is free"""
+    return min(candidates, key=lambda candidate: (not is_preferred(candidate, request), candidate.window),
+               default=None)
+
+
+def get_score(candidate, request, weights, max_count):
+    """Weighted sum of the objectives of a candidate, lower is better. Every objective is between 0 and 1: window is
+    the smaller gap in days (at most 1), preferred is 0 on a spot preferred by the user and load is the number of
+    reservations on the spot relative to the busiest candidate"""
+    score = weights.get('window', 0) * min(candidate.window, DAY) / DAY
+    score += weights.get('preferred', 0) * (not is_preferred(candidate, request))
+    score += weights.get('load', 0) * candidate.count / max_count
+    return score
+
+
+def get_weighted_placement(weights):
+    """Return a placement strategy which takes the candidate with the lowest weighted score (see get_score)"""
+
+    def place_weighted(candidates, request):
+        max_count = max((candidate.count for candidate in candidates), default=0) or 1
+        return min(candidates, key=lambda candidate: get_score(candidate, request, weights, max_count), default=None)
+
+    return place_weighted
+
+
+def parse_weights(text):
+    """Parse weights like "window:1,load:0.5", raise ValueError on an unknown objective or a weight that is not a
+    number"""
+    weights = {}
+    for item in text.split(','):
+        name, _, weight = item.partition(':')
+        if name not in DEFAULT_WEIGHTS:
+            raise ValueError("unknown objective " + name)
+        weights[name] = float(weight)
+    return weights
+
+
+# placement strategy: function of the candidates and the request which returns the chosen candidate or None
+PLACEMENT_STRATEGIES = {
+    'first_fit': place_first_fit,
+    'best_fit': place_best_fit,
+    'worst_fit': place_worst_fit,
+    'preferred': place_preferred,
+    'weighted': get_weighted_placement(DEFAULT_WEIGHTS),
+}
+
+
+def get_placement_args(args):
+    """Return the placement strategy and the weights of the weighted one from query arguments ("placement" and
+    "weights"), raise ValueError if they are not valid"""
+    placement = args.get('placement', 'best_fit')
+    if placement not in PLACEMENT_STRATEGIES:
+        raise ValueError("unknown placement " + placement)
+    weights = args.get('weights')
+    return placement, parse_weights(weights) if weights is not None else None
+
+
+def get_placement(name, weights=None):
+    """Return the placement strategy with a given name, the weighted one with the given weights"""
+    if name == 'weighted' and weights is not None:
+        return get_weighted_placement(weights)
+    return PLACEMENT_STRATEGIES[name]
+
+
+def place(parking_spots, request, strategies):
+    """Return the spot chosen by every one of the given placement strategies (name -> strategy), None where there is no
+    free spot. The candidates are found only once for all of them"""
+    candidates = get_candidates(parking_spots, request)
+    spots = {}
+    for name, strategy in strategies.items():
+        candidate = strategy(candidates, request)
+        spots[name] = candidate.spot if candidate is not None else None
+    return spots
@@ -0,0 +1,51 @@
+import unittest
+from placement import get_candidates, get_placement, get_placement_args, parse_weights, place, PLACEMENT_STRATEGIES
+from reservation import ParkingSpot, get_minimal_window_parking_spot
+from reservation_unittest import make_slot, make_random_timetable
+
+
+class PlacementTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spots = [ParkingSpot("101", True, attributes={"preferred": ["code:admin"]}), ParkingSpot("102", True),
+                      ParkingSpot("103", True), ParkingSpot("104", False)]
+        self.spots[0].add_reservation(make_slot("1", 8, 10))
+        for slot in (make_slot("2", 8, 11), make_slot("3", 14, 16)):
+            self.spots[1].add_reservation(slot)
+        self.request = make_slot("4", 11, 12)
+
+    def test_candidates(self):
+        candidates = get_candidates(self.spots, self.request)
+        self.assertEqual(["101", "102", "103"], [candidate.spot.name for candidate in candidates])
+        self.assertEqual([60, 0, float('inf')], [candidate.window for candidate in candidates])
+        self.assertEqual([], get_candidates(self.spots[:2], make_slot("5", 9, 12)))
+
+    def test_strategies(self):
+        spots = place(self.spots, self.request, PLACEMENT_STRATEGIES)
+        self.assertEqual({"first_fit": "101", "best_fit": "102", "worst_fit": "103", "preferred": "101",
+                          "weighted": "101"}, {name: spot.name for name, spot in spots.items()})
+        spots = place(self.spots, self.request, {"weighted": get_placement('weighted', {"window": 1.0})})
+        self.assertEqual("102", spots["weighted"].name)
+        self.assertEqual({"best_fit": None}, place(self.spots[:2], make_slot("5", 9, 12),
+                                                   {"best_fit": PLACEMENT_STRATEGIES['best_fit']}))
+
+    def test_best_fit_same_as_minimal_window(self):
+        strategy = PLACEMENT_STRATEGIES['best_fit']
+        for seed in range(20):
+            timetable = make_random_timetable(seed)
+            for hour in range(0, 12):
+                request = make_slot("r", hour, hour + 1)
+                candidate = strategy(get_candidates(timetable.parking_spots, request), request)
+                self.assertIs(get_minimal_window_parking_spot(timetable, request),
+                              candidate.spot if candidate is not None else None)
+
+    def test_args(self):
+        self.assertEqual(('best_fit', None), get_placement_args({}))
+        self.assertEqual(('weighted', {"window": 1.0, "load": 0.5}),
+                         get_placement_args({"placement": "weighted", "weights": "window:1,load:0.5"}))
+        self.assertRaises(ValueError, get_placement_args, {"placement": "random"})
+        self.assertRaises(ValueError, parse_weights, "size:1")
+        self.assertRaises(ValueError, parse_weights, "load:much")
+
+
+if __name__ == '__main__':
+    unittest.main()
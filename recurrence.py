@@ -0,0 +1,220 @@
+import calendar
+import datetime
+from bisect import bisect_left, bisect_right
+from math import lcm
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+DAY = 24 * 60
+WEEK = 7 * DAY
+YEAR = 366 * DAY
+MINUTE = datetime.timedelta(minutes=1)
+EPOCH = datetime.datetime(1970, 1, 1)
+INFINITY = float('inf')
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+# 1970-01-01, the day 0 of the times, was a Thursday
+EPOCH_WEEKDAY = 3
+
+
+class InvalidRule(ValueError):
+    """Raised when a recurring booking has a rule that is not supported or that is not valid"""
+
+
+def get_weekday(time):
+    """Return the day of the week of a time in UTC (or of a local time counted the same way), 0 is Monday"""
+    return (time // DAY + EPOCH_WEEKDAY) % 7
+
+
+def get_zone(timezone):
+    """Return the time zone of an IANA name, raise ValueError if there is no such zone"""
+    try:
+        return ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError("unknown time zone " + str(timezone)) from None
+
+
+def parse_until(text):
+    """Convert an UNTIL value (20211231 or 20211231T235959Z) to minutes since epoch"""
+    date_format = '%Y%m%dT%H%M%S' if 'T' in text else '%Y%m%d'
+    return calendar.timegm(datetime.datetime.strptime(text.rstrip('Z'), date_format).timetuple()) // 60
+
+
+def parse_rrule(text):
+    """Parse a recurrence rule like "FREQ=WEEKLY;INTERVAL=1;BYDAY=MO,TU,WE,TH,FR;UNTIL=20211231T000000Z" into the
+    arguments of RecurrenceRule. Only FREQ (DAILY or WEEKLY), INTERVAL, BYDAY, COUNT and UNTIL are supported, raise
+    ValueError on anything else"""
+    arguments = {}
+    for part in text.upper().split(';'):
+        name, _, value = part.partition('=')
+        if name == 'FREQ':
+            arguments['frequency'] = value.lower()
+        elif name == 'INTERVAL':
+            arguments['interval'] = int(value)
+        elif name == 'COUNT':
+            arguments['count'] = int(value)
+        elif name == 'UNTIL':
+            arguments['until'] = parse_until(value)
+        elif name == 'BYDAY':
+            arguments['weekdays'] = [WEEKDAYS.index(day) for day in value.split(',')]
+        elif name != '':
+            raise ValueError("unsupported rule part " + name)
+    if 'frequency' not in arguments:
+        raise ValueError("FREQ is missing")
+    return arguments
+
+
+class RecurrenceRule:
+    """Booking repeated every interval days or weeks (on the given days of the week) from its first occurrence
+    [start, end), at most count times or until the given time, without the occurrences that begin at one of exdates.
+
+    The days of the week and the time of the day are those of the time zone of the booking: a fixed offset from UTC
+    in minutes or an IANA name like "Europe/Prague", where the occurrences keep the local time across the daylight
+    saving changes. Occurrence n begins at local time origin + (k // m) * period + offsets[k % m] for k = n + skip,
+    where m is the number of occurrences in a period, so any occurrence is computed directly and the series is never
+    generated further than the interval asked for. Times are minutes since epoch in UTC"""
+
+    def __init__(self, id, user, start, end, frequency='daily', interval=1, weekdays=None, count=None, until=None,
+                 exdates=(), timezone=0):
+        if frequency not in ('daily', 'weekly'):
+            raise ValueError("unknown frequency " + str(frequency))
+        if interval < 1 or end <= start:
+            raise ValueError("interval has to be positive and the booking can not end before it begins")
+        self.id = id
+        self.user = user
+        self.start = start
+        self.end = end
+        self.duration = end - start
+        self.frequency = frequency
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.exdates = frozenset(exdates)
+        self.timezone = timezone
+        # fixed offset in minutes, None when it is looked up in the zone
+        self.offset = timezone if isinstance(timezone, int) else None
+        self.zone = get_zone(timezone) if self.offset is None else None
+        local_start = self.get_local_time(start)
+        if frequency == 'daily':
+            self.weekdays = None
+            self.origin, self.period, self.offsets, self.skip = local_start, interval * DAY, [0], 0
+        else:
+            weekday = get_weekday(local_start)
+            self.weekdays = sorted(set(weekdays)) if weekdays else [weekday]
+            if weekday not in self.weekdays:
+                raise ValueError("the first occurrence has to be on one of the days of the week")
+            # periods begin on Monday like in iCalendar, the days before the first occurrence are skipped
+            self.origin = local_start - weekday * DAY
+            self.period = interval * WEEK
+            self.offsets = [day * DAY for day in self.weekdays]
+            self.skip = self.weekdays.index(weekday)
+        # index of the last occurrence, None if the series never ends
+        self.last = None
+        if until is not None:
+            self.last = self.get_index(until + 1) - 1
+        if count is not None:
+            self.last = count - 1 if self.last is None else min(self.last, count - 1)
+        if self.last is not None and self.last < 0:
+            raise ValueError("the series has no occurrence")
+
+    def get_local_time(self, time):
+        """Convert a time in UTC to the local time of the booking, counted in minutes since epoch like UTC"""
+        if self.offset is not None:
+            return time + self.offset
+        return time + datetime.datetime.fromtimestamp(time * 60, self.zone).utcoffset() // MINUTE
+
+    def get_utc_time(self, local_time):
+        """Convert a local time of the booking to UTC, a local time skipped by a daylight saving change is taken with
+        the offset before the change"""
+        if self.offset is not None:
+            return local_time - self.offset
+        return local_time - (EPOCH + local_time * MINUTE).replace(tzinfo=self.zone).utcoffset() // MINUTE
+
+    def get_start(self, n):
+        """Return the start of the occurrence n, exdates are not taken into account"""
+        k = n + self.skip
+        local_start = self.origin + k // len(self.offsets) * self.period + self.offsets[k % len(self.offsets)]
+        return self.get_utc_time(local_start)
+
+    def get_index(self, time):
+        """Return the index of the first occurrence that begins at time or later"""
+        if time <= self.start:
+            return 0
+        local_time = self.get_local_time(time)
+        period = (local_time - self.origin) // self.period
+        n = period * len(self.offsets) + bisect_left(self.offsets, local_time - self.origin - period * self.period) \
+            - self.skip
+        # around a daylight saving change the local time is off by the change, the occurrences are at least a day apart
+        while n > 0 and self.get_start(n - 1) >= time:
+            n -= 1
+        while self.get_start(n) < time:
+            n += 1
+        return n
+
+    def get_end(self):
+        """Return the end of the last occurrence, infinity if the series never ends"""
+        return self.get_start(self.last) + self.duration if self.last is not None else INFINITY
+
+    def occurrences(self, start, end, exclude=True):
+        """Yield (start, end) of the occurrences that overlap the interval [start, end), without the exdates unless
+        exclude is False"""
+        n = self.get_index(start - self.duration + 1)
+        while self.last is None or n <= self.last:
+            occurrence_start = self.get_start(n)
+            if occurrence_start >= end:
+                return
+            if not (exclude and occurrence_start in self.exdates):
+                yield occurrence_start, occurrence_start + self.duration
+            n += 1
+
+    def overlaps(self, start, end):
+        """Check if an occurrence overlaps the interval [start, end), only the occurrences around it are computed"""
+        return next(self.occurrences(start, end), None) is not None
+
+    def get_conflict(self, parking_spot):
+        """Return the index of a reservation of a parking spot that overlaps an occurrence, None if there is none.
+        Either every reservation in the span of the series is checked against the rule or every occurrence is looked
+        up among the reservations, whichever is less work"""
+        starts, ends = parking_spot.starts, parking_spot.ends
+        first, last = bisect_right(ends, self.start), bisect_left(starts, self.get_end())
+        if self.last is not None and self.last + 1 < last - first:
+            for start, end in self.occurrences(self.start, self.get_end()):
+                idx = bisect_left(starts, end)
+                if idx > 0 and ends[idx - 1] > start:
+                    return idx - 1
+            return None
+        for idx in range(first, last):
+            if self.overlaps(starts[idx], ends[idx]):
+                return idx
+        return None
+
+    def conflicts_with(self, other):
+        """Check if an occurrence overlaps an occurrence of another rule. Once both series have begun, they repeat
+        together after the least common multiple of their periods, so only that long is checked (and a year longer
+        with a time zone that has daylight saving changes). Exdates are ignored, a conflict is reported even if it is
+        excluded in the checked period but not in the later ones"""
+        start = max(self.start, other.start)
+        span = lcm(self.period, other.period)
+        if self.zone is not None or other.zone is not None:
+            span += YEAR
+        end = min(self.get_end(), other.get_end(), start + span + self.duration)
+        for occurrence_start, occurrence_end in self.occurrences(start, end, exclude=False):
+            if next(other.occurrences(occurrence_start, occurrence_end, exclude=False), None) is not None:
+                return True
+        return False
+
+    def format(self):
+        """Return the rule in the form parsed by parse_rrule"""
+        parts = ["FREQ=" + self.frequency.upper(), "INTERVAL=" + str(self.interval)]
+        if self.weekdays is not None:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[day] for day in self.weekdays))
+        if self.count is not None:
+            parts.append("COUNT=" + str(self.count))
+        if self.until is not None:
+            parts.append("UNTIL=" + datetime.datetime.fromtimestamp(self.until * 60, datetime.timezone.utc)
+                         .strftime('%Y%m%dT%H%M%SZ'))
+        return ";".join(parts)
+
+    def to_dict(self):
+        """Return the arguments the rule was created with"""
+        return {"id": self.id, "user": self.user, "start": self.start, "end": self.end, "frequency": self.frequency,
+                "interval": self.interval, "weekdays": self.weekdays, "count": self.count, "until": self.until,
+                "exdates": sorted(self.exdates), "timezone": self.timezone}
@@ -0,0 +1,223 @@
+import copy
+import datetime
+import os
+import random
+import tempfile
+import unittest
+from bisect import bisect_left
+from recurrence import RecurrenceRule, InvalidRule, parse_rrule, get_weekday, DAY
+from zoneinfo import ZoneInfo
+from reservation import ParkingSpot, TimeSlot, Timetable, convert_date_to_time, optimize_timetable, \
+    process_reservation_request, process_batch_reservation_request, get_rule, get_rule_element
+from reservation_unittest import test_data
+from snapshot import Snapshot
+from store import TimetableStore
+
+# Monday 2021-04-19 8:00 UTC
+MONDAY = convert_date_to_time("2021-04-19T08:00:00+00:00")
+
+
+def expand(rule, start, end):
+    """Occurrences of a rule found by going through it day by day"""
+    occurrences, n, day = [], 0, 0
+    while rule.start + day * DAY < end + DAY * 7 * rule.interval:
+        time = rule.start + day * DAY
+        if rule.frequency == 'daily':
+            matches = day % rule.interval == 0
+        else:
+            week = (day + get_weekday(rule.start)) // 7
+            matches = get_weekday(time) in rule.weekdays and week % rule.interval == 0
+        if matches:
+            if (rule.count is not None and n >= rule.count) or (rule.until is not None and time > rule.until):
+                break
+            n += 1
+            if time not in rule.exdates and time < end and time + rule.duration > start:
+                occurrences.append((time, time + rule.duration))
+        day += 1
+    return occurrences
+
+
+def make_element(id, spot, start, end, rrule=None, exdate=None):
+    element = copy.deepcopy(test_data['winstrom']['udalost'][0])
+    element.update({"id": id, "predmet": spot, "zahajeni": start, "dokonceni": end})
+    if rrule is not None:
+        element['rrule'] = rrule
+    if exdate is not None:
+        element['exdate'] = exdate
+    return element
+
+
+class RecurrenceRuleTestCase(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual({"frequency": 'weekly', "interval": 2, "weekdays": [0, 4], "count": 10},
+                         parse_rrule("FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,FR;COUNT=10"))
+        self.assertEqual(convert_date_to_time("2021-12-31T00:00:00+00:00"),
+                         parse_rrule("FREQ=DAILY;UNTIL=20211231")['until'])
+        self.assertRaises(ValueError, parse_rrule, "FREQ=DAILY;BYHOUR=8")
+        self.assertRaises(ValueError, parse_rrule, "INTERVAL=2")
+        rule = RecurrenceRule("1", "user", MONDAY, MONDAY + 60, **parse_rrule("FREQ=WEEKLY;BYDAY=MO,WE;UNTIL=20211231"))
+        self.assertEqual(rule.to_dict(), RecurrenceRule(**dict(rule.to_dict(), **parse_rrule(rule.format()))).to_dict())
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, RecurrenceRule, "1", "user", MONDAY, MONDAY + 60, 'weekly', weekdays=[1])
+        self.assertRaises(ValueError, RecurrenceRule, "1", "user", MONDAY, MONDAY + 60, 'monthly')
+        self.assertRaises(ValueError, RecurrenceRule, "1", "user", MONDAY, MONDAY + 60, until=MONDAY - 1)
+
+    def test_weekdays(self):
+        rule = RecurrenceRule("1", "user", MONDAY, MONDAY + 60, 'weekly', weekdays=[0, 1, 2, 3, 4],
+                              exdates=[MONDAY + 2 * DAY])
+        self.assertEqual([MONDAY, MONDAY + DAY, MONDAY + 3 * DAY, MONDAY + 4 * DAY, MONDAY + 7 * DAY],
+                         [start for start, _ in rule.occurrences(MONDAY, MONDAY + 7 * DAY + 1)])
+        self.assertEqual([], list(rule.occurrences(MONDAY + 5 * DAY, MONDAY + 7 * DAY)))
+        self.assertTrue(rule.overlaps(MONDAY + 7 * DAY + 59, MONDAY + 7 * DAY + 120))
+        self.assertFalse(rule.overlaps(MONDAY + 2 * DAY, MONDAY + 2 * DAY + 60))
+
+    def test_same_as_day_by_day(self):
+        rnd = random.Random(0)
+        for _ in range(200):
+            start = MONDAY + rnd.randrange(7) * DAY + rnd.randrange(DAY)
+            frequency = rnd.choice(['daily', 'weekly'])
+            weekdays = rnd.sample(range(7), rnd.randint(0, 4)) + [get_weekday(start)]
+            limit = rnd.choice([{}, {"count": rnd.randint(1, 30)}, {"until": start + rnd.randrange(60 * DAY)}])
+            exdates = [start + rnd.randrange(30) * DAY for _ in range(3)]
+            rule = RecurrenceRule("1", "user", start, start + rnd.randint(1, 2 * DAY), frequency, rnd.randint(1, 3),
+                                  weekdays, exdates=exdates, **limit)
+            window_start = start + rnd.randint(-5 * DAY, 50 * DAY)
+            window_end = window_start + rnd.randint(1, 20 * DAY)
+            self.assertEqual(expand(rule, window_start, window_end),
+                             list(rule.occurrences(window_start, window_end)))
+
+    def test_offset(self):
+        # Sunday 1:00 in +02:00 is Saturday in UTC
+        element = make_element("1", "101", "2021-04-18T01:00:00+02:00", "2021-04-18T02:00:00+02:00",
+                               "FREQ=WEEKLY;BYDAY=SU")
+        rule = get_rule(element)
+        self.assertEqual(6, get_weekday(rule.get_local_time(rule.get_start(3))))
+        self.assertRaises(ValueError, get_rule, dict(element, rrule="FREQ=WEEKLY;BYDAY=SA"))
+        self.assertEqual(element['zahajeni'], get_rule_element("101", rule)['zahajeni'])
+        self.assertEqual(rule.to_dict(), get_rule(get_rule_element("101", rule)).to_dict())
+
+    def test_daylight_saving(self):
+        zone = ZoneInfo("Europe/Prague")
+        first = datetime.datetime(2021, 3, 20, 8, 30, tzinfo=zone)
+        starts = [int((first + datetime.timedelta(days=day)).timestamp()) // 60 for day in range(240)]
+        rule = RecurrenceRule("1", "user", starts[0], starts[0] + 60, timezone="Europe/Prague")
+        self.assertEqual(starts, [start for start, _ in rule.occurrences(starts[0], starts[-1] + 1)])
+        for time in range(starts[0] - 100, starts[-1], 37):
+            self.assertEqual(bisect_left(starts, time), rule.get_index(time))
+        element = get_rule_element("101", rule)
+        self.assertEqual(("2021-03-20T08:30:00+01:00", "Europe/Prague"), (element['zahajeni'], element['tzid']))
+        self.assertEqual(rule.to_dict(), get_rule(element).to_dict())
+        self.assertRaises(ValueError, get_rule, dict(element, tzid="Europe/Nowhere"))
+
+    def test_conflicts(self):
+        rule = RecurrenceRule("1", "user", MONDAY, MONDAY + 60, 'weekly', weekdays=[0, 2], count=4)
+        parking_spot = ParkingSpot("101", True)
+        parking_spot.add_reservation(TimeSlot("2", "user", MONDAY + DAY, MONDAY + DAY + 60))
+        self.assertIsNone(rule.get_conflict(parking_spot))
+        parking_spot.add_reservation(TimeSlot("3", "user", MONDAY + 9 * DAY + 30, MONDAY + 9 * DAY + 90))
+        self.assertEqual(1, rule.get_conflict(parking_spot))
+        for i in range(10):  # more reservations than occurrences, the occurrences are looked up
+            parking_spot.add_reservation(TimeSlot(str(i + 4), "user", MONDAY + 100 + i, MONDAY + 101 + i))
+        self.assertEqual(11, rule.get_conflict(parking_spot))
+        endless = RecurrenceRule("4", "user", MONDAY, MONDAY + 60, 'daily')
+        self.assertEqual(10, endless.get_conflict(parking_spot))
+
+        # every other Tuesday against every third day from Thursday, they meet on the Tuesday after four weeks
+        tuesdays = RecurrenceRule("5", "user", MONDAY + DAY, MONDAY + DAY + 60, 'weekly', interval=2)
+        self.assertTrue(tuesdays.conflicts_with(RecurrenceRule("6", "user", MONDAY + 3 * DAY + 30,
+                                                               MONDAY + 3 * DAY + 90, 'daily', interval=3)))
+        self.assertFalse(tuesdays.conflicts_with(RecurrenceRule("7", "user", MONDAY + 3 * DAY + 30,
+                                                                MONDAY + 3 * DAY + 90, 'daily', interval=7)))
+
+
+class RecurringTimetableTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = copy.deepcopy(test_data)
+        # 101 every weekday 8:00-17:00 from 2021-04-19
+        self.data['winstrom']['udalost'].append(make_element("r1", "101", "2021-04-19T08:00:00+00:00",
+                                                             "2021-04-19T17:00:00+00:00",
+                                                             "FREQ=WEEKLY;BYDAY=MO,TU,WE,TH,FR",
+                                                             ["2021-04-21T08:00:00+00:00"]))
+
+    def test_lazy_expansion(self):
+        timetable = Timetable(self.data['winstrom']['udalost'], self.data)
+        parking_spot = timetable.get_parking_spot("101")
+        count = len(parking_spot.reservations)
+        timetable.expand_rules(MONDAY + 3 * DAY, MONDAY + 8 * DAY)
+        self.assertEqual(3, len(parking_spot.reservations) - count)
+        timetable.expand_rules(MONDAY, MONDAY + 10 * DAY)
+        self.assertEqual(7, len(parking_spot.reservations) - count)
+        self.assertEqual([MONDAY, MONDAY + DAY, MONDAY + 3 * DAY], parking_spot.starts[count:count + 3])
+        self.assertEqual("101", timetable.get_assignments()["r1"])
+        # a query far ahead leaves only its own occurrences in the spot
+        timetable.expand_rules(MONDAY + 1092 * DAY, MONDAY + 1095 * DAY)
+        self.assertEqual([MONDAY + 1092 * DAY, MONDAY + 1093 * DAY, MONDAY + 1094 * DAY], parking_spot.starts[count:])
+        timetable.expand_rules(MONDAY + 3 * DAY, MONDAY + 8 * DAY)
+        self.assertEqual([MONDAY + 3 * DAY, MONDAY + 4 * DAY, MONDAY + 7 * DAY], parking_spot.starts[count:])
+
+    def test_reserve(self):
+        request = make_element("2", "", "2021-04-26T07:00:00+00:00", "2021-04-26T09:00:00+00:00")
+        self.data['winstrom']['udalost'].append(request)
+        timetable = Timetable(self.data['winstrom']['udalost'], self.data)
+        self.assertTrue(timetable.get_parking_spot("101").fits(MONDAY + 7 * DAY - 60, MONDAY + 7 * DAY + 60))
+        timetable.expand_rules(MONDAY + 7 * DAY, MONDAY + 8 * DAY)
+        self.assertFalse(timetable.get_parking_spot("101").fits(MONDAY + 7 * DAY - 60, MONDAY + 7 * DAY + 60))
+        # a series that meets r1 only in the third week does not get 101
+        recurring = make_element("3", "", "2021-04-19T17:00:00+00:00", "2021-04-19T18:00:00+00:00",
+                                 "FREQ=DAILY;COUNT=30")
+        self.data['winstrom']['udalost'][-1] = recurring
+        self.data['winstrom']['udalost'].append(make_element("4", "101", "2021-05-05T16:00:00+00:00",
+                                                             "2021-05-05T16:30:00+00:00"))
+        self.assertNotIn(process_reservation_request(self.data)['predmet'], ("", "101"))
+        self.data['winstrom']['udalost'].append(request)
+        assignments = {element['id']: element['predmet'] for element in process_batch_reservation_request(self.data)}
+        self.assertNotEqual("101", assignments["2"])
+
+    def test_optimize_keeps_rule_spots(self):
+        self.data['winstrom']['udalost'].append(make_element("5", "101", "2021-05-01T08:00:00+00:00",
+                                                             "2021-05-01T09:00:00+00:00"))
+        timetable = Timetable(self.data['winstrom']['udalost'], self.data)
+        optimized = optimize_timetable(timetable)
+        self.assertEqual("101", optimized.get_assignments()["5"])
+        self.assertTrue(optimized.get_parking_spot("101").is_reservable)
+        self.assertTrue(timetable.get_parking_spot("101").is_reservable)
+
+
+class RecurringStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'timetable.snap')
+        self.store = TimetableStore(snapshot=Snapshot(self.path))
+        self.store.load([make_element("r1", "101", "2021-04-19T08:00:00+00:00", "2021-04-19T17:00:00+00:00",
+                                      "FREQ=DAILY")])
+
+    def tearDown(self):
+        self.store.snapshot.close()
+        self.directory.cleanup()
+
+    def test_invalid_rule(self):
+        version = self.store.version
+        self.assertRaises(InvalidRule, self.store.reserve, make_element("r1", "", "2021-04-20T08:00:00+00:00",
+                                                                        "2021-04-20T17:00:00+00:00", "FREQ=MONTHLY"))
+        self.assertEqual((version, "101"), (self.store.version, self.store.records["r1"]['predmet']))
+
+    def test_events_and_restore(self):
+        record = self.store.reserve(make_element("r2", "", "2021-04-20T08:00:00+00:00", "2021-04-20T17:00:00+00:00",
+                                                 "FREQ=WEEKLY"))
+        self.assertNotIn(record['predmet'], ("", "101"))
+        self.store.apply({"action": "modify", "udalost": {"id": "r1", "rrule": "FREQ=DAILY;COUNT=3"}})
+        self.assertEqual(1, len(self.store.timetable.rules["101"]))
+        self.store.snapshot.close()
+
+        store = TimetableStore(snapshot=Snapshot(self.path))
+        self.addCleanup(store.snapshot.close)
+        self.assertEqual(self.store.version, store.restore())
+        self.assertEqual("FREQ=DAILY;INTERVAL=1;COUNT=3", store.records["r1"]['rrule'])
+        self.assertEqual(3, len(list(store.timetable.rules["101"][0].occurrences(MONDAY, MONDAY + 30 * DAY))))
+        store.apply({"action": "remove", "udalost": {"id": "r2"}})
+        self.assertEqual([], store.timetable.rules[record['predmet']])
+
+
+if __name__ == '__main__':
+    unittest.main()
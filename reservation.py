@@ -1,21 +1,64 @@
-import copy
+import atexit
 import datetime
 import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from datetime import timedelta
+from functools import lru_cache
+from itertools import repeat
+
+from cache import get_timetable_key
+from inventory import inventory as spot_inventory
+from metrics import timed
+from placement import get_candidates, get_placement
+from recurrence import RecurrenceRule, InvalidRule, parse_rrule
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+EPOCH_ORDINAL = EPOCH.toordinal()
+ISO_DATE_TIME = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d)(?::\d\d(?:\.\d+)?)?(Z|[+-]\d\d:\d\d)?$')
+# the sharded optimization runs in this many processes, shards have at least SHARD_MIN_SIZE reservations
+SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', os.cpu_count() or 1))
+SHARD_MIN_SIZE = 5000
+# occurrences of recurring bookings are expanded this long around a request, so that its neighbours are known
+RULE_MARGIN = 24 * 60
+# pools of processes of the sharded optimization by number of workers
+shard_executors = {}
+logger = logging.getLogger(__name__)
 
 
 class TimeSlot:
+    __slots__ = ('id', 'user', 'start', 'end')
+
     def __init__(self, id, user, start, end):
         self.id = id
-        self.user = user
+        self.user = sys.intern(user)
         self.start = start
         self.end = end
 
 
 class ParkingSpot:
-    def __init__(self, name, reservable, reservations=None):
+    """Parking spot with its reservations kept sorted by start time.
+
+    Start and end times of the reservations are mirrored in parallel sorted arrays, so neighbour lookups and
+    free interval checks are a binary search instead of a scan. Reservations on a single spot never overlap, therefore
+    the end times are sorted as well."""
+
+    def __init__(self, name, reservable, reservations=None, attributes=None):
         self.name = name
+        self.attributes = attributes if attributes is not None else {}
         self.reservations = []
+        self.starts = []
+        self.ends = []
+        # number of inserts and deletes, tells indexes built from the reservations that they are out of date
+        self.changes = 0
 
         if reservable:
             self.is_reservable = True
@@ -25,71 +68,232 @@ class ParkingSpot:
         if reservations is not None:
             for time_slot in reservations:
                 start, end = get_reservation_time(time_slot['start'], time_slot['end'])
-                self.reservations.append(TimeSlot(time_slot['id'], time_slot['user'], start, end))
+                self.add_reservation(TimeSlot(time_slot['id'], time_slot['user'], start, end))
 
     def __str__(self):
         return self.name + ": " + ", ".join(
-            [str(time.start) + " - " + str(time.end) + " (user " + time.user + ")" for time in self.reservations])
+            [convert_time_to_date(time.start) + " - " + convert_time_to_date(time.end) + " (user " + time.user + ")"
+             for time in self.reservations])
+
+    def _insert(self, idx, time_slot):
+        self.reservations.insert(idx, time_slot)
+        self.starts.insert(idx, time_slot.start)
+        self.ends.insert(idx, time_slot.end)
+        self.changes += 1
+
+    def _delete(self, idx):
+        del self.reservations[idx]
+        del self.starts[idx]
+        del self.ends[idx]
+        self.changes += 1
+
+    def find(self, slot):
+        """Return the index of a reservation with the same start and end as the given slot, None if there is none"""
+        idx = bisect_left(self.starts, slot.start)
+        while idx < len(self.starts) and self.starts[idx] == slot.start:
+            if self.ends[idx] == slot.end:
+                return idx
+            idx += 1
+        return None
 
     def get_next_time_slot(self, slot):
-        next_slot = None
-        for idx, time_slot in enumerate(self.reservations):
-            if time_slot.start == slot.start and time_slot.end == slot.end:
-                next_slot = self.reservations[idx + 1] if idx < len(self.reservations) - 1 else None
-        return next_slot
+        idx = self.find(slot)
+        if idx is None or idx == len(self.reservations) - 1:
+            return None
+        return self.reservations[idx + 1]
 
     def get_previous_time_slot(self, slot):
-        prev_slot = None
-        for idx, time_slot in enumerate(self.reservations):
-            if time_slot.start == slot.start and time_slot.end == slot.end:
-                prev_slot = self.reservations[idx - 1] if idx > 0 else None
-        return prev_slot
+        idx = self.find(slot)
+        if idx is None or idx == 0:
+            return None
+        return self.reservations[idx - 1]
+
+    def get_neighbours(self, start, end):
+        """Return the reservations right before and right after the interval [start, end). The interval fits on the
+        spot if the first one ends before start and the second one begins after end"""
+        idx = bisect_left(self.starts, end)
+        previous_slot = self.reservations[idx - 1] if idx > 0 else None
+        next_slot = self.reservations[idx] if idx < len(self.reservations) else None
+        return previous_slot, next_slot
+
+    def fits(self, start, end):
+        """Check if the interval [start, end) can be put on the spot without overlapping any reservation"""
+        idx = bisect_left(self.starts, end)
+        return idx == 0 or self.ends[idx - 1] <= start
+
+    def get_window(self, start, end):
+        """Return the smallest gap between the interval [start, end) and its neighbouring reservations.
+        Return None if the interval does not fit or there are no reservations on the spot"""
+        previous_slot, next_slot = self.get_neighbours(start, end)
+        if previous_slot is not None and previous_slot.end > start:
+            return None
+        window = None
+        if previous_slot is not None:
+            window = start - previous_slot.end
+        if next_slot is not None and (window is None or next_slot.start - end < window):
+            window = next_slot.start - end
+        return window
+
+    def get_first_time_slot_after(self, time):
+        """Return the first reservation that starts at the given time or later"""
+        idx = bisect_left(self.starts, time)
+        return self.reservations[idx] if idx < len(self.reservations) else None
+
+    def empty_copy(self):
+        """Return a parking spot with the same name and reservability but without any reservations"""
+        return ParkingSpot(self.name, self.is_reservable, attributes=self.attributes)
 
     def add_reservation(self, interval):
         """Insert a reservation so that the array of reservations remains sorted"""
-        for idx, time_slot in enumerate(self.reservations):
-            if interval.start <= time_slot.start:
-                self.reservations.insert(idx, interval)
-                return
-        self.reservations.append(interval)  # append to the end
+        self._insert(bisect_left(self.starts, interval.start), interval)
 
     def remove_reservation(self, reservation):
         """Remove a reservation from the old_timetable"""
+        idx = self.find(reservation)
+        if idx is not None:
+            self._delete(idx)
+
+    def find_id(self, id):
+        """Return the index of the reservation with a given id, None if there is none. Runs in O(n)"""
         for idx, time_slot in enumerate(self.reservations):
-            if reservation.start == time_slot.start and reservation.end == time_slot.end:
-                self.reservations.remove(time_slot)
-                break
+            if time_slot.id == id:
+                return idx
+        return None
+
+
+class SymbolTable:
+    """Strings numbered in the order they were added, each of them is stored only once"""
+
+    def __init__(self):
+        self.values = []
+        self.indexes = {}
+
+    def index(self, value):
+        idx = self.indexes.get(value)
+        if idx is None:
+            idx = self.indexes[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return idx
+
+    def encode_id(self, id):
+        """Return a reservation id as a number. Decimal ids are stored as they are, other ones as negative indexes"""
+        if id.isdecimal() and id.isascii() and len(id) < 19 and (id[0] != '0' or id == '0'):
+            return int(id)
+        return -1 - self.index(id)
+
+    def decode_id(self, number):
+        return str(number) if number >= 0 else self.values[-1 - number]
+
+    def find_id(self, id):
+        """Return a reservation id as a number without adding it to the table, None if it has never been added"""
+        if id.isdecimal() and id.isascii() and len(id) < 19 and (id[0] != '0' or id == '0'):
+            return int(id)
+        idx = self.indexes.get(id)
+        return -1 - idx if idx is not None else None
+
+
+class CompactReservations(Sequence):
+    """Read-only list of the reservations of a compact parking spot, time slots are created when they are read"""
+
+    def __init__(self, spot):
+        self.spot = spot
+
+    def __len__(self):
+        return len(self.spot.starts)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        spot = self.spot
+        return TimeSlot(spot.symbols.decode_id(spot.ids[idx]), spot.symbols.values[spot.users[idx]],
+                        spot.starts[idx], spot.ends[idx])
+
+
+class CompactParkingSpot(ParkingSpot):
+    """Parking spot which keeps its reservations column-wise in arrays of integers (start, end, id and index of the
+    user) instead of TimeSlot objects. Spots of a timetable share one table of the user names and ids"""
+
+    def __init__(self, name, reservable, reservations=None, symbols=None, attributes=None):
+        super().__init__(name, reservable, attributes=attributes)
+        self.symbols = symbols if symbols is not None else SymbolTable()
+        self.starts = array('q')
+        self.ends = array('q')
+        self.ids = array('q')
+        self.users = array('i')
+        self.reservations = CompactReservations(self)
+
+        if reservations is not None:
+            for time_slot in reservations:
+                start, end = get_reservation_time(time_slot['start'], time_slot['end'])
+                self.add_reservation(TimeSlot(time_slot['id'], time_slot['user'], start, end))
+
+    def _insert(self, idx, time_slot):
+        self.starts.insert(idx, time_slot.start)
+        self.ends.insert(idx, time_slot.end)
+        self.ids.insert(idx, self.symbols.encode_id(time_slot.id))
+        self.users.insert(idx, self.symbols.index(time_slot.user))
+        self.changes += 1
+
+    def _delete(self, idx):
+        del self.starts[idx]
+        del self.ends[idx]
+        del self.ids[idx]
+        del self.users[idx]
+        self.changes += 1
+
+    def find_id(self, id):
+        number = self.symbols.find_id(id)
+        try:
+            return self.ids.index(number) if number is not None else None
+        except ValueError:
+            return None
+
+    def empty_copy(self):
+        return CompactParkingSpot(self.name, self.is_reservable, symbols=self.symbols, attributes=self.attributes)
 
 
 class Timetable:
-    def __init__(self, reservations=None, json_data=None):
+    def __init__(self, reservations=None, json_data=None, compact=False, inventory=None):
+        """The parking spots are taken from a SpotInventory, the one from SPOT_INVENTORY by default. With compact the
+        reservations are kept in arrays of integers instead of TimeSlot objects, which takes several times less memory
+        for large timetables but makes reading of single reservations slower.
+
+        Recurring bookings (elements with rrule) are kept as rules, their occurrences are added to the parking spots
+        only within the window that has been asked for (see expand_rules)"""
         self.parking_spots = []
+        self.spots = {}
+        self.symbols = SymbolTable() if compact else None
         self.original_json = json_data
-        reservable_spots = None
-
-        if reservations:
-            for element in reservations:
-                if element['predmet'] == "":
-                    if 'reservation' in element.keys():
-                        reservable_spots = []
-                        for spot in element['reservation']:
-                            reservable_spots.append(spot)
-
-        for i in range(101, 121):
-            if reservable_spots is not None and str(i) in reservable_spots:
-                self.parking_spots.append(ParkingSpot(str(i), True))  # TODO: add reservability info
-            elif reservable_spots is not None:
-                self.parking_spots.append(ParkingSpot(str(i), False))
-            else:
-                self.parking_spots.append(ParkingSpot(str(i), True))
+        self.records = {}
+        # spot name -> recurring bookings on the spot
+        self.rules = {}
+        # working window (start, end), the occurrences which overlap it are in the parking spots, None if none are
+        self.expanded = None
+        self.inventory = inventory or spot_inventory
+
+        if json_data is not None:
+            for element in json_data['winstrom']['udalost']:
+                self.records[element['id']] = element
+
+        spots = self.inventory.get_spots()
+        # version of the inventory the spots are from, see update_spots
+        self.inventory_version = self.inventory.version
+        for name, reservable, attributes in spots:
+            self.add_parking_spot(self.make_parking_spot(name, reservable, attributes))
 
         if reservations is not None:
-            for reservation_info in reservations:
-                # print(reservation_info)
-                for spot in self.parking_spots:
-                    if spot.name == reservation_info['predmet']:
-                        start, end = get_reservation_time(reservation_info['zahajeni'], reservation_info['dokonceni'])
-                        spot.add_reservation(TimeSlot(reservation_info['id'], reservation_info['zodpPrac'], start, end))
+            for element in reservations:
+                self.set_reservable_spots(element)
+
+            spots = self.spots
+            assigned = [element for element in reservations if element['predmet'] in spots and 'rrule' not in element]
+            starts = convert_dates_to_times([element['zahajeni'] for element in assigned])
+            ends = convert_dates_to_times([element['dokonceni'] for element in assigned])
+            for element, start, end in zip(assigned, starts, ends):
+                spots[element['predmet']].add_reservation(TimeSlot(element['id'], element['zodpPrac'], start, end))
+            for element in reservations:
+                if 'rrule' in element and element['predmet'] in spots:
+                    self.add_rule(element['predmet'], get_rule(element))
 
     def __str__(self):
         """Print every parking spot and its actual reservations"""
@@ -98,24 +302,147 @@ class Timetable:
             out_str = out_str + str(parking_spot) + "\n"
         return out_str
 
+    def set_reservable_spots(self, element):
+        """Update reservability of the parking spots from the list of spots sent along with a reservation request"""
+        if element['predmet'] == "" and 'reservation' in element.keys():
+            reservable = set(element['reservation'])
+            for parking_spot in self.parking_spots:
+                parking_spot.is_reservable = parking_spot.name in reservable
+
+    def get_parking_spot(self, name):
+        """Return the parking spot with a given name, None if there is none"""
+        return self.spots.get(name)
+
     def add_reservation(self, target_parking_spot, time_interval):
-        for parking_spot in self.parking_spots:
-            if parking_spot.name == target_parking_spot.name:
-                parking_spot.add_reservation(time_interval)
+        parking_spot = self.spots.get(target_parking_spot.name)
+        if parking_spot is not None:
+            parking_spot.add_reservation(time_interval)
 
     def remove_reservation(self, spot_name, interval):
+        parking_spot = self.spots.get(spot_name)
+        if parking_spot is not None:
+            parking_spot.remove_reservation(interval)
+
+    def empty_copy(self):
+        """Return a timetable with the same parking spots but without any reservations"""
+        timetable = Timetable(inventory=self.inventory)
+        timetable.inventory_version = self.inventory_version
+        timetable.original_json = self.original_json
+        timetable.records = self.records
+        timetable.symbols = self.symbols
+        timetable.rules = {name: list(rules) for name, rules in self.rules.items()}
+        timetable.parking_spots = []
+        timetable.spots = {}
         for parking_spot in self.parking_spots:
-            if parking_spot.name == spot_name:
-                parking_spot.remove_reservation(interval)
+            timetable.add_parking_spot(parking_spot.empty_copy())
+        return timetable
+
+    def make_parking_spot(self, name, reservable, attributes):
+        """Return a new parking spot without reservations of the same kind as the others"""
+        if self.symbols is not None:
+            return CompactParkingSpot(name, reservable, symbols=self.symbols, attributes=attributes)
+        return ParkingSpot(name, reservable, attributes=attributes)
+
+    def update_spots(self):
+        """Bring the parking spots of a long-lived timetable up to date with the inventory if it has changed since they
+        were read: new spots are added, reservability and attributes of the others are taken from the inventory and
+        spots that are no longer in it are dropped (see drop_parking_spot). Return True if the inventory has changed"""
+        self.inventory.get_spots()  # reads the file again if it is time to check it
+        version = self.inventory.version
+        if version == self.inventory_version:
+            return False
+        self.inventory_version = version
+        names = set()
+        for name, reservable, attributes in self.inventory.spots:
+            names.add(name)
+            parking_spot = self.spots.get(name)
+            if parking_spot is None:
+                self.add_parking_spot(self.make_parking_spot(name, reservable, attributes))
+            else:
+                parking_spot.is_reservable = reservable
+                parking_spot.attributes = attributes
+        for parking_spot in list(self.parking_spots):
+            if parking_spot.name not in names:
+                self.drop_parking_spot(parking_spot)
+        return True
+
+    def drop_parking_spot(self, parking_spot):
+        """Remove a parking spot that is no longer in the inventory. A spot with reservations or recurring bookings is
+        kept as not reservable instead, so that they are not lost and no new ones are placed there"""
+        if len(parking_spot.starts) > 0 or self.rules.get(parking_spot.name):
+            parking_spot.is_reservable = False
+            return
+        self.parking_spots.remove(parking_spot)
+        del self.spots[parking_spot.name]
+        self.rules.pop(parking_spot.name, None)
+
+    def add_rule(self, spot_name, rule):
+        """Add a recurring booking to a parking spot, its occurrences within the expanded window are added right away"""
+        self.rules.setdefault(spot_name, []).append(rule)
+        if self.expanded is not None:
+            for start, end in rule.occurrences(*self.expanded):
+                self.spots[spot_name].add_reservation(TimeSlot(rule.id, rule.user, start, end))
+
+    def remove_rule(self, spot_name, rule):
+        """Remove a recurring booking and its expanded occurrences from a parking spot"""
+        self.rules[spot_name].remove(rule)
+        if self.expanded is not None:
+            for start, end in rule.occurrences(*self.expanded):
+                self.spots[spot_name].remove_reservation(TimeSlot(rule.id, rule.user, start, end))
+
+    def find_rule(self, id):
+        """Return the name of the parking spot and the recurring booking with a given id, None if there is none"""
+        for spot_name, rules in self.rules.items():
+            for rule in rules:
+                if rule.id == id:
+                    return spot_name, rule
+        return None
+
+    def rule_fits(self, parking_spot, rule):
+        """Check if no occurrence of a recurring booking overlaps a reservation or an occurrence of another
+        recurring booking on a parking spot. The series is never expanded, it is checked against every reservation and
+        every other rule"""
+        return (rule.get_conflict(parking_spot) is None
+                and not any(rule.conflicts_with(other) for other in self.rules.get(parking_spot.name, ())))
+
+    def expand_rules(self, start, end):
+        """Make [start, end) the working window: the parking spots get the occurrences of the recurring bookings which
+        overlap it and lose those of the previous window which do not, so that a query far ahead does not leave its
+        occurrences behind. Only the occurrences in the difference of the two windows are computed"""
+        old = self.expanded
+        if old == (start, end):
+            return
+        for spot_name, rules in self.rules.items():
+            parking_spot = self.spots[spot_name]
+            for rule in rules:
+                if old is not None:
+                    for segment_start, segment_end in get_difference(old, (start, end)):
+                        for occurrence_start, occurrence_end in rule.occurrences(segment_start, segment_end):
+                            if occurrence_end <= start or occurrence_start >= end:
+                                parking_spot.remove_reservation(TimeSlot(rule.id, rule.user, occurrence_start,
+                                                                         occurrence_end))
+                for segment_start, segment_end in get_difference((start, end), old):
+                    for occurrence_start, occurrence_end in rule.occurrences(segment_start, segment_end):
+                        if old is None or occurrence_end <= old[0] or occurrence_start >= old[1]:
+                            parking_spot.add_reservation(TimeSlot(rule.id, rule.user, occurrence_start,
+                                                                  occurrence_end))
+        self.expanded = (start, end)
 
     def add_parking_spot(self, parking_spot):
-        self.parking_spots.append(parking_spot)
+        """Add a parking spot, a spot with the same name is replaced"""
+        old_spot = self.spots.get(parking_spot.name)
+        if old_spot is not None:
+            self.parking_spots[self.parking_spots.index(old_spot)] = parking_spot
+        else:
+            self.parking_spots.append(parking_spot)
+        self.spots[parking_spot.name] = parking_spot
 
     def get_spot_with_earliest_time_slot(self):
-        earliest_start = timedelta(hours=99999, minutes=0)
+        earliest_start = None
         spot, earliest_time_slot = None, None
         for parking_spot in self.parking_spots:
-            if parking_spot.is_reservable and len(parking_spot.reservations) > 0 and parking_spot.reservations[0].start <= earliest_start:
+            if parking_spot.is_reservable and len(parking_spot.reservations) > 0 and (
+                    earliest_start is None or parking_spot.reservations[0].start <= earliest_start):
                 earliest_start = parking_spot.reservations[0].start
                 spot = parking_spot
                 earliest_time_slot = spot.reservations[0]
@@ -123,54 +450,138 @@ class Timetable:
 
     def get_spot_with_closest_time_slot(self, input_time_slot):
         """Get the spot with reservation that is closest to a given time slot"""
-        smallest_difference = timedelta(hours=99999, minutes=0)
+        smallest_difference = None
         spot, closest_time_slot = None, None
         for parking_spot in self.parking_spots:
-            for time_slot in parking_spot.reservations:
-                difference = time_slot.start - input_time_slot.end
-                if parking_spot.is_reservable and time_slot.start >= input_time_slot.end and difference < smallest_difference:
-                    spot = parking_spot
-                    closest_time_slot = time_slot
-                    smallest_difference = difference
+            if not parking_spot.is_reservable:
+                continue
+            time_slot = parking_spot.get_first_time_slot_after(input_time_slot.end)
+            if time_slot is not None and (smallest_difference is None
+                                          or time_slot.start - input_time_slot.end < smallest_difference):
+                spot = parking_spot
+                closest_time_slot = time_slot
+                smallest_difference = time_slot.start - input_time_slot.end
         return spot, closest_time_slot
 
-    def to_json(self, request_only=False):
-        data = copy.deepcopy(self.original_json)
+    def get_assignments(self):
+        """Return the parking spot of every reservation in the timetable by reservation id"""
+        assignments = {time_slot.id: parking_spot.name
+                       for parking_spot in self.parking_spots for time_slot in parking_spot.reservations}
+        for spot_name, rules in self.rules.items():
+            for rule in rules:
+                assignments[rule.id] = spot_name
+        return assignments
+
+    def get_changes(self):
+        """Return new parking spots of the elements of the original document whose parking spot has changed"""
+        changes = {}
+        for id, spot_name in self.get_assignments().items():
+            element = self.records.get(id)
+            if element is not None and element['predmet'] != spot_name:
+                changes[id] = spot_name
+        return changes
+
+    def to_json(self, request_only=False, diff=False):
+        """Return the original document with the parking spots from the timetable. The original document is never
+        copied, only the changed elements are. With request_only return only the first reservation request that got
+        a parking spot (or the whole document if none did), with diff return only ids and parking spots of the
+        changed elements"""
+        data = self.original_json
+        changes = self.get_changes()
 
         if request_only:  # LAST MINUTE CHANGE, MAY NOT BE VERY GOOD ONE
             for element in data['winstrom']['udalost']:
-                if element['predmet'] == "":
-                    for parking_spot in self.parking_spots:
-                        for time_slot in parking_spot.reservations:
-                            if time_slot.id == element['id']:
-                                element['predmet'] = parking_spot.name
-                                return element
-
-        if not request_only:
-            for parking_spot in self.parking_spots:
-                for time_slot in parking_spot.reservations:
-                    id = time_slot.id
-                    for element in data['winstrom']['udalost']:
-                        if element['id'] == id:
-                            element['predmet'] = parking_spot.name
-
-                    # reservations.append({"user": time_slot.user, "start": str(time_slot.start), "end": str(time_slot.end)})
-                # data['parking_spots'].append({"name": parking_spot.name, "reservable": parking_spot.is_reservable, "reservations": reservations})
-        return data
-
-
+                if element['predmet'] == "" and element['id'] in changes:
+                    return dict(element, predmet=changes[element['id']])
+            return data
+
+        return apply_changes(data, changes, diff)
+
+    def iter_json(self):
+        """Yield the original document with the parking spots from the timetable as JSON text, element by element"""
+        changes = self.get_changes()
+        yield '{'
+        for key_idx, (key, value) in enumerate(self.original_json.items()):
+            yield (', ' if key_idx else '') + json.dumps(key) + ': '
+            if key != 'winstrom':
+                yield json.dumps(value)
+                continue
+            yield '{'
+            for winstrom_idx, (winstrom_key, winstrom_value) in enumerate(value.items()):
+                yield (', ' if winstrom_idx else '') + json.dumps(winstrom_key) + ': '
+                if winstrom_key != 'udalost':
+                    yield json.dumps(winstrom_value)
+                    continue
+                yield '['
+                for idx, element in enumerate(winstrom_value):
+                    if element['id'] in changes:
+                        element = dict(element, predmet=changes[element['id']])
+                    yield (', ' if idx else '') + json.dumps(element)
+                yield ']'
+            yield '}'
+        yield '}'
+
+
+def apply_changes(data, changes, diff=False):
+    """Return the document with new parking spots of the changed elements, only the changed elements are copied.
+    With diff return only ids and parking spots of the changed elements"""
+    if diff:
+        udalost = [{"id": id, "predmet": spot_name} for id, spot_name in changes.items()]
+    else:
+        udalost = [dict(element, predmet=changes[element['id']]) if element['id'] in changes else element
+                   for element in data['winstrom']['udalost']]
+    return dict(data, winstrom=dict(data['winstrom'], udalost=udalost))
+
+
+@lru_cache(maxsize=8192)
 def convert_date_to_time(date_time):
-    """Convert time slot from a string (for example '2021-04-13T10:41:49.285+02:00') to timedelta time format"""
-    ref_date = datetime.date(2021, 4, 17)  # FIXME: nestihame
-    date, time_region = date_time.split('T')
-    year, month, day = date.split('-')
-    time, _ = time_region.split('.')
-    hours, minutes, _ = time.split(':')
-
-    date = datetime.date(int(year), int(month), int(day))
-    days = date - ref_date
-
-    return timedelta(days=days.days, hours=int(hours), minutes=int(minutes))
+    """Convert time from a string (for example '2021-04-13T10:41:49.285+02:00') to minutes since epoch in UTC.
+    Seconds are dropped and a time without an offset is taken as UTC"""
+    match = ISO_DATE_TIME.match(date_time)
+    if match is None:
+        date_time = datetime.datetime.fromisoformat(date_time.replace('Z', '+00:00'))
+        if date_time.tzinfo is None:
+            date_time = date_time.replace(tzinfo=datetime.timezone.utc)
+        return (date_time - EPOCH) // timedelta(minutes=1)
+
+    year, month, day, hours, minutes, offset = match.groups()
+    days = datetime.date(int(year), int(month), int(day)).toordinal() - EPOCH_ORDINAL
+    time = days * 1440 + int(hours) * 60 + int(minutes)
+    if offset is not None and offset != 'Z':
+        offset_minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+        time = time - offset_minutes if offset[0] == '+' else time + offset_minutes
+    return time
+
+
+def get_offset(date_time):
+    """Return the offset from UTC of a time string in minutes, 0 for a time without an offset"""
+    match = ISO_DATE_TIME.match(date_time)
+    if match is None:
+        offset = datetime.datetime.fromisoformat(date_time.replace('Z', '+00:00')).utcoffset()
+        return offset // timedelta(minutes=1) if offset is not None else 0
+    offset = match.group(6)
+    if offset is None or offset == 'Z':
+        return 0
+    offset_minutes = int(offset[1:3]) * 60 + int(offset[4:6])
+    return offset_minutes if offset[0] == '+' else -offset_minutes
+
+
+def convert_dates_to_times(date_times):
+    """Convert a whole column of time strings, every distinct string is parsed only once"""
+    times = {}
+    for date_time in date_times:
+        if date_time not in times:
+            times[date_time] = convert_date_to_time(date_time)
+    return [times[date_time] for date_time in date_times]
+
+
+def convert_time_to_date(time, offset=0):
+    """Convert minutes since epoch back to a string in UTC (for example '2021-04-13T08:41:00+00:00') or with a given
+    offset in minutes"""
+    date_time = EPOCH + timedelta(minutes=time)
+    if offset:
+        date_time = date_time.astimezone(datetime.timezone(timedelta(minutes=offset)))
+    return date_time.isoformat()
 
 
 def get_reservation_time(start_date, end_date):
@@ -183,65 +594,279 @@ def get_reservation_time(start_date, end_date):
 def get_minimal_window_parking_spot(timetable, request):
     """Return the parking spot which has reservations with start or end time as close to requested interval as
     possible. Return None if there is no free parking spots"""
-    difference, optimal_spot, minimal_difference = None, None, None
+    return get_placement_parking_spot(timetable, request)
+
+
+def get_placement_parking_spot(timetable, request, placement='best_fit', weights=None, reservable=None):
+    """Return the parking spot chosen for a request by a placement strategy (see PLACEMENT_STRATEGIES), weights are
+    used by the weighted one. With reservable only the spots of that set are taken (see get_reservable). Return None if
+    there is no free parking spot"""
+    timetable.expand_rules(request.start - RULE_MARGIN, request.end + RULE_MARGIN)
+    candidates = get_candidates(timetable.parking_spots, request, reservable)
+    candidate = get_placement(placement, weights)(candidates, request)
+    return candidate.spot if candidate is not None else None
+
+
+def get_difference(interval, other):
+    """Return the parts of an interval (start, end) that are not in another one (None is an empty interval)"""
+    start, end = interval
+    if other is None or other[1] <= start or end <= other[0]:
+        return [interval]
+    return [(segment_start, segment_end) for segment_start, segment_end in ((start, other[0]), (other[1], end))
+            if segment_start < segment_end]
+
+
+def get_rule(element):
+    """Return the recurring booking of an element with rrule (see parse_rrule) and optionally exdate, a list of starts
+    of the left out occurrences. The occurrences follow the offset of zahajeni, or the time zone tzid (an IANA name)
+    when the element has it. Raise InvalidRule if it is not valid"""
+    try:
+        start, end = get_reservation_time(element['zahajeni'], element['dokonceni'])
+        return RecurrenceRule(element['id'], element['zodpPrac'], start, end,
+                              exdates=convert_dates_to_times(element.get('exdate', [])),
+                              timezone=element.get('tzid', get_offset(element['zahajeni'])),
+                              **parse_rrule(element['rrule']))
+    except ValueError as e:
+        raise InvalidRule("invalid recurring booking " + str(element['id']) + ": " + str(e)) from None
+
+
+def get_rule_element(spot_name, rule):
+    """Return an udalost element of a recurring booking with the fields the scheduling uses"""
+    offset = rule.get_local_time(rule.start) - rule.start
+    element = {"id": rule.id, "predmet": spot_name, "zahajeni": convert_time_to_date(rule.start, offset),
+               "dokonceni": convert_time_to_date(rule.end, offset), "zodpPrac": rule.user, "rrule": rule.format(),
+               "exdate": [convert_time_to_date(time, offset) for time in sorted(rule.exdates)]}
+    if rule.zone is not None:
+        element['tzid'] = rule.timezone
+    return element
+
+
+def get_rule_parking_spot(timetable, rule, placement='best_fit', weights=None, reservable=None):
+    """Return the parking spot chosen by a placement strategy for the first occurrence of a recurring booking among
+    the spots where all its occurrences fit, None if there is no such spot"""
+    first = TimeSlot(rule.id, rule.user, rule.start, rule.end)
+    timetable.expand_rules(first.start - RULE_MARGIN, first.end + RULE_MARGIN)
+    parking_spots = [parking_spot for parking_spot in timetable.parking_spots
+                     if (parking_spot.is_reservable if reservable is None else parking_spot.name in reservable)
+                     and timetable.rule_fits(parking_spot, rule)]
+    candidate = get_placement(placement, weights)(get_candidates(parking_spots, first, reservable), first)
+    return candidate.spot if candidate is not None else None
+
+
+def get_reservable(element):
+    """Return the set of spots sent along with a reservation request in "reservation", None if it has not sent any.
+    The list applies to that request only"""
+    return set(element['reservation']) if 'reservation' in element else None
+
+
+def reserve_element(timetable, element, placement='best_fit', weights=None):
+    """Find a parking spot for a reservation request, a single or a recurring one, and add the request to it. Return
+    the spot, None if there is no free one"""
+    reservable = get_reservable(element)
+    if 'rrule' in element:
+        rule = get_rule(element)
+        spot = get_rule_parking_spot(timetable, rule, placement, weights, reservable)
+        if spot is not None:
+            timetable.add_rule(spot.name, rule)
+        return spot
+    start, end = get_reservation_time(element['zahajeni'], element['dokonceni'])
+    request = TimeSlot(element['id'], element['zodpPrac'], start, end)
+    spot = get_placement_parking_spot(timetable, request, placement, weights, reservable)
+    if spot is not None:
+        spot.add_reservation(request)
+    return spot
+
+
+def get_first_free_parking_spot(timetable, request):
+    """Return the first parking spot with free time slot for a given interval.
+    Return None if there is no free parking spots"""
 
     for parking_spot in timetable.parking_spots:
         if not parking_spot.is_reservable:
             continue
-        for time_slot in parking_spot.reservations:
-
-            previous_time_slot = parking_spot.get_previous_time_slot(time_slot)
-            next_time_slot = parking_spot.get_next_time_slot(time_slot)
-
-            # check if we the reservation can be put between the ending of the end of this time slot and the
-            # beginning of the next one
-            if request.start >= time_slot.end and (next_time_slot is None
-                                                   or next_time_slot.start >= request.end):
+        # check if we the reservation can be put after ending or before the beginning of some time slot
+        if len(parking_spot.reservations) > 0 and parking_spot.fits(request.start, request.end):
+            return parking_spot
+    return None
 
-                difference = request.start - time_slot.end
-            # check if we the reservation can be put between the ending of the end of previous and the beginning of
-            # this time slot
-            elif request.end <= time_slot.start and (previous_time_slot is None
-                                                     or previous_time_slot.end <= request.start):
-                difference = time_slot.start - request.end
 
-            if minimal_difference is not None and difference < minimal_difference \
-                    or minimal_difference is None and difference is not None:
-                optimal_spot = parking_spot
-                minimal_difference = difference
+def get_windows(timetable):
+    """Return the sum of windows between neighbouring reservations on reservable parking spots"""
+    windows = 0
+    for parking_spot in timetable.parking_spots:
+        if parking_spot.is_reservable:
+            windows += sum(start - end for start, end in zip(parking_spot.starts[1:], parking_spot.ends))
+    return windows
+
+
+def optimize_timetable(old_timetable, strategy='best_fit'):
+    """Take a timetable and find equivalent timetable with same or lesser windows between time slots. Parking spots
+    with recurring bookings are left as they are, see pinned_rule_spots"""
+    with pinned_rule_spots(old_timetable) as pinned:
+        new_timetable = OPTIMIZATION_STRATEGIES[strategy](old_timetable)
+    for parking_spot in pinned:
+        new_timetable.get_parking_spot(parking_spot.name).is_reservable = True
+    new_timetable.expanded = old_timetable.expanded
+    return new_timetable
 
-        # there is a possibility that there is no reservations on a spot
-        if len(parking_spot.reservations) == 0 and optimal_spot is None:
-            optimal_spot = parking_spot
-    return optimal_spot
 
+@contextmanager
+def pinned_rule_spots(timetable):
+    """Treat the parking spots with recurring bookings as not reservable for a while, so that an optimization keeps
+    their reservations where they are and never needs to expand the series. A series has one parking spot for all its
+    occurrences, so they can not be moved one by one"""
+    pinned = [parking_spot for parking_spot in timetable.parking_spots
+              if parking_spot.is_reservable and timetable.rules.get(parking_spot.name)]
+    for parking_spot in pinned:
+        parking_spot.is_reservable = False
+    try:
+        yield pinned
+    finally:
+        for parking_spot in pinned:
+            parking_spot.is_reservable = True
+
+
+def get_best_fit_spots(intervals, spot_count):
+    """Give each interval (start, end), sorted by start, to the spot whose last interval ends right before it (best
+    fit). Next spot is used only when none of the used ones is free, which needs the least possible number of spots.
+    Return index of the spot of every interval, -1 where all spots are taken. Runs in O(n log n)"""
+    # (end of the last interval, index of the spot) of used spots, sorted
+    last_ends, spots = [], []
+    for start, end in intervals:
+        idx = bisect_right(last_ends, (start, spot_count)) - 1
+        if idx >= 0:
+            spot_idx = last_ends.pop(idx)[1]
+        elif len(last_ends) < spot_count:
+            spot_idx = len(last_ends)
+        else:
+            spots.append(-1)
+            continue
+        spots.append(spot_idx)
+        insort(last_ends, (end, spot_idx))
+    return spots
 
-def get_first_free_parking_spot(timetable, request):
-    """Return the first parking spot with free time slot for a given interval.
-    Return None if there is no free parking spots"""
 
-    for parking_spot in timetable.parking_spots:
-        if not parking_spot.is_reservable:
+def optimize_timetable_best_fit(old_timetable):
+    """Take reservations of reservable spots by their start time and give each one to the parking spot whose last
+    reservation ends right before it (best fit), see get_best_fit_spots. Old timetable stays untouched"""
+    new_timetable = old_timetable.empty_copy()
+    reservable_spots, time_slots = [], []
+    for idx, parking_spot in enumerate(old_timetable.parking_spots):
+        if not parking_spot.is_reservable:  # if a spot is manager's spot leave it as it is
+            for reservation in parking_spot.reservations:
+                new_timetable.parking_spots[idx].add_reservation(reservation)
             continue
-        for time_slot in parking_spot.reservations:
-
-            previous_time_slot = parking_spot.get_previous_time_slot(time_slot)
-            next_time_slot = parking_spot.get_next_time_slot(time_slot)
+        reservable_spots.append(new_timetable.parking_spots[idx])
+        time_slots.extend((time_slot, idx) for time_slot in parking_spot.reservations)
+    time_slots.sort(key=lambda item: (item[0].start, item[0].end))
+
+    spots = get_best_fit_spots([(time_slot.start, time_slot.end) for time_slot, _ in time_slots], len(reservable_spots))
+    for (time_slot, old_idx), spot_idx in zip(time_slots, spots):
+        if spot_idx < 0:  # reservations overlapped already in the old timetable, keep such one where it was
+            new_timetable.parking_spots[old_idx].add_reservation(time_slot)
+        else:
+            reservable_spots[spot_idx].add_reservation(time_slot)
+    return new_timetable
 
-            # check if we the reservation can be put after ending or before the beginning of this time slot
-            if request.start >= time_slot.end and (next_time_slot is None
-                                                   or next_time_slot.start >= request.end):
 
-                return parking_spot
-            elif request.end <= time_slot.start and (previous_time_slot is None
-                                                     or previous_time_slot.end <= request.start):
-                return parking_spot
-    return None
+def get_cut_times(parking_spots, count):
+    """Return at most count - 1 sorted moments, spread evenly over the timetable, when no reservation on the given
+    parking spots is running. Every spot is free at such moment, so the timetable can be cut there into shards which
+    are independent of each other (bookings do not span across days, so there is always one at night)"""
+    used_spots = [parking_spot for parking_spot in parking_spots if len(parking_spot.starts) > 0]
+    if not used_spots:
+        return []
+    first = min(parking_spot.starts[0] for parking_spot in used_spots)
+    last = max(parking_spot.ends[-1] for parking_spot in used_spots)
+    cut_times = set()
+    for i in range(1, count):
+        time = first + (last - first) * i // count
+        cut_times.add(get_affected_window(used_spots, time, time)[0])
+    return sorted(cut_times - {first})
+
+
+def get_shard_best_fit_spots(columns, spot_count):
+    """Best fit of one shard given as (starts, ends) of the reservations of every reservable spot. Return positions of
+    the reservations in the shard (spot after spot) sorted by start time and their new spots"""
+    starts, ends = [], []
+    for spot_starts, spot_ends in columns:
+        starts.extend(spot_starts)
+        ends.extend(spot_ends)
+    order = sorted(range(len(starts)), key=lambda idx: (starts[idx], ends[idx]))
+    return order, get_best_fit_spots([(starts[idx], ends[idx]) for idx in order], spot_count)
+
+
+def get_shard_executor(workers):
+    """Return the pool of processes of the sharded optimization with a given number of workers, it is started once"""
+    if workers not in shard_executors:
+        shard_executors[workers] = ProcessPoolExecutor(workers)
+    return shard_executors[workers]
+
+
+def shutdown_shard_executors():
+    """Stop the pools of processes of the sharded optimization, a new one is started when it is needed again"""
+    for executor in shard_executors.values():
+        executor.shutdown()
+    shard_executors.clear()
+
+
+atexit.register(shutdown_shard_executors)
+# a forked child can not use the pools of its parent, their processes and threads are not there
+os.register_at_fork(after_in_child=shard_executors.clear)
+
+
+def optimize_timetable_sharded(old_timetable, workers=None):
+    """Same as optimize_timetable_best_fit, but the timetable is cut into shards at moments when all spots are free
+    (see get_cut_times) and the shards are optimized in parallel by a pool of SHARD_WORKERS processes. Timetables
+    with less than two shards of SHARD_MIN_SIZE reservations are optimized right away, and so are all timetables in
+    a process started by multiprocessing (a worker of another pool), which would not stop with a pool of its own and
+    would multiply the processes"""
+    workers = workers or SHARD_WORKERS
+    if multiprocessing.parent_process() is not None:
+        return optimize_timetable_best_fit(old_timetable)
+    old_spots = [parking_spot for parking_spot in old_timetable.parking_spots if parking_spot.is_reservable]
+    shard_count = min(4 * workers, sum(len(parking_spot.starts) for parking_spot in old_spots) // SHARD_MIN_SIZE)
+    cut_times = get_cut_times(old_spots, shard_count)
+    if workers == 1 or not cut_times:
+        return optimize_timetable_best_fit(old_timetable)
+
+    new_timetable = old_timetable.empty_copy()
+    reservable_spots, old_idxs = [], []
+    for idx, parking_spot in enumerate(old_timetable.parking_spots):
+        if not parking_spot.is_reservable:  # if a spot is manager's spot leave it as it is
+            for reservation in parking_spot.reservations:
+                new_timetable.parking_spots[idx].add_reservation(reservation)
+            continue
+        reservable_spots.append(new_timetable.parking_spots[idx])
+        old_idxs.append(idx)
+
+    # (first, last) index of the reservations of every spot in every shard
+    shard_bounds = []
+    positions = [[0] + [bisect_left(parking_spot.starts, time) for time in cut_times] + [len(parking_spot.starts)]
+                 for parking_spot in old_spots]
+    for shard in range(len(cut_times) + 1):
+        shard_bounds.append([(spot_positions[shard], spot_positions[shard + 1]) for spot_positions in positions])
+    shards = [[(list(parking_spot.starts[first:last]), list(parking_spot.ends[first:last]))
+               for parking_spot, (first, last) in zip(old_spots, bounds)] for bounds in shard_bounds]
+
+    results = get_shard_executor(workers).map(get_shard_best_fit_spots, shards, repeat(len(old_spots)))
+    for bounds, (order, spots) in zip(shard_bounds, results):
+        time_slots, shard_old_idxs = [], []
+        for parking_spot, old_idx, (first, last) in zip(old_spots, old_idxs, bounds):
+            time_slots.extend(parking_spot.reservations[first:last])
+            shard_old_idxs.extend([old_idx] * (last - first))
+        for position, spot_idx in zip(order, spots):
+            if spot_idx < 0:  # reservations overlapped already in the old timetable, keep such one where it was
+                new_timetable.parking_spots[shard_old_idxs[position]].add_reservation(time_slots[position])
+            else:
+                reservable_spots[spot_idx].add_reservation(time_slots[position])
+    return new_timetable
 
 
-def optimize_timetable(old_timetable):
-    """Take a timetable and find equivalent timetable with same or lesser windows between time slots"""
-    new_timetable = Timetable(json_data=old_timetable.original_json)
+def optimize_timetable_greedy(old_timetable):
+    """Take a timetable and find equivalent timetable with same or lesser windows between time slots.
+    Every parking spot takes the earliest reservation left and then the closest following ones"""
+    new_timetable = old_timetable.empty_copy()
     for idx, parking_spot in enumerate(old_timetable.parking_spots):
         # current_parking_spot = ParkingSpot(parking_spot.name, parking_spot.is_reservable)
 
@@ -272,39 +897,196 @@ def optimize_timetable(old_timetable):
     return new_timetable
 
 
-def get_request(data):
-    for element in data:
-        if element['predmet'] == "":
-            start, end = get_reservation_time(element['zahajeni'], element['dokonceni'])
-            return TimeSlot(element['id'], element['zodpPrac'], start, end)
-
+def get_affected_window(parking_spots, start, end):
+    """Widen the interval [start, end) until no reservation on the given parking spots crosses its borders"""
+    while True:
+        new_start, new_end = start, end
+        for parking_spot in parking_spots:
+            idx = bisect_right(parking_spot.ends, new_start)
+            if idx < len(parking_spot.starts) and parking_spot.starts[idx] < new_start:
+                new_start = parking_spot.starts[idx]
+            idx = bisect_left(parking_spot.starts, new_end)
+            if idx > 0 and parking_spot.ends[idx - 1] > new_end:
+                new_end = parking_spot.ends[idx - 1]
+        if new_start == start and new_end == end:
+            return start, end
+        start, end = new_start, new_end
+
+
+def get_max_overlap(time_slots, start, end):
+    """Return the largest number of time slots that overlap each other at some moment of the interval [start, end)"""
+    events = []
+    for time_slot in time_slots:
+        if time_slot.start < end and start < time_slot.end:
+            events.append((max(time_slot.start, start), 1))
+            events.append((time_slot.end, -1))
+    overlap, max_overlap = 0, 0
+    for _, change in sorted(events):  # at the same time an end goes before a start
+        overlap += change
+        max_overlap = max(max_overlap, overlap)
+    return max_overlap
+
+
+def reoptimize_timetable(timetable, added=(), removed=()):
+    """Apply a change to an optimized timetable and pack again only the reservations around it. Removed and added are
+    time slots, a moved reservation is in both (with its old and new times). The window the change touches is widened
+    until no reservation crosses it, reservations of reservable spots inside the window are placed again by best fit
+    starting from the last reservation of every spot before the window, all others stay where they are. The cost grows
+    with the size of the window, not of the timetable. The timetable is changed in place, parking spots with recurring
+    bookings are left as they are.
+
+    Return new parking spots of the added and moved reservations by id, an added one that does not fit is left out"""
+    with pinned_rule_spots(timetable):
+        return reoptimize_reservable_spots(timetable, added, removed)
+
+
+def reoptimize_reservable_spots(timetable, added, removed):
+    for time_slot in removed:
+        for parking_spot in timetable.parking_spots:
+            idx = parking_spot.find(time_slot)
+            if idx is not None and parking_spot.reservations[idx].id == time_slot.id:
+                parking_spot._delete(idx)
+                break
+    changed = list(removed) + list(added)
+    if not changed:
+        return {}
+    reservable_spots = [parking_spot for parking_spot in timetable.parking_spots if parking_spot.is_reservable]
+    start, end = get_affected_window(reservable_spots, min(time_slot.start for time_slot in changed),
+                                     max(time_slot.end for time_slot in changed))
+
+    # take the window out, the spots are seeded with the end of their last reservation before it
+    time_slots, last_ends, free_spots = [], [], []
+    for spot_idx, parking_spot in enumerate(reservable_spots):
+        first, last = bisect_left(parking_spot.starts, start), bisect_left(parking_spot.starts, end)
+        time_slots.extend((parking_spot.reservations[idx], spot_idx) for idx in range(first, last))
+        for idx in reversed(range(first, last)):
+            parking_spot._delete(idx)
+        if first > 0:
+            last_ends.append((parking_spot.ends[first - 1], spot_idx))
+        else:
+            free_spots.append(spot_idx)
+    last_ends.sort()
+    # best fit finds a place for everything as long as there are never more overlapping reservations than spots
+    for time_slot in added:
+        window_slots = [item[0] for item in time_slots]
+        if get_max_overlap(window_slots, time_slot.start, time_slot.end) < len(reservable_spots):
+            time_slots.append((time_slot, None))
+    time_slots.sort(key=lambda item: (item[0].start, item[0].end))
+
+    changes = {}
+    for time_slot, old_idx in time_slots:
+        idx = bisect_right(last_ends, (time_slot.start, len(reservable_spots))) - 1
+        # from the spots that fit equally well the old one is taken, so that as few reservations as possible move
+        if idx >= 0 and old_idx is not None:
+            same_idx = bisect_left(last_ends, (last_ends[idx][0], old_idx))
+            if same_idx < len(last_ends) and last_ends[same_idx] == (last_ends[idx][0], old_idx):
+                idx = same_idx
+        if idx >= 0:
+            spot_idx = last_ends.pop(idx)[1]
+        elif free_spots:
+            spot_idx = old_idx if old_idx in free_spots else free_spots[0]
+            free_spots.remove(spot_idx)
+        else:
+            if old_idx is not None:  # reservations overlapped already in the old timetable, keep such one where it was
+                reservable_spots[old_idx].add_reservation(time_slot)
+            continue
+        reservable_spots[spot_idx].add_reservation(time_slot)
+        insort(last_ends, (time_slot.end, spot_idx))
+        if spot_idx != old_idx:
+            changes[time_slot.id] = reservable_spots[spot_idx].name
+    return changes
+
+
+OPTIMIZATION_STRATEGIES = {
+    'best_fit': optimize_timetable_best_fit,
+    'greedy': optimize_timetable_greedy,
+    'sharded': optimize_timetable_sharded,
+}
+
+
+def get_requests(data):
+    """Return all single reservation requests (elements without a parking spot and rrule) as time slots"""
+    elements = [element for element in data if element['predmet'] == "" and 'rrule' not in element]
+    starts = convert_dates_to_times([element['zahajeni'] for element in elements])
+    ends = convert_dates_to_times([element['dokonceni'] for element in elements])
+    return [TimeSlot(element['id'], element['zodpPrac'], start, end)
+            for element, start, end in zip(elements, starts, ends)]
+
+
+# order in which the requests of a batch get their parking spots
+PLACEMENT_ORDERS = {
+    'earliest_start': lambda request: (request.start, request.end),
+    'longest_duration': lambda request: (request.start - request.end, request.start),
+}
+
+
+def process_batch_reservation_request(data, order='earliest_start', placement='best_fit', weights=None):
+    """Find parking spots for all reservation requests at once. Return the requests with assigned parking spots in the
+    order they were sent, the parking spot stays empty if there is no free one. Every request is placed among the spots
+    of its own "reservation" list when it has sent one"""
+    udalost = data['winstrom']['udalost']
+    with timed('build'):
+        # without the requests, their lists of spots must not change the reservable spots of the whole timetable
+        timetable = Timetable([element for element in udalost if element['predmet'] != ""], data)
+    reservable = {element['id']: get_reservable(element) for element in udalost if element['predmet'] == ""}
+    assignments = {}
+    with timed('search'):
+        # recurring requests first, they are the hardest to place
+        for element in udalost:
+            if element['predmet'] == "" and 'rrule' in element:
+                spot = reserve_element(timetable, element, placement, weights)
+                if spot:
+                    assignments[element['id']] = spot.name
+        for request in sorted(get_requests(udalost), key=PLACEMENT_ORDERS[order]):
+            spot = get_placement_parking_spot(timetable, request, placement, weights, reservable[request.id])
+            if spot:
+                spot.add_reservation(request)
+                assignments[request.id] = spot.name
+    with timed('serialize'):
+        return [dict(element, predmet=assignments.get(element['id'], ""))
+                for element in udalost if element['predmet'] == ""]
+
+
+def process_reservation_request(data, placement='best_fit', weights=None):
+    """Find a parking spot for the reservation request by a placement strategy (see PLACEMENT_STRATEGIES)"""
+    with timed('build'):
+        timetable = Timetable(data['winstrom']['udalost'], data)
+    logger.debug("%s", timetable)
+
+    with timed('search'):
+        for element in data['winstrom']['udalost']:
+            if element['predmet'] == "":
+                reserve_element(timetable, element, placement, weights)
+                break
+    logger.debug("%s", timetable)
+    # optimized_timetable = optimize_timetable(timetable)
+    with timed('serialize'):
+        return timetable.to_json(request_only=True)
 
-def process_reservation_request(data):
-    timetable = Timetable(data['winstrom']['udalost'], data)
-    request = get_request(data['winstrom']['udalost'])
-    print(timetable)
 
-    # spot = get_first_free_parking_spot(timetable, request)
-    spot_min_window = get_minimal_window_parking_spot(timetable, request)
-    if spot_min_window:
-        timetable.add_reservation(spot_min_window, request)
-    print(timetable)
-    print('-------')
-    # optimized_timetable = optimize_timetable(timetable)
-    # print(optimized_timetable)
-    return timetable.to_json(request_only=True)
+def get_optimization_changes(data, strategy='best_fit'):
+    """Optimize the timetable of a document and return new parking spots of the changed elements"""
+    with timed('build'):
+        timetable = Timetable(data['winstrom']['udalost'], data)
+    with timed('optimize'):
+        optimized_timetable = optimize_timetable(timetable, strategy)
+    logger.debug("%s", optimized_timetable)
+    return optimized_timetable.get_changes()
 
 
-def optimize(data):
-    timetable = Timetable(data['winstrom']['udalost'], data)
-    # print(timetable)
-    # print('-------')
-    optimized_timetable = optimize_timetable(timetable)
-    print(optimized_timetable)
-    return optimized_timetable.to_json()
+def optimize(data, strategy='best_fit', diff=False, cache=None):
+    """Optimize the timetable of a document. With a cache (ResultCache) the result for the same bookings is reused"""
+    if cache is None:
+        changes = get_optimization_changes(data, strategy)
+    else:
+        key = get_timetable_key(data['winstrom']['udalost'], strategy)
+        changes = cache.get_or_compute(key, lambda: get_optimization_changes(data, strategy))
+    with timed('serialize'):
+        return apply_changes(data, changes, diff)
 
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.DEBUG)
     # test data
     data_json = '{\
     "winstrom": {\
@@ -1,6 +1,13 @@
+import copy
 import json
+import random
 import unittest
-from reservation import process_reservation_request
+from concurrent.futures import ProcessPoolExecutor
+import reservation
+from reservation import process_reservation_request, process_batch_reservation_request, ParkingSpot, TimeSlot, \
+    Timetable, CompactParkingSpot, get_minimal_window_parking_spot, get_requests, convert_date_to_time, \
+    convert_dates_to_times, optimize_timetable, get_windows, reoptimize_timetable, optimize_timetable_sharded, \
+    get_cut_times
 
 test_data = json.loads('{\
     "winstrom": {\
@@ -140,5 +147,275 @@ class MyTestCase(unittest.TestCase):
         timetable = process_reservation_request(test_data_can_be_reserved_info)
         self.assertEqual(test_data_can_be_reserved_info, timetable)
 
+
+def make_slot(id, start_hour, end_hour):
+    return TimeSlot(id, "code:admin", start_hour * 60, end_hour * 60)
+
+
+class ParkingSpotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.spot = ParkingSpot("101", True)
+        for slot in [make_slot("3", 14, 16), make_slot("1", 8, 10), make_slot("2", 11, 12)]:
+            self.spot.add_reservation(slot)
+
+    def test_reservations_stay_sorted(self):
+        self.assertEqual(["1", "2", "3"], [slot.id for slot in self.spot.reservations])
+        self.assertEqual(self.spot.starts, [slot.start for slot in self.spot.reservations])
+        self.assertEqual(self.spot.ends, [slot.end for slot in self.spot.reservations])
+
+    def test_neighbours(self):
+        self.assertEqual("1", self.spot.get_previous_time_slot(make_slot("2", 11, 12)).id)
+        self.assertEqual("3", self.spot.get_next_time_slot(make_slot("2", 11, 12)).id)
+        self.assertIsNone(self.spot.get_next_time_slot(make_slot("3", 14, 16)))
+        previous_slot, next_slot = self.spot.get_neighbours(12 * 60, 13 * 60)
+        self.assertEqual(("2", "3"), (previous_slot.id, next_slot.id))
+
+    def test_fits(self):
+        self.assertTrue(self.spot.fits(12 * 60, 14 * 60))
+        self.assertTrue(self.spot.fits(6 * 60, 8 * 60))
+        self.assertFalse(self.spot.fits(9 * 60, 11 * 60))
+        self.assertFalse(self.spot.fits(15 * 60, 17 * 60))
+
+    def test_window(self):
+        self.assertEqual(0, self.spot.get_window(12 * 60, 13 * 60))
+        self.assertEqual(30, self.spot.get_window(12 * 60 + 30, 13 * 60))
+        self.assertIsNone(self.spot.get_window(9 * 60, 11 * 60))
+
+    def test_remove_reservation(self):
+        self.spot.remove_reservation(make_slot("2", 11, 12))
+        self.assertEqual(["1", "3"], [slot.id for slot in self.spot.reservations])
+        self.assertEqual([8 * 60, 14 * 60], self.spot.starts)
+
+
+class ConvertDateTestCase(unittest.TestCase):
+    def test_offset(self):
+        self.assertEqual(convert_date_to_time("2021-04-17T17:41:00Z"),
+                         convert_date_to_time("2021-04-17T19:41:49.285+02:00"))
+        self.assertEqual(convert_date_to_time("2021-04-17T17:41:00+00:00"),
+                         convert_date_to_time("2021-04-17T12:11:00-05:30"))
+
+    def test_minutes_since_epoch(self):
+        self.assertEqual(0, convert_date_to_time("1970-01-01T00:00:59.999+00:00"))
+        self.assertEqual(26978021, convert_date_to_time("2021-04-17T19:41:49.285+02:00"))
+        self.assertEqual(26978021, convert_date_to_time("2021-04-17 17:41:49"))
+
+    def test_bulk(self):
+        column = ["2021-04-17T19:41:49.285+02:00", "2021-04-17T20:41:49.285+02:00", "2021-04-17T19:41:49.285+02:00"]
+        self.assertEqual([26978021, 26978081, 26978021], convert_dates_to_times(column))
+
+
+def make_request(id, start, end):
+    element = copy.deepcopy(test_data['winstrom']['udalost'][0])
+    element.update({"id": id, "zahajeni": start, "dokonceni": end})
+    return element
+
+
+class BatchReservationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = copy.deepcopy(test_data)
+        self.data['winstrom']['udalost'] += [
+            make_request("2", "2021-04-17T12:41:49.285+02:00", "2021-04-17T15:41:49.285+02:00"),
+            make_request("3", "2021-04-17T12:41:49.285+02:00", "2021-04-17T13:41:49.285+02:00"),
+        ]
+
+    def get_assignments(self, order):
+        return {element['id']: element['predmet'] for element in process_batch_reservation_request(self.data, order)}
+
+    def test_earliest_start(self):
+        self.assertEqual({"1": "102", "2": "102", "3": "101"}, self.get_assignments('earliest_start'))
+
+    def test_longest_duration(self):
+        self.assertEqual({"1": "102", "2": "101", "3": "102"}, self.get_assignments('longest_duration'))
+
+    def test_reservable_per_request(self):
+        self.data['winstrom']['udalost'][3]['reservation'] = ["101"]
+        self.data['winstrom']['udalost'][4]['reservation'] = ["105", "106"]
+        self.assertEqual({"1": "102", "2": "101", "3": "105"}, self.get_assignments('earliest_start'))
+
+
+def make_random_timetable(seed):
+    rnd = random.Random(seed)
+    timetable = Timetable()
+    for idx, parking_spot in enumerate(timetable.parking_spots):
+        parking_spot.is_reservable = idx % 5 != 0
+        time = rnd.randint(0, 60)
+        for i in range(rnd.randint(0, 8)):
+            time += rnd.randint(0, 120)
+            duration = rnd.randint(15, 240)
+            parking_spot.add_reservation(TimeSlot(parking_spot.name + "-" + str(i), "code:admin", time,
+                                                  time + duration))
+            time += duration
+    return timetable
+
+
+def get_slots(timetable):
+    return {parking_spot.name: [slot.id for slot in parking_spot.reservations]
+            for parking_spot in timetable.parking_spots}
+
+
+class OptimizeTestCase(unittest.TestCase):
+    def test_best_fit_is_not_worse_than_greedy(self):
+        for seed in range(20):
+            best_fit = optimize_timetable(make_random_timetable(seed))
+            greedy = optimize_timetable(make_random_timetable(seed), 'greedy')
+            self.assertLessEqual(get_windows(best_fit), get_windows(greedy))
+
+    def test_best_fit_keeps_all_reservations(self):
+        timetable = make_random_timetable(1)
+        old_slots = get_slots(timetable)
+        optimized = get_slots(optimize_timetable(timetable))
+        self.assertEqual(old_slots, get_slots(timetable))
+        self.assertEqual(sorted(sum(old_slots.values(), [])), sorted(sum(optimized.values(), [])))
+        for parking_spot in timetable.parking_spots:
+            if not parking_spot.is_reservable:
+                self.assertEqual(old_slots[parking_spot.name], optimized[parking_spot.name])
+        for parking_spot in optimize_timetable(timetable).parking_spots:
+            self.assertTrue(all(end <= start for start, end in zip(parking_spot.starts[1:], parking_spot.ends)))
+
+
+def make_random_days(seed, days):
+    rnd = random.Random(seed)
+    timetable = Timetable()
+    for day in range(days):
+        for idx, parking_spot in enumerate(timetable.parking_spots):
+            parking_spot.is_reservable = idx % 5 != 0
+            time = day * 24 * 60 + 7 * 60 + rnd.randint(0, 60)
+            for i in range(rnd.randint(0, 10)):
+                time += rnd.randint(0, 60)
+                duration = rnd.randint(15, 120)
+                parking_spot.add_reservation(TimeSlot("%s-%d-%d" % (parking_spot.name, day, i), "code:admin", time,
+                                                      time + duration))
+                time += duration
+    return timetable
+
+
+def optimize_sharded_days():
+    """Sharded optimization in a worker process, return the number of bookings and of the pools it has started"""
+    timetable = optimize_timetable_sharded(make_random_days(1, 160), workers=2)
+    return len(timetable.get_assignments()), len(reservation.shard_executors)
+
+
+class ShardedOptimizeTestCase(unittest.TestCase):
+    def test_cut_times(self):
+        timetable = make_random_days(0, 10)
+        cut_times = get_cut_times(timetable.parking_spots, 4)
+        self.assertEqual(3, len(cut_times))
+        for time in cut_times:
+            for parking_spot in timetable.parking_spots:
+                self.assertTrue(parking_spot.fits(time, time))
+        self.assertEqual([], get_cut_times(Timetable().parking_spots, 4))
+
+    def test_same_as_best_fit(self):
+        timetable = make_random_days(1, 160)
+        best_fit = optimize_timetable(timetable)
+        sharded = optimize_timetable_sharded(timetable, workers=2)
+        self.assertEqual(get_windows(best_fit), get_windows(sharded))
+        self.assertEqual(sorted(best_fit.get_assignments()), sorted(sharded.get_assignments()))
+        for parking_spot in timetable.parking_spots:
+            if not parking_spot.is_reservable:
+                self.assertEqual(get_slots(timetable)[parking_spot.name], get_slots(sharded)[parking_spot.name])
+        for parking_spot in sharded.parking_spots:
+            self.assertTrue(all(end <= start for start, end in zip(parking_spot.starts[1:], parking_spot.ends)))
+
+    def test_in_worker_process(self):
+        count = len(optimize_timetable_sharded(make_random_days(1, 160), workers=2).get_assignments())
+        # the pool of this process is not inherited and the worker does not start one of its own
+        with ProcessPoolExecutor(1) as executor:
+            self.assertEqual((count, 0), executor.submit(optimize_sharded_days).result(timeout=60))
+
+
+class ReoptimizeTestCase(unittest.TestCase):
+    def test_same_reservations_without_overlaps(self):
+        for seed in range(50):
+            rnd = random.Random(seed)
+            timetable = optimize_timetable(make_random_timetable(seed))
+            removed = rnd.choice([slot for spot in timetable.parking_spots if spot.is_reservable
+                                  for slot in spot.reservations])
+            added = TimeSlot("new", "code:admin", removed.start + 30, removed.end + 30)
+            moved = TimeSlot(removed.id, removed.user, removed.start - 60, removed.end)
+            old_slots = get_slots(timetable)
+            changes = reoptimize_timetable(timetable, added=[added, moved], removed=[removed])
+            new_slots = get_slots(timetable)
+
+            self.assertEqual(sorted(sum(old_slots.values(), []) + ["new"]), sorted(sum(new_slots.values(), [])))
+            self.assertEqual({removed.id, "new"}, {removed.id, "new"} & set(changes))
+            for parking_spot in timetable.parking_spots:
+                if not parking_spot.is_reservable:
+                    self.assertEqual(old_slots[parking_spot.name], new_slots[parking_spot.name])
+                self.assertTrue(all(end <= start for start, end in zip(parking_spot.starts[1:], parking_spot.ends)))
+                for slot in parking_spot.reservations:
+                    if slot.id in changes:
+                        self.assertEqual(parking_spot.name, changes[slot.id])
+                    else:
+                        self.assertIn(slot.id, old_slots[parking_spot.name])
+
+    def test_keeps_reservations_outside_window(self):
+        timetable = Timetable()
+        timetable.parking_spots[0].add_reservation(make_slot("1", 8, 10))
+        timetable.parking_spots[0].add_reservation(make_slot("2", 14, 16))
+        timetable.parking_spots[1].add_reservation(make_slot("3", 9, 11))
+        timetable.parking_spots[1].add_reservation(make_slot("4", 12, 13))
+        changes = reoptimize_timetable(timetable, added=[make_slot("5", 10, 12)])
+        self.assertEqual({"5": "101"}, changes)
+        self.assertEqual(["1", "5", "2"], get_slots(timetable)["101"])
+        self.assertEqual(["3", "4"], get_slots(timetable)["102"])
+
+    def test_added_does_not_fit(self):
+        timetable = Timetable()
+        for idx, parking_spot in enumerate(timetable.parking_spots):
+            parking_spot.add_reservation(make_slot(str(idx), 8, 12))
+        self.assertEqual({}, reoptimize_timetable(timetable, added=[make_slot("new", 10, 11)]))
+        self.assertEqual(20, len(get_slots(timetable)))
+        self.assertEqual({}, reoptimize_timetable(timetable, removed=[make_slot("0", 8, 12)]))
+        self.assertEqual([], get_slots(timetable)["101"])
+
+
+class ToJsonTestCase(unittest.TestCase):
+    def setUp(self):
+        self.data = copy.deepcopy(test_data)
+        self.timetable = Timetable(self.data['winstrom']['udalost'], self.data)
+        self.timetable.parking_spots[0].add_reservation(self.timetable.parking_spots[1].reservations.pop())
+
+    def test_full(self):
+        data = self.timetable.to_json()
+        self.assertEqual(["", "101", "101"], [element['predmet'] for element in data['winstrom']['udalost']])
+        self.assertEqual(test_data, self.data)
+        self.assertIs(self.data['winstrom']['udalost'][1], data['winstrom']['udalost'][1])
+
+    def test_diff(self):
+        self.assertEqual({"winstrom": {"@version": "1.0", "udalost": [{"id": "42", "predmet": "101"}]}},
+                         self.timetable.to_json(diff=True))
+
+    def test_stream(self):
+        self.assertEqual(self.timetable.to_json(), json.loads("".join(self.timetable.iter_json())))
+
+
+class CompactTestCase(unittest.TestCase):
+    def test_compact_spot(self):
+        spot = CompactParkingSpot("101", True)
+        for slot in [make_slot("3", 14, 16), make_slot("a1", 8, 10), make_slot("02", 11, 12)]:
+            spot.add_reservation(slot)
+        self.assertEqual(["a1", "02", "3"], [slot.id for slot in spot.reservations])
+        self.assertEqual(["code:admin"] * 3, [slot.user for slot in spot.reservations])
+        self.assertEqual("3", spot.get_next_time_slot(make_slot("02", 11, 12)).id)
+        self.assertEqual(0, spot.get_window(12 * 60, 13 * 60))
+        spot.remove_reservation(make_slot("02", 11, 12))
+        self.assertEqual(["a1", "3"], [slot.id for slot in spot.reservations])
+        self.assertEqual("3", spot.reservations[-1].id)
+
+    def test_same_results(self):
+        data = copy.deepcopy(test_data)
+        data['winstrom']['udalost'] += [make_request("2", "2021-04-17T12:41:49.285+02:00",
+                                                     "2021-04-17T15:41:49.285+02:00")]
+        timetable = Timetable(data['winstrom']['udalost'], data)
+        compact = Timetable(data['winstrom']['udalost'], data, compact=True)
+        request = get_requests(data['winstrom']['udalost'])[1]
+        self.assertEqual("101", get_minimal_window_parking_spot(compact, request).name)
+        self.assertEqual(get_minimal_window_parking_spot(timetable, request).name,
+                         get_minimal_window_parking_spot(compact, request).name)
+        self.assertEqual(optimize_timetable(timetable).to_json(), optimize_timetable(compact).to_json())
+        self.assertIsInstance(optimize_timetable(compact).parking_spots[0], CompactParkingSpot)
+
+
 if __name__ == '__main__':
     unittest.main()
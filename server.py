@@ -1,29 +1,259 @@
+import logging
+import os
+import sqlite3
 from datetime import timedelta
 from types import SimpleNamespace
 
 from flask import Flask
-from flask import request, jsonify
-from reservation import process_reservation_request, optimize
+from flask import request, jsonify, Response
+from recurrence import InvalidRule
+from reservation import Timetable, optimize_timetable, optimize, process_reservation_request, \
+    process_batch_reservation_request, convert_date_to_time, convert_time_to_date, PLACEMENT_ORDERS, \
+    OPTIMIZATION_STRATEGIES
+from availability import Availability
+from cache import ResultCache
+from metrics import timed, render_metrics, configure_logging, REQUESTS, UNMATCHED
+from placement import get_placement_args
+from engine import ReservationEngine, Conflict
+from snapshot import Snapshot
+from store import TimetableStore, VersionConflict
+from streaming import process_reservation_stream, optimize_stream
 
 app = Flask(__name__)
+configure_logging()
+logger = logging.getLogger(__name__)
+# the loaded timetable is kept in this snapshot file and restored when the server starts, only one worker may use it
+SNAPSHOT_PATH = os.environ.get('TIMETABLE_SNAPSHOT')
+store = TimetableStore(compact=SNAPSHOT_PATH is not None, snapshot=Snapshot(SNAPSHOT_PATH) if SNAPSHOT_PATH else None)
+store.restore()
+availability = Availability()
+optimize_cache = ResultCache(int(os.environ.get('OPTIMIZE_CACHE_SIZE', 128)),
+                             float(os.environ.get('OPTIMIZE_CACHE_TTL', 300)))
+engine = None
+
+
+def get_engine():
+    """Return the reservation engine shared by all workers through the database in RESERVATION_DB"""
+    global engine
+    if engine is None:
+        engine = ReservationEngine(os.environ.get('RESERVATION_DB', 'reservations.sqlite3'))
+    return engine
+
+
+def get_json():
+    with timed('parse'):
+        return request.get_json()
+
+
+def send_json(data):
+    with timed('encode'):
+        return jsonify(data)
+
+
+@app.before_request
+def count_request():
+    REQUESTS.inc(label_value=request.url_rule.rule if request.url_rule is not None else UNMATCHED)
+
+
+@app.errorhandler(InvalidRule)
+def invalid_rule(e):
+    return jsonify({"error": str(e)}), 400
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/reserve/', methods=['GET', 'POST'])
 def post_json():
     if request.method == 'POST':
-        received_json = request.get_json()
-        print(received_json)
-        timetable = process_reservation_request(received_json)
-        return jsonify(timetable)
+        try:
+            placement, weights = get_placement_args(request.args)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        received_json = get_json()
+        logger.debug("received %s", received_json)
+        timetable = process_reservation_request(received_json, placement, weights)
+        return send_json(timetable)
     else:
         return "post_json called without POST"
 
 
+@app.route('/reserve/batch/', methods=['POST'])
+def post_batch():
+    order = request.args.get('order', 'earliest_start')
+    if order not in PLACEMENT_ORDERS:
+        return jsonify({"error": "unknown order " + order}), 400
+    try:
+        placement, weights = get_placement_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return send_json(process_batch_reservation_request(get_json(), order, placement, weights))
+
+
 @app.route('/optimize/', methods=['GET', 'POST'])
 def post_optimize():
     if request.method == 'POST':
-        received_json = request.get_json()
-        timetable = optimize(received_json)
-        return jsonify(timetable)
+        strategy = request.args.get('strategy', 'best_fit')
+        if strategy not in OPTIMIZATION_STRATEGIES:
+            return jsonify({"error": "unknown strategy " + strategy}), 400
+        output_format = request.args.get('format', 'full')
+        received_json = get_json()
+        if output_format == 'stream':
+            timetable = Timetable(received_json['winstrom']['udalost'], received_json)
+            return Response(optimize_timetable(timetable, strategy).iter_json(), mimetype='application/json')
+        timetable = optimize(received_json, strategy, diff=output_format == 'diff', cache=optimize_cache)
+        return send_json(timetable)
     else:
-        return "post_json called without POST"
\ No newline at end of file
+        return "post_json called without POST"
+
+
+@app.route('/optimize/cache/', methods=['GET'])
+def get_optimize_cache():
+    return jsonify(optimize_cache.stats())
+
+
+@app.route('/timetable/', methods=['POST'])
+def post_timetable():
+    received_json = get_json()
+    version = store.load(received_json['winstrom']['udalost'])
+    return jsonify({"version": version})
+
+
+@app.route('/timetable/events/', methods=['GET', 'POST'])
+def timetable_events():
+    if request.method == 'POST':
+        received_json = get_json()
+        if not isinstance(received_json, dict) or not isinstance(received_json.get('events'), list):
+            return jsonify({"error": "events have to be a list"}), 400
+        try:
+            version = store.apply_events(received_json['events'], received_json.get('version'))
+        except VersionConflict:
+            return jsonify({"version": store.version}), 409
+        except KeyError as e:
+            return jsonify({"error": "unknown reservation " + str(e)}), 404
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"version": version})
+    else:
+        events = store.changes_since(request.args.get('since', 0, type=int))
+        if events is None:
+            return jsonify({"version": store.version}), 410
+        return jsonify({"version": store.version, "events": events})
+
+
+@app.route('/timetable/reserve/', methods=['POST'])
+def post_timetable_reserve():
+    try:
+        placement, weights = get_placement_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    received_json = get_json()
+    for element in received_json['winstrom']['udalost']:
+        if element['predmet'] == "":
+            try:
+                return jsonify(store.reserve(element, request.args.get('reoptimize') == '1', placement, weights))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+    return jsonify({"error": "no reservation request"}), 400
+
+
+def get_time_args(*names):
+    """Return the query arguments with the given names converted to times, raise ValueError if one is missing or is
+    not a date"""
+    if any(name not in request.args for name in names):
+        raise ValueError("missing " + ", ".join(names))
+    return [convert_date_to_time(request.args[name]) for name in names]
+
+
+@app.route('/timetable/availability/', methods=['GET'])
+def get_availability():
+    try:
+        start, end = get_time_args('start', 'end')
+    except ValueError:
+        return jsonify({"error": "start and end have to be dates"}), 400
+    if end <= start:
+        return jsonify({"error": "end has to be after start"}), 400
+    with store.lock:
+        spots = availability.get_free_spots(store.timetable, start, end)
+    return jsonify({"free": [parking_spot.name for parking_spot in spots]})
+
+
+@app.route('/timetable/availability/earliest/', methods=['GET'])
+def get_earliest_availability():
+    try:
+        after, = get_time_args('after')
+        duration = int(request.args['duration'])
+    except (KeyError, ValueError):
+        return jsonify({"error": "after has to be a date and duration a number of minutes"}), 400
+    if duration < 1:
+        return jsonify({"error": "duration has to be at least 1"}), 400
+    limit = request.args.get('limit', 10, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit has to be at least 1"}), 400
+    with store.lock:
+        fits = availability.get_earliest_fits(store.timetable, after, duration, limit)
+    return jsonify({"fits": [{"spot": parking_spot.name, "start": convert_time_to_date(start),
+                              "end": convert_time_to_date(start + duration)} for start, parking_spot in fits]})
+
+
+@app.route('/timetable/availability/intervals/', methods=['GET'])
+def get_availability_intervals():
+    try:
+        start, end = get_time_args('start', 'end')
+    except ValueError:
+        return jsonify({"error": "start and end have to be dates"}), 400
+    if end <= start:
+        return jsonify({"error": "end has to be after start"}), 400
+    limit = request.args.get('limit', 100, type=int)
+    if limit < 1:
+        return jsonify({"error": "limit has to be at least 1"}), 400
+    with store.lock:
+        parking_spot = store.timetable.get_parking_spot(request.args.get('spot'))
+        if parking_spot is None:
+            return jsonify({"error": "unknown spot " + str(request.args.get('spot'))}), 404
+        store.timetable.expand_rules(start, end)
+        intervals, more = availability.get_intervals(parking_spot, start, end, limit)
+    return jsonify({"intervals": [{"start": convert_time_to_date(free_start), "end": convert_time_to_date(free_end)}
+                                  for free_start, free_end in intervals],
+                    "next": convert_time_to_date(intervals[-1][1]) if more else None})
+
+
+@app.route('/reserve/stream/', methods=['POST'])
+def post_reserve_stream():
+    try:
+        placement, weights = get_placement_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    element = process_reservation_stream(request.stream, placement, weights)
+    if element is None:
+        return jsonify({"error": "no reservation request"}), 400
+    return jsonify(element)
+
+
+@app.route('/optimize/stream/', methods=['POST'])
+def post_optimize_stream():
+    strategy = request.args.get('strategy', 'best_fit')
+    if strategy not in OPTIMIZATION_STRATEGIES:
+        return jsonify({"error": "unknown strategy " + strategy}), 400
+    return jsonify(optimize_stream(request.stream, strategy))
+
+
+@app.route('/shared/timetable/', methods=['POST'])
+def post_shared_timetable():
+    get_engine().load(get_json()['winstrom']['udalost'])
+    return jsonify({"loaded": True})
+
+
+@app.route('/shared/reserve/', methods=['POST'])
+def post_shared_reserve():
+    for element in get_json()['winstrom']['udalost']:
+        if element['predmet'] == "":
+            try:
+                return jsonify(get_engine().reserve_element(element))
+            except Conflict:
+                return jsonify({"error": "too many concurrent reservations, try again"}), 409
+            except sqlite3.IntegrityError:
+                return jsonify({"error": "reservation " + element['id'] + " already exists"}), 409
+    return jsonify({"error": "no reservation request"}), 400
@@ -0,0 +1,238 @@
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+
+from recurrence import RecurrenceRule
+from reservation import Timetable, TimeSlot, CompactParkingSpot, SymbolTable
+
+MAGIC = b'RSNAP002'
+# magic, generation, version of the store, number of symbols, number of spots
+HEADER = struct.Struct('<8sqqII')
+SYMBOL = struct.Struct('<I')
+# length of the name, reservable, number of reservations
+SPOT = struct.Struct('<HBq')
+# length of the JSON with the recurring bookings and the expanded window after the columns
+RULES = struct.Struct('<I')
+
+
+def align(offset):
+    return (offset + 7) & ~7
+
+
+class MappedParkingSpot(CompactParkingSpot):
+    """Compact parking spot whose columns are read-only views of a memory-mapped snapshot, so the pages are shared
+    by all processes that map the same file. The columns are copied into arrays of its own when the spot is changed
+    for the first time"""
+
+    def __init__(self, name, reservable, symbols, columns, attributes=None):
+        super().__init__(name, reservable, symbols=symbols, attributes=attributes)
+        self.starts, self.ends, self.ids, self.users = columns
+
+    def own_columns(self):
+        if isinstance(self.starts, memoryview):
+            columns = []
+            for typecode, column in zip('qqqi', (self.starts, self.ends, self.ids, self.users)):
+                columns.append(array(typecode))
+                columns[-1].frombytes(column.cast('B'))
+            self.starts, self.ends, self.ids, self.users = columns
+
+    def _insert(self, idx, time_slot):
+        self.own_columns()
+        super()._insert(idx, time_slot)
+
+    def _delete(self, idx):
+        self.own_columns()
+        super()._delete(idx)
+
+    def find_id(self, id):
+        if isinstance(self.ids, memoryview):  # memoryview has no index()
+            number = self.symbols.find_id(id)
+            ids = self.ids.tolist()
+            return ids.index(number) if number in ids else None
+        return super().find_id(id)
+
+
+def write_snapshot(timetable, path, generation, version=0):
+    """Write reservations of a timetable to a binary file: the header, the symbol table (users and ids that are not
+    numbers), the table of the parking spots, then starts, ends, ids and users of every spot as arrays of integers
+    in the native byte order and at last the recurring bookings as JSON. The file is replaced atomically"""
+    symbols = SymbolTable()
+    spots = []
+    for parking_spot in timetable.parking_spots:
+        columns = (array('q', parking_spot.starts), array('q', parking_spot.ends), array('q'), array('i'))
+        for time_slot in parking_spot.reservations:
+            columns[2].append(symbols.encode_id(time_slot.id))
+            columns[3].append(symbols.index(time_slot.user))
+        spots.append((parking_spot, columns))
+
+    parts = [HEADER.pack(MAGIC, generation, version, len(symbols.values), len(spots))]
+    for value in symbols.values:
+        data = value.encode('utf-8')
+        parts.append(SYMBOL.pack(len(data)) + data)
+    for parking_spot, columns in spots:
+        name = parking_spot.name.encode('utf-8')
+        parts.append(SPOT.pack(len(name), parking_spot.is_reservable, len(columns[0])) + name)
+    offset = sum(len(part) for part in parts)
+    for _, columns in spots:
+        for column in columns:
+            parts.append(b'\0' * (align(offset) - offset))
+            offset = align(offset)
+            parts.append(column.tobytes())
+            offset += len(parts[-1])
+    rules = json.dumps({"expanded": timetable.expanded, "rules": {
+        spot_name: [rule.to_dict() for rule in rules] for spot_name, rules in timetable.rules.items() if rules}})
+    parts.append(RULES.pack(len(rules.encode('utf-8'))) + rules.encode('utf-8'))
+
+    with open(path + '.tmp', 'wb') as file:
+        file.writelines(parts)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def read_snapshot(path, inventory=None):
+    """Map a snapshot file into memory and return the timetable with the reservations in it, the generation and the
+    version of the snapshot. Only the tables are read, reservations stay in the mapped pages. Spots of the inventory
+    which are not in the snapshot are added without reservations, spots which are no longer in the inventory are
+    dropped (see Timetable.drop_parking_spot)"""
+    with open(path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, generation, version, symbol_count, spot_count = HEADER.unpack_from(view)
+    if magic != MAGIC:
+        raise ValueError(path + " is not a snapshot")
+    offset = HEADER.size
+
+    symbols = SymbolTable()
+    for _ in range(symbol_count):
+        length, = SYMBOL.unpack_from(view, offset)
+        offset += SYMBOL.size
+        symbols.index(str(view[offset:offset + length], 'utf-8'))
+        offset += length
+    spots = []
+    for _ in range(spot_count):
+        length, reservable, count = SPOT.unpack_from(view, offset)
+        offset += SPOT.size
+        spots.append((str(view[offset:offset + length], 'utf-8'), reservable, count))
+        offset += length
+
+    timetable = Timetable(compact=True, inventory=inventory)
+    names = set(timetable.spots)
+    timetable.symbols = symbols
+    for parking_spot in timetable.parking_spots:
+        parking_spot.symbols = symbols
+    for name, reservable, count in spots:
+        columns = []
+        for typecode in 'qqqi':
+            offset = align(offset)
+            size = count * array(typecode).itemsize
+            columns.append(view[offset:offset + size].cast(typecode))
+            offset += size
+        old_spot = timetable.get_parking_spot(name)
+        attributes = old_spot.attributes if old_spot is not None else None
+        timetable.add_parking_spot(MappedParkingSpot(name, reservable, symbols, columns, attributes))
+    length, = RULES.unpack_from(view, offset)
+    offset += RULES.size
+    rules = json.loads(str(view[offset:offset + length], 'utf-8'))
+    timetable.rules = {spot_name: [RecurrenceRule(**rule) for rule in spot_rules]
+                       for spot_name, spot_rules in rules['rules'].items() if spot_name in timetable.spots}
+    timetable.expanded = tuple(rules['expanded']) if rules['expanded'] is not None else None
+    for parking_spot in list(timetable.parking_spots):
+        if parking_spot.name not in names:
+            timetable.drop_parking_spot(parking_spot)
+    return timetable, generation, version
+
+
+class Snapshot:
+    """Timetable persisted in a snapshot file and an append-only log of the changes since it was written (the same
+    path with .log), which is replayed on top of the snapshot when it is loaded. Only one process should write, after
+    max_changes changes in the log the writer should save a new snapshot"""
+
+    def __init__(self, path, inventory=None, max_changes=100000):
+        self.path = path
+        self.log_path = path + '.log'
+        self.inventory = inventory
+        self.max_changes = max_changes
+        self.generation = None
+        self.changes = 0
+        self.log = None
+
+    def save(self, timetable, version=0):
+        """Write a new snapshot and start a new log. Log records of older snapshots are ignored when the log is
+        replayed, so a crash between the two steps loses nothing"""
+        generation = time.time_ns()
+        write_snapshot(timetable, self.path, generation, version)
+        self.generation = generation
+        self.changes = 0
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self.log_path, 'w', encoding='utf-8')
+
+    def load(self):
+        """Return the timetable and the version of the snapshot with the log replayed, None if there is no snapshot"""
+        if not os.path.exists(self.path):
+            return None
+        timetable, self.generation, version = read_snapshot(self.path, self.inventory)
+        self.changes = 0
+        if os.path.exists(self.log_path):
+            with open(self.log_path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:  # the last line may be cut off by a crash
+                        break
+                    if change['generation'] == self.generation:
+                        apply_change(timetable, change)
+                        version = change['version']
+                        self.changes += 1
+        if self.log is not None:
+            self.log.close()
+        self.log = open(self.log_path, 'a', encoding='utf-8')
+        return timetable, version
+
+    def append(self, version, action, spot_name, item):
+        """Append a change to the log: add or remove of a time slot, add_rule or remove_rule of a recurring booking
+        (RecurrenceRule) or reservable with a new list of the reservable spots"""
+        if self.log is None:
+            return
+        change = {"generation": self.generation, "version": version, "action": action, "spot": spot_name}
+        if action == 'reservable':
+            change['reservable'] = item
+        elif action in ('add_rule', 'remove_rule'):
+            change['rule'] = item.to_dict()
+        else:
+            change.update(id=item.id, user=item.user, start=item.start, end=item.end)
+        self.log.write(json.dumps(change) + "\n")
+        self.log.flush()
+        self.changes += 1
+
+    def close(self):
+        if self.log is not None:
+            self.log.close()
+            self.log = None
+
+
+def apply_change(timetable, change):
+    if change['action'] == 'reservable':
+        timetable.set_reservable_spots({"predmet": "", "reservation": change['reservable']})
+        return
+    parking_spot = timetable.get_parking_spot(change['spot'])
+    if parking_spot is None:
+        return
+    if change['action'] == 'add_rule':
+        timetable.add_rule(parking_spot.name, RecurrenceRule(**change['rule']))
+        return
+    if change['action'] == 'remove_rule':
+        for rule in timetable.rules.get(parking_spot.name, ()):
+            if rule.id == change['rule']['id']:
+                timetable.remove_rule(parking_spot.name, rule)
+                break
+        return
+    time_slot = TimeSlot(change['id'], change['user'], change['start'], change['end'])
+    if change['action'] == 'add':
+        parking_spot.add_reservation(time_slot)
+    elif change['action'] == 'remove':
+        parking_spot.remove_reservation(time_slot)
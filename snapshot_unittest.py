@@ -0,0 +1,152 @@
+import json
+import os
+import tempfile
+import unittest
+from array import array
+from inventory import SpotInventory
+from reservation_unittest import test_data
+from reservation import Timetable, TimeSlot
+from snapshot import Snapshot, MappedParkingSpot, write_snapshot, read_snapshot
+from store import TimetableStore
+from store_unittest import get_record
+
+
+def get_reservations(timetable):
+    return {parking_spot.name: [(slot.id, slot.user, slot.start, slot.end) for slot in parking_spot.reservations]
+            for parking_spot in timetable.parking_spots}
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'timetable.snap')
+        self.timetable = Timetable(test_data['winstrom']['udalost'], test_data)
+        # an id that is not a number goes to the symbol table
+        self.timetable.parking_spots[0].add_reservation(TimeSlot("a-1", "user", 10, 20))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_write_and_read(self):
+        self.timetable.parking_spots[3].is_reservable = False
+        write_snapshot(self.timetable, self.path, 7, 3)
+        timetable, generation, version = read_snapshot(self.path)
+        self.assertEqual((7, 3), (generation, version))
+        self.assertEqual(get_reservations(self.timetable), get_reservations(timetable))
+        self.assertEqual([parking_spot.is_reservable for parking_spot in self.timetable.parking_spots],
+                         [parking_spot.is_reservable for parking_spot in timetable.parking_spots])
+        self.assertIsInstance(timetable.parking_spots[0].starts, memoryview)
+
+    def test_inventory_changed(self):
+        write_snapshot(self.timetable, self.path, 0)
+        inventory_path = os.path.join(self.directory.name, 'spots.json')
+        with open(inventory_path, 'w') as file:
+            json.dump({"spots": [{"name": "102"}, {"name": "150"}]}, file)
+        timetable, _, _ = read_snapshot(self.path, SpotInventory(inventory_path))
+        # 101 has reservations and is kept without new ones, the other old spots are empty
+        self.assertEqual(["102", "150", "101"], [parking_spot.name for parking_spot in timetable.parking_spots])
+        self.assertEqual([True, True, False], [parking_spot.is_reservable for parking_spot in timetable.parking_spots])
+
+    def test_copy_on_write(self):
+        write_snapshot(self.timetable, self.path, 0)
+        timetable, _, _ = read_snapshot(self.path)
+        parking_spot, other_spot = timetable.parking_spots[:2]
+        self.assertIsInstance(parking_spot, MappedParkingSpot)
+        self.assertEqual(0, parking_spot.find_id("a-1"))
+        parking_spot.remove_reservation(parking_spot.reservations[0])
+        parking_spot.add_reservation(TimeSlot("b-2", "user", 30, 40))
+        self.assertIsInstance(parking_spot.starts, array)
+        self.assertIsInstance(other_spot.starts, memoryview)
+        self.assertEqual(("b-2", "user", 30, 40), get_reservations(timetable)[parking_spot.name][0][:4])
+        self.assertIsNone(parking_spot.find_id("a-1"))
+
+    def test_log_replay(self):
+        snapshot = Snapshot(self.path)
+        snapshot.save(self.timetable, 1)
+        time_slot = TimeSlot("c-3", "user", 50, 60)
+        snapshot.append(2, 'add', "102", time_slot)
+        snapshot.append(3, 'remove', "101", TimeSlot("a-1", "user", 10, 20))
+        snapshot.append(4, 'reservable', "", ["101"])
+        snapshot.close()
+        with open(self.path + '.log', 'a', encoding='utf-8') as file:
+            # a record of an older snapshot and a line cut off by a crash
+            file.write(json.dumps({"generation": 0, "version": 5, "action": 'add', "spot": "103", "id": "d-4",
+                                   "user": "user", "start": 0, "end": 1}) + "\n")
+            file.write('{"generation": ')
+
+        snapshot = Snapshot(self.path)
+        self.addCleanup(snapshot.close)
+        timetable, version = snapshot.load()
+        self.timetable.parking_spots[0].remove_reservation(TimeSlot("a-1", "user", 10, 20))
+        self.timetable.parking_spots[1].add_reservation(time_slot)
+        self.assertEqual(4, version)
+        self.assertEqual(get_reservations(self.timetable), get_reservations(timetable))
+        self.assertEqual(["101"], [parking_spot.name for parking_spot in timetable.parking_spots
+                                   if parking_spot.is_reservable])
+
+    def test_no_snapshot(self):
+        self.assertIsNone(Snapshot(self.path).load())
+        self.assertIsNone(TimetableStore(snapshot=Snapshot(self.path)).restore())
+
+
+class SnapshotStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'timetable.snap')
+        self.store = TimetableStore(snapshot=Snapshot(self.path))
+        self.store.load([get_record("41"), get_record("42")])
+
+    def tearDown(self):
+        self.store.snapshot.close()
+        self.directory.cleanup()
+
+    def restore(self):
+        self.store.snapshot.close()
+        store = TimetableStore(snapshot=Snapshot(self.path))
+        self.addCleanup(store.snapshot.close)
+        self.assertEqual(self.store.version, store.restore())
+        self.assertEqual(get_reservations(self.store.timetable), get_reservations(store.timetable))
+        return store
+
+    def test_restore(self):
+        self.store.reserve(get_record("1"))
+        self.store.apply({"action": "remove", "udalost": {"id": "42"}})
+        store = self.restore()
+        self.assertEqual({}, store.records)
+        self.assertEqual(2, len(store.restored))
+
+    def test_change_restored(self):
+        store = self.restore()
+        store.apply({"action": "modify", "udalost": {"id": "41", "predmet": "103"}})
+        self.assertEqual("103", store.records["41"]['predmet'])
+        self.assertEqual(get_record("41")['zodpPrac'], store.records["41"]['zodpPrac'])
+        self.assertRaises(KeyError, store.apply, {"action": "remove", "udalost": {"id": "43"}})
+        store.apply({"action": "remove", "udalost": {"id": "42"}})
+        self.assertEqual(["41"], [slot.id for slot in store.timetable.get_parking_spot("103").reservations])
+        self.assertEqual(0, len(store.timetable.get_parking_spot("102").reservations))
+        self.store = store
+        self.restore()
+
+    def test_reserve_reoptimize_restored(self):
+        self.store.apply({"action": "modify", "udalost": {"id": "42", "predmet": "103",
+                                                         "zahajeni": "2021-04-17T12:41:49.285+02:00",
+                                                         "dokonceni": "2021-04-17T13:41:49.285+02:00"}})
+        store = self.restore()
+        request = dict(get_record("1"), zahajeni="2021-04-17T12:00:00.000+02:00",
+                       dokonceni="2021-04-17T13:00:00.000+02:00")
+        self.assertEqual("102", store.reserve(request, reoptimize=True)['predmet'])
+        self.assertEqual("101", store.records["42"]['predmet'])
+        self.store = store
+        self.restore()
+
+    def test_compaction(self):
+        self.store.snapshot.max_changes = 2
+        self.store.reserve(get_record("1"))
+        self.store.apply({"action": "remove", "udalost": {"id": "42"}})
+        self.assertEqual(0, self.store.snapshot.changes)
+        self.assertEqual(0, os.path.getsize(self.path + '.log'))
+        self.restore()
+
+
+if __name__ == '__main__':
+    unittest.main()
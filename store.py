@@ -0,0 +1,284 @@
+import threading
+from collections import deque
+from itertools import repeat
+
+from recurrence import RecurrenceRule, InvalidRule
+from reservation import Timetable, TimeSlot, get_reservation_time, get_placement_parking_spot, \
+    reoptimize_timetable, convert_time_to_date, get_rule, get_rule_element, get_rule_parking_spot, get_reservable
+
+
+class VersionConflict(Exception):
+    """Raised when a delta is based on another version than the current version of the store"""
+
+
+class InvalidEvent(ValueError):
+    """Raised when an event has an unknown action or its record is not a valid reservation"""
+
+
+def check_record(record):
+    """Raise InvalidEvent if a record has not the fields of a reservation or its times are not dates, its rule is
+    checked by get_rule"""
+    if any(field not in record for field in ('id', 'predmet', 'zodpPrac')):
+        raise InvalidEvent("reservation " + str(record.get('id')) + " needs id, predmet and zodpPrac")
+    try:
+        get_reservation_time(record['zahajeni'], record['dokonceni'])
+    except KeyError:
+        raise InvalidEvent("reservation " + str(record['id']) + " needs zahajeni and dokonceni") from None
+    except (TypeError, ValueError) as e:
+        raise InvalidEvent("reservation " + str(record['id']) + ": " + str(e)) from None
+
+
+class TimetableStore:
+    """Timetable kept in memory between requests.
+
+    The store is loaded once with the whole udalost payload and then updated by add, remove and modify events keyed
+    by reservation id. Every event bumps the version number, and the last events are kept so that a client can ask
+    only for the changes since the version it has seen. Records with rrule are recurring bookings, the store keeps
+    their rules in the timetable. Changes of the spot inventory are taken over on the next change of the store.
+
+    With a Snapshot every load writes a snapshot and every change is appended to its log, so that a restarted server
+    can restore the store without the whole payload."""
+
+    def __init__(self, max_events=10000, compact=False, snapshot=None, inventory=None):
+        self.lock = threading.RLock()
+        self.compact = compact
+        self.snapshot = snapshot
+        self.inventory = inventory
+        self.timetable = Timetable(compact=compact, inventory=inventory)
+        self.records = {}
+        self.slots = {}
+        # encoded id -> spot name of the restored reservations whose records have not been needed yet
+        self.restored = {}
+        self.pending = []
+        self.version = 0
+        self.events = deque(maxlen=max_events)
+
+    def load(self, reservations):
+        """Replace the whole content of the store with a list of udalost records"""
+        with self.lock:
+            # without the requests, their lists of spots must not change the reservable spots of the store
+            self.timetable = Timetable([record for record in reservations if record['predmet'] != ""],
+                                       compact=self.compact, inventory=self.inventory)
+            self.records = {}
+            self.slots = {}
+            for record in reservations:
+                self.records[record['id']] = record
+                slot = self._find_slot(record)
+                if slot is not None:
+                    self.slots[record['id']] = slot
+            self.restored = {}
+            self.pending = []
+            self.version += 1
+            self.events.clear()
+            if self.snapshot is not None:
+                self.snapshot.save(self.timetable, self.version)
+            return self.version
+
+    def restore(self):
+        """Replace the content of the store with the snapshot and its log. The reservations stay in the mapped
+        snapshot, records of the udalost are made up from them only when they are changed. Return the version, None if
+        there is no snapshot"""
+        with self.lock:
+            loaded = self.snapshot.load() if self.snapshot is not None else None
+            if loaded is None:
+                return None
+            self.timetable, self.version = loaded
+            self.records = {}
+            self.slots = {}
+            self.restored = {}
+            for parking_spot in self.timetable.parking_spots:
+                self.restored.update(zip(parking_spot.ids, repeat(parking_spot.name)))
+            # recurring bookings are few, their records are made up right away
+            for spot_name, rules in self.timetable.rules.items():
+                for rule in rules:
+                    self.records[rule.id] = get_rule_element(spot_name, rule)
+                    self.slots[rule.id] = rule
+                    self.restored.pop(self.timetable.symbols.find_id(rule.id), None)
+            self.pending = []
+            self.events.clear()
+            return self.version
+
+    def _get_record(self, id, spot_name=None):
+        """Return the record with a given id, None if there is none. A restored reservation that has been moved by
+        the timetable in the meantime is looked up in spot_name"""
+        record = self.records.get(id)
+        if record is not None or not self.restored:
+            return record
+        old_spot_name = self.restored.pop(self.timetable.symbols.find_id(id), None)
+        if old_spot_name is None:
+            return None
+        parking_spot = self.timetable.get_parking_spot(spot_name or old_spot_name)
+        slot = parking_spot.reservations[parking_spot.find_id(id)]
+        record = {"id": id, "predmet": old_spot_name, "zahajeni": convert_time_to_date(slot.start),
+                  "dokonceni": convert_time_to_date(slot.end), "zodpPrac": slot.user}
+        self.records[id] = record
+        self.slots[id] = slot
+        return record
+
+    def _find_slot(self, record):
+        """Return the time slot (or the rule of a recurring booking) of a record that is already in the timetable"""
+        if 'rrule' in record:
+            found = self.timetable.find_rule(record['id'])
+            return found[1] if found is not None else None
+        parking_spot = self.timetable.get_parking_spot(record['predmet'])
+        if parking_spot is None:
+            return None
+        start, end = get_reservation_time(record['zahajeni'], record['dokonceni'])
+        idx = parking_spot.find(TimeSlot(record['id'], record['zodpPrac'], start, end))
+        return parking_spot.reservations[idx] if idx is not None else None
+
+    def _add(self, record):
+        self.records[record['id']] = record
+        if 'rrule' in record:
+            if self.timetable.get_parking_spot(record['predmet']) is not None:
+                self._add_rule(record['predmet'], get_rule(record))
+            return
+        start, end = get_reservation_time(record['zahajeni'], record['dokonceni'])
+        slot = TimeSlot(record['id'], record['zodpPrac'], start, end)
+        parking_spot = self.timetable.get_parking_spot(record['predmet'])
+        if parking_spot is not None:
+            parking_spot.add_reservation(slot)
+            self.slots[record['id']] = slot
+            self.pending.append(('add', parking_spot.name, slot))
+
+    def _add_rule(self, spot_name, rule):
+        self.timetable.add_rule(spot_name, rule)
+        self.slots[rule.id] = rule
+        self.pending.append(('add_rule', spot_name, rule))
+
+    def _remove(self, id):
+        self._get_record(id)
+        record = self.records.pop(id, None)
+        slot = self.slots.pop(id, None)
+        if isinstance(slot, RecurrenceRule):
+            self.timetable.remove_rule(record['predmet'], slot)
+            self.pending.append(('remove_rule', record['predmet'], slot))
+        elif slot is not None:
+            self.timetable.remove_reservation(record['predmet'], slot)
+            self.pending.append(('remove', record['predmet'], slot))
+        return record
+
+    def _commit(self, action, record):
+        self.version += 1
+        self.events.append({"version": self.version, "action": action, "udalost": record})
+        if self.snapshot is not None:
+            for change in self.pending:
+                self.snapshot.append(self.version, *change)
+            if self.snapshot.changes >= self.snapshot.max_changes:
+                self.snapshot.save(self.timetable, self.version)
+        self.pending = []
+
+    def _check(self, event, records):
+        """Return the record an event leaves behind, None for remove, without changing anything. records are the
+        records left by the previous events of the same delta by id. Raise KeyError if the event removes or modifies a
+        record that does not exist and InvalidEvent if it is not valid"""
+        try:
+            action, record, id = event['action'], event['udalost'], event['udalost']['id']
+        except (KeyError, TypeError):
+            raise InvalidEvent("an event needs action and udalost with id") from None
+        if action not in ('add', 'remove', 'modify'):
+            raise InvalidEvent("unknown action " + str(action))
+        if action == 'add':
+            old_record = None
+        else:
+            old_record = records[id] if id in records else self._get_record(id)
+            if old_record is None:
+                raise KeyError(id)
+            if action == 'remove':
+                return None
+            record = dict(old_record, **record)
+        check_record(record)
+        if 'rrule' in record:
+            try:
+                get_rule(record)
+            except InvalidRule as e:
+                raise InvalidEvent(str(e)) from None
+        return record
+
+    def apply(self, event):
+        """Apply a single add, remove or modify event and return the new version. Nothing is changed if the event
+        raises KeyError or InvalidEvent (see _check)"""
+        with self.lock:
+            self._check(event, {})
+            action, record = event['action'], event['udalost']
+            self.timetable.update_spots()
+            if action == 'add':
+                self._remove(record['id'])
+                self._add(record)
+            elif action == 'remove':
+                self._remove(record['id'])
+            else:
+                self._add(dict(self._remove(record['id']), **record))
+                record = self.records[record['id']]
+            self._commit(action, record)
+            return self.version
+
+    def apply_events(self, events, version=None):
+        """Apply a list of events at once. If a version is given, the events are a delta since that version and they
+        are rejected when the store has changed in the meantime. All events are checked first, if one of them is not
+        valid none is applied"""
+        with self.lock:
+            if version is not None and version != self.version:
+                raise VersionConflict(version)
+            records = {}
+            for event in events:
+                records[event['udalost']['id']] = self._check(event, records)
+            for event in events:
+                self.apply(event)
+            return self.version
+
+    def changes_since(self, version):
+        """Return the events after a given version. Return None if they are no longer kept and the client has to
+        load the whole timetable again"""
+        with self.lock:
+            if version > self.version:
+                return None
+            if version < self.version and (not self.events or self.events[0]['version'] > version + 1):
+                return None
+            return [event for event in self.events if event['version'] > version]
+
+    def reserve(self, element, reoptimize=False, placement='best_fit', weights=None):
+        """Find a parking spot for a new booking by a placement strategy, store it and return the element with the
+        assigned spot. Leave the spot empty if there is no free parking spot. With reoptimize the bookings around the
+        new one are packed again instead (see reoptimize_timetable) and every booking that has moved gets a modify
+        event. A recurring booking (with rrule) gets a spot where all its occurrences fit and is never reoptimized.
+        A request with its own list of spots ("reservation") is placed among them, without reoptimizing, the list does
+        not change the reservable spots of the store. Raise InvalidEvent if the element is not a valid reservation and
+        InvalidRule if its rule is not valid"""
+        check_record(element)
+        start, end = get_reservation_time(element['zahajeni'], element['dokonceni'])
+        request = TimeSlot(element['id'], element['zodpPrac'], start, end)
+        rule = get_rule(element) if 'rrule' in element else None
+        reservable = get_reservable(element)
+        with self.lock:
+            self.timetable.update_spots()
+            self._remove(element['id'])
+            if rule is not None:
+                spot = get_rule_parking_spot(self.timetable, rule, placement, weights, reservable)
+                record = dict(element, predmet=spot.name if spot is not None else "")
+                self.records[record['id']] = record
+                if spot is not None:
+                    self._add_rule(spot.name, rule)
+                self._commit('add', record)
+                return record
+            if reoptimize and reservable is None:
+                changes = reoptimize_timetable(self.timetable, added=[request])
+            else:
+                spot = get_placement_parking_spot(self.timetable, request, placement, weights, reservable)
+                changes = {}
+                if spot is not None:
+                    spot.add_reservation(request)
+                    changes[request.id] = spot.name
+            record = dict(element, predmet=changes.pop(request.id, ""))
+            self.records[record['id']] = record
+            if record['predmet'] != "":
+                self.slots[record['id']] = request
+                self.pending.append(('add', record['predmet'], request))
+            self._commit('add', record)
+            for id, spot_name in changes.items():
+                old_record = self._get_record(id, spot_name)
+                self.pending.append(('remove', old_record['predmet'], self.slots[id]))
+                self.pending.append(('add', spot_name, self.slots[id]))
+                self.records[id] = dict(old_record, predmet=spot_name)
+                self._commit('modify', self.records[id])
+            return record
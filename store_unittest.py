@@ -0,0 +1,91 @@
+import copy
+import unittest
+from reservation_unittest import test_data
+from store import TimetableStore, VersionConflict, InvalidEvent
+
+
+def get_record(id):
+    for element in test_data['winstrom']['udalost']:
+        if element['id'] == id:
+            return copy.deepcopy(element)
+
+
+class TimetableStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.store = TimetableStore()
+        self.store.load([get_record("41"), get_record("42")])
+
+    def test_reserve(self):
+        record = self.store.reserve(get_record("1"))
+        self.assertEqual("102", record['predmet'])
+        self.assertEqual(3, len(self.store.slots))
+        self.assertEqual(2, self.store.version)
+
+    def test_reserve_invalid(self):
+        request = get_record("1")
+        del request['dokonceni']
+        self.assertRaises(InvalidEvent, self.store.reserve, request)
+        self.assertRaises(InvalidEvent, self.store.reserve, dict(get_record("1"), zahajeni="tomorrow"))
+        self.assertEqual(1, self.store.version)
+
+    def test_reservable_per_request(self):
+        self.assertEqual("110", self.store.reserve(dict(get_record("1"), reservation=["110"]))['predmet'])
+        request = dict(get_record("1"), id="2")
+        self.assertEqual("102", self.store.reserve(request)['predmet'])
+        self.assertTrue(all(parking_spot.is_reservable for parking_spot in self.store.timetable.parking_spots))
+
+    def test_reserve_reoptimize(self):
+        # 42 right after 41, but on another spot
+        self.store.apply({"action": "modify", "udalost": {"id": "42", "predmet": "103",
+                                                         "zahajeni": "2021-04-17T12:41:49.285+02:00",
+                                                         "dokonceni": "2021-04-17T13:41:49.285+02:00"}})
+        request = dict(get_record("1"), zahajeni="2021-04-17T12:00:00.000+02:00",
+                       dokonceni="2021-04-17T13:00:00.000+02:00")
+        record = self.store.reserve(request, reoptimize=True)
+        self.assertEqual("102", record['predmet'])
+        self.assertEqual(['add', 'modify'], [event['action'] for event in self.store.changes_since(2)])
+        self.assertEqual("101", self.store.records["42"]['predmet'])
+        self.assertEqual(["41", "42"], [slot.id for slot in self.store.timetable.parking_spots[0].reservations])
+
+    def test_remove_and_modify(self):
+        self.store.apply({"action": "remove", "udalost": {"id": "42"}})
+        self.assertEqual(0, len(self.store.timetable.parking_spots[1].reservations))
+        self.store.apply({"action": "modify", "udalost": {"id": "41", "predmet": "103"}})
+        self.assertEqual(0, len(self.store.timetable.parking_spots[0].reservations))
+        self.assertEqual("41", self.store.timetable.parking_spots[2].reservations[0].id)
+        self.assertRaises(KeyError, self.store.apply, {"action": "remove", "udalost": {"id": "42"}})
+
+    def test_changes_since(self):
+        self.store.reserve(get_record("1"))
+        self.store.apply({"action": "remove", "udalost": {"id": "42"}})
+        self.assertEqual(['add', 'remove'], [event['action'] for event in self.store.changes_since(1)])
+        self.assertEqual(['remove'], [event['action'] for event in self.store.changes_since(2)])
+        self.assertEqual([], self.store.changes_since(3))
+        self.assertIsNone(self.store.changes_since(4))
+
+    def test_delta_is_atomic(self):
+        events = [{"action": "remove", "udalost": {"id": "41"}}, {"action": "remove", "udalost": {"id": "999"}}]
+        self.assertRaises(KeyError, self.store.apply_events, events)
+        self.assertEqual((1, "41"), (self.store.version, self.store.timetable.parking_spots[0].reservations[0].id))
+        events[1] = {"action": "move", "udalost": {"id": "42"}}
+        self.assertRaises(InvalidEvent, self.store.apply_events, events)
+        events[1] = {"action": "modify", "udalost": {"id": "42", "zahajeni": "yesterday"}}
+        self.assertRaises(InvalidEvent, self.store.apply_events, events)
+        events[1] = {"action": "add", "udalost": dict(get_record("1"), predmet="102", rrule="FREQ=MONTHLY")}
+        self.assertRaises(InvalidEvent, self.store.apply_events, events)
+        self.assertEqual(1, self.store.version)
+        self.assertEqual({"41", "42"}, set(self.store.records))
+        # later events see the records left by the earlier ones
+        events = [{"action": "add", "udalost": dict(get_record("1"), predmet="102")},
+                  {"action": "modify", "udalost": {"id": "1", "predmet": "103"}},
+                  {"action": "remove", "udalost": {"id": "1"}}]
+        self.assertEqual(4, self.store.apply_events(events))
+
+    def test_version_conflict(self):
+        event = {"action": "remove", "udalost": {"id": "42"}}
+        self.assertRaises(VersionConflict, self.store.apply_events, [event], 0)
+        self.assertEqual(2, self.store.apply_events([event], 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
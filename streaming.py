@@ -0,0 +1,145 @@
+import codecs
+import json
+import re
+
+from reservation import Timetable, TimeSlot, get_reservation_time, optimize_timetable, get_rule, reserve_element
+
+# fields of a booking the scheduler needs, others are dropped while reading
+SCHEDULER_FIELDS = ('id', 'predmet', 'zahajeni', 'dokonceni', 'zodpPrac', 'reservation', 'rrule', 'exdate', 'tzid')
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+
+
+class JSONStreamReader:
+    """Reads JSON values one by one from a binary stream, only the unread part of the current chunk is kept in memory"""
+
+    def __init__(self, stream, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Append next chunk of the stream to the buffer. Return False if the stream has ended"""
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        self.eof = not chunk
+        self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk, final=self.eof)
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """Return the next character that is not a whitespace without reading it, empty string at the end"""
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("expected '" + char + "' at " + repr(self.buffer[self.pos:self.pos + 20]))
+        self.pos += 1
+
+    def skip(self, char):
+        """Read a given character if it is next"""
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value(self):
+        """Read a whole JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self, path):
+        """Yield the elements of the array found under the given keys, for example ('winstrom', 'udalost'), the rest
+        of the document is read and thrown away"""
+        self.expect('{')
+        if self.skip('}'):
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            if key == path[0] and len(path) > 1 and self.peek() == '{':
+                yield from self.items(path[1:])
+            elif key == path[0] and len(path) == 1 and self.peek() == '[':
+                self.pos += 1
+                if not self.skip(']'):
+                    while True:
+                        yield self.value()
+                        if self.skip(']'):
+                            break
+                        self.expect(',')
+            else:
+                self.value()
+            if self.skip('}'):
+                return
+            self.expect(',')
+
+
+def iter_udalost(stream, chunk_size=65536):
+    """Yield udalost elements of a winstrom document one by one. Bookings keep only the fields the scheduler needs,
+    reservation requests (elements without predmet) are kept whole because they are sent back"""
+    for element in JSONStreamReader(stream, chunk_size).items(('winstrom', 'udalost')):
+        if element['predmet'] == "":
+            yield element
+        else:
+            yield {field: element[field] for field in SCHEDULER_FIELDS if field in element}
+
+
+def read_timetable(stream, keep_records=True):
+    """Build a timetable from a winstrom document in a stream. Return the timetable, the reduced elements of the
+    bookings (empty if they are not kept) and the reservation requests"""
+    timetable = Timetable()
+    spots = timetable.spots
+    records, requests = [], []
+    for element in iter_udalost(stream):
+        if element['predmet'] == "":
+            timetable.set_reservable_spots(element)
+            requests.append(element)
+            continue
+        if keep_records:
+            records.append(element)
+        if element['predmet'] in spots and 'rrule' in element:
+            timetable.add_rule(element['predmet'], get_rule(element))
+        elif element['predmet'] in spots:
+            start, end = get_reservation_time(element['zahajeni'], element['dokonceni'])
+            spots[element['predmet']].add_reservation(TimeSlot(element['id'], element['zodpPrac'], start, end))
+    return timetable, records, requests
+
+
+def process_reservation_stream(stream, placement='best_fit', weights=None):
+    """Find a parking spot by a placement strategy (see PLACEMENT_STRATEGIES) for the first reservation request of a
+    winstrom document in a stream. Return the request with the assigned parking spot, the spot stays empty if there is
+    no free one"""
+    timetable, _, requests = read_timetable(stream, keep_records=False)
+    if not requests:
+        return None
+    element = requests[0]
+    spot = reserve_element(timetable, element, placement, weights)
+    return dict(element, predmet=spot.name if spot else "")
+
+
+def optimize_stream(stream, strategy='best_fit'):
+    """Optimize a timetable read from a stream. Return a winstrom document with the reduced bookings"""
+    timetable, records, requests = read_timetable(stream)
+    assignments = optimize_timetable(timetable, strategy).get_assignments()
+    udalost = [dict(record, predmet=assignments.get(record['id'], record['predmet'])) for record in records]
+    return {"winstrom": {"udalost": udalost + requests}}
@@ -0,0 +1,42 @@
+import io
+import json
+import unittest
+from reservation import optimize, process_reservation_request
+from reservation_unittest import test_data, optimal_space_data
+from streaming import JSONStreamReader, iter_udalost, process_reservation_stream, optimize_stream, SCHEDULER_FIELDS
+
+
+def make_stream(data):
+    return io.BytesIO(json.dumps(data, indent=1).encode('utf-8'))
+
+
+class StreamingTestCase(unittest.TestCase):
+    def test_small_chunks(self):
+        data = {"a": [1, {"b": "ů"}], "winstrom": {"@version": "1.0", "udalost": [{"predmet": "1"}, 12345]}, "c": {}}
+        for chunk_size in [1, 2, 3, 7, 1000]:
+            reader = JSONStreamReader(make_stream(data), chunk_size)
+            self.assertEqual([{"predmet": "1"}, 12345], list(reader.items(('winstrom', 'udalost'))))
+
+    def test_empty_array(self):
+        reader = JSONStreamReader(make_stream({"winstrom": {"udalost": []}}))
+        self.assertEqual([], list(reader.items(('winstrom', 'udalost'))))
+
+    def test_fields_are_reduced(self):
+        elements = list(iter_udalost(make_stream(test_data), 16))
+        self.assertEqual(test_data['winstrom']['udalost'][0], elements[0])
+        self.assertEqual(set(SCHEDULER_FIELDS) - {'reservation', 'rrule', 'exdate', 'tzid'}, set(elements[1].keys()))
+
+    def test_reserve(self):
+        self.assertEqual(optimal_space_data, process_reservation_stream(make_stream(test_data)))
+        for placement in ('first_fit', 'worst_fit'):
+            self.assertEqual(process_reservation_request(test_data, placement),
+                             process_reservation_stream(make_stream(test_data), placement))
+
+    def test_optimize(self):
+        expected = {element['id']: element['predmet'] for element in optimize(test_data)['winstrom']['udalost']}
+        result = optimize_stream(make_stream(test_data))
+        self.assertEqual(expected, {element['id']: element['predmet'] for element in result['winstrom']['udalost']})
+
+
+if __name__ == '__main__':
+    unittest.main()
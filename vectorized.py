@@ -0,0 +1,69 @@
+import numpy as np
+
+# spot index is kept in the bits above the time, so that one sorted array holds reservations of all spots
+TIME_BITS = 40
+TIME_LIMIT = (1 << TIME_BITS) - 1
+INFINITY = np.iinfo(np.int64).max
+
+
+class SpotArrays:
+    """Reservations of all parking spots of a timetable in NumPy arrays sorted by spot and start time.
+
+    The arrays are a snapshot, they have to be built again when the timetable changes"""
+
+    def __init__(self, timetable):
+        self.parking_spots = list(timetable.parking_spots)
+        counts = np.array([len(spot.starts) for spot in self.parking_spots], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.is_empty = counts == 0
+        self.is_reservable = np.array([spot.is_reservable for spot in self.parking_spots], dtype=bool)
+        # one more element at the end, so that the neighbours can be read without checking the bounds
+        self.starts = np.concatenate([np.asarray(spot.starts, dtype=np.int64) for spot in self.parking_spots] + [[0]])
+        self.ends = np.concatenate([np.asarray(spot.ends, dtype=np.int64) for spot in self.parking_spots] + [[0]])
+        self.base = int(self.starts[:-1].min()) if len(self.starts) > 1 else 0
+        self.spot_keys = np.arange(len(self.parking_spots), dtype=np.int64) << TIME_BITS
+        self.keys = np.repeat(self.spot_keys, counts) + (self.starts[:-1] - self.base)
+
+    def get_windows(self, starts, ends):
+        """Return the windows between the requests [starts, ends) and the neighbouring reservations on every spot, one
+        row per request. Window is INFINITY where the request does not fit or the spot has no reservations"""
+        starts = np.asarray(starts, dtype=np.int64)[:, None]
+        ends = np.asarray(ends, dtype=np.int64)[:, None]
+        positions = np.searchsorted(self.keys, self.spot_keys + np.clip(ends - self.base, 0, TIME_LIMIT))
+        has_previous = positions > self.offsets[:-1]
+        has_next = positions < self.offsets[1:]
+        previous_ends = self.ends[positions - 1]
+        next_starts = self.starts[positions]
+
+        fits = ~has_previous | (previous_ends <= starts)
+        windows = np.minimum(np.where(has_previous, starts - previous_ends, INFINITY),
+                             np.where(has_next, next_starts - ends, INFINITY))
+        return np.where(fits & self.is_reservable & ~self.is_empty, windows, INFINITY)
+
+    def get_free_spots(self, start, end):
+        """Return a mask of the reservable spots where the interval [start, end) fits"""
+        windows = self.get_windows([start], [end])[0]
+        return (windows < INFINITY) | (self.is_reservable & self.is_empty)
+
+    def get_minimal_window_indexes(self, starts, ends):
+        """Return index of the spot with the minimal window for every request, -1 where there is no free spot. Same
+        rules as get_minimal_window_parking_spot, a spot without reservations is used only if no other spot fits"""
+        windows = self.get_windows(starts, ends)
+        best = np.argmin(windows, axis=1)
+        empty_spots = np.flatnonzero(self.is_reservable & self.is_empty)
+        fallback = empty_spots[0] if len(empty_spots) else -1
+        return np.where(windows[np.arange(len(best)), best] < INFINITY, best, fallback)
+
+    def get_minimal_window_parking_spot(self, request):
+        """Return the parking spot with the minimal window for a single request, None if there is no free spot"""
+        idx = self.get_minimal_window_indexes([request.start], [request.end])[0]
+        return self.parking_spots[idx] if idx >= 0 else None
+
+    def get_minimal_window_parking_spots(self, requests):
+        """Score a list of requests against all spots at once. The requests are scored independently, none of them
+        is added to the timetable. Return the best parking spot (or None) for every request"""
+        if not requests:
+            return []
+        indexes = self.get_minimal_window_indexes([request.start for request in requests],
+                                                  [request.end for request in requests])
+        return [self.parking_spots[idx] if idx >= 0 else None for idx in indexes]
@@ -0,0 +1,30 @@
+import unittest
+from reservation import Timetable, TimeSlot, get_minimal_window_parking_spot
+from reservation_unittest import test_data, make_random_timetable
+from vectorized import SpotArrays
+
+
+class SpotArraysTestCase(unittest.TestCase):
+    def test_same_as_minimal_window(self):
+        for seed in range(10):
+            timetable = make_random_timetable(seed)
+            spot_arrays = SpotArrays(timetable)
+            requests = [TimeSlot(str(start), "code:admin", start, start + 60) for start in range(-60, 1500, 15)]
+            expected = [get_minimal_window_parking_spot(timetable, request) for request in requests]
+            self.assertEqual(expected, spot_arrays.get_minimal_window_parking_spots(requests))
+            self.assertEqual(expected[10], spot_arrays.get_minimal_window_parking_spot(requests[10]))
+
+    def test_free_spots(self):
+        timetable = Timetable(test_data['winstrom']['udalost'], test_data)
+        spot_arrays = SpotArrays(timetable)
+        start, end = timetable.parking_spots[0].starts[0], timetable.parking_spots[0].ends[0]
+        self.assertEqual([False] + [True] * 19, list(spot_arrays.get_free_spots(start, end)))
+        self.assertTrue(all(spot_arrays.get_free_spots(end, end + 60)))
+
+    def test_empty_timetable(self):
+        spot_arrays = SpotArrays(Timetable())
+        self.assertEqual("101", spot_arrays.get_minimal_window_parking_spot(TimeSlot("1", "code:admin", 0, 60)).name)
+
+
+if __name__ == '__main__':
+    unittest.main()